@@ -0,0 +1,322 @@
+import json
+import random
+import re
+import time
+from dataclasses import dataclass, field
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from typing import Any, Dict, List, Tuple
+from urllib.parse import parse_qs, urlparse
+
+API_PREFIX: str = "/wp-json/wc/v3"
+
+
+@dataclass
+class FakeShop:
+    """In-memory woocommerce data"""
+
+    orders: Dict[int, Dict[str, Any]] = field(default_factory=dict)
+    products: Dict[int, Dict[str, Any]] = field(default_factory=dict)
+    coupons: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    telegram_messages: List[Dict[str, Any]] = field(default_factory=list)
+    lock: Lock = field(default_factory=Lock)
+
+    @classmethod
+    def generate(
+        cls,
+        *,
+        orders_count: int,
+        product_files: List[List[str]],
+        seed: int = 42,
+    ) -> "FakeShop":
+        """Generate synthetic shop
+
+        Args:
+            orders_count (int): processing orders count
+            product_files (List[List[str]]): downloads of every product
+            seed (int, optional): random seed. Defaults to 42.
+
+        Returns:
+            FakeShop: shop
+        """
+        rnd = random.Random(seed)
+        shop = cls()
+        for product_id, files in enumerate(product_files, start=1):
+            shop.products[product_id] = {
+                "id": product_id,
+                "name": f"Product {product_id}",
+                "purchase_note": f"Note for product {product_id}",
+                "downloads": [{"file": file_name} for file_name in files],
+                "date_modified_gmt": "2024-01-01T00:00:00",
+            }
+        for order_id in range(1, orders_count + 1):
+            line_items = [
+                {"product_id": product_id, "name": f"Product {product_id}"}
+                for product_id in rnd.sample(
+                    sorted(shop.products), k=min(len(shop.products), rnd.randint(1, 3))
+                )
+            ]
+            shop.orders[order_id] = {
+                "id": order_id,
+                "status": "processing",
+                "total": str(rnd.choice((500, 1500, 3000))),
+                "date_modified_gmt": time.strftime(
+                    "%Y-%m-%dT%H:%M:%S", time.gmtime(1_700_000_000 + order_id)
+                ),
+                "billing": {
+                    "email": f"customer{order_id}@example.com",
+                    "first_name": "Иван",
+                    "last_name": f"Покупатель{order_id}",
+                },
+                "line_items": line_items,
+                "meta_data": [{"key": "_note", "value": "x" * 256}],
+            }
+        return shop
+
+
+class FakeWoocommerceServer:
+    """Local woocommerce rest api and telegram bot api stand-in
+
+    Supports orders with pagination, products, coupons, batch endpoints
+    and a configurable latency of every request"""
+
+    def __init__(
+        self,
+        *,
+        shop: FakeShop,
+        latency: float = 0.0,
+        default_per_page: int = 10,
+    ) -> None:
+        self.shop: FakeShop = shop
+        self.latency: float = latency
+        self.default_per_page: int = default_per_page
+        self.requests_count: Dict[str, int] = {}
+        self.server: ThreadingHTTPServer = ThreadingHTTPServer(
+            ("127.0.0.1", 0), self._make_request_handler()
+        )
+        self.thread: Thread = Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    def __enter__(self) -> "FakeWoocommerceServer":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _count(self, key: str) -> None:
+        with self.shop.lock:
+            self.requests_count[key] = self.requests_count.get(key, 0) + 1
+
+    def _paginate(
+        self, items: List[Dict[str, Any]], query: Dict[str, str]
+    ) -> Tuple[List[Dict[str, Any]], Dict[str, str]]:
+        per_page = int(query.get("per_page", self.default_per_page))
+        page = int(query.get("page", 1))
+        total_pages = max(1, -(-len(items) // per_page))
+        headers = {"X-WP-Total": str(len(items)), "X-WP-TotalPages": str(total_pages)}
+        return items[(page - 1) * per_page : page * per_page], headers
+
+    @staticmethod
+    def _fields(items: List[Dict[str, Any]], query: Dict[str, str]):
+        """Filter items like WordPress does, nested fields are dotted"""
+        if "_fields" not in query:
+            return items
+
+        def pick(value: Any, paths: List[List[str]]) -> Any:
+            if isinstance(value, list):
+                return [pick(item, paths) for item in value]
+            if any(not path for path in paths) or not isinstance(value, dict):
+                return value
+            picked: Dict[str, Any] = {}
+            for key in dict.fromkeys(path[0] for path in paths):
+                if key in value:
+                    picked[key] = pick(
+                        value[key], [path[1:] for path in paths if path[0] == key]
+                    )
+            return picked
+
+        paths = [field.split(".") for field in query["_fields"].split(",")]
+        return [pick(item, paths) for item in items]
+
+    def get(self, path: str, query: Dict[str, str]):
+        shop = self.shop
+        if path == "/orders":
+            with shop.lock:
+                orders = [
+                    order
+                    for order in shop.orders.values()
+                    if order["status"] == query.get("status", order["status"])
+                ]
+            if "include" in query:
+                ids = {int(order_id) for order_id in query["include"].split(",")}
+                orders = [order for order in orders if order["id"] in ids]
+            if query.get("exclude"):
+                ids = {int(order_id) for order_id in query["exclude"].split(",")}
+                orders = [order for order in orders if order["id"] not in ids]
+            if "modified_after" in query:
+                orders = [
+                    order
+                    for order in orders
+                    if order["date_modified_gmt"] > query["modified_after"]
+                ]
+            if "search" in query:
+                orders = [
+                    order
+                    for order in orders
+                    if query["search"] in json.dumps(order, ensure_ascii=False)
+                ]
+            if query.get("orderby") == "modified":
+                orders.sort(key=lambda order: (order["date_modified_gmt"], order["id"]))
+            page, headers = self._paginate(orders, query)
+            return HTTPStatus.OK, self._fields(page, query), headers
+        if path == "/products":
+            products = list(shop.products.values())
+            if "include" in query:
+                ids = {int(product_id) for product_id in query["include"].split(",")}
+                products = [product for product in products if product["id"] in ids]
+            if "modified_after" in query:
+                products = [
+                    product
+                    for product in products
+                    if product["date_modified_gmt"] > query["modified_after"]
+                ]
+            page, headers = self._paginate(products, query)
+            return HTTPStatus.OK, self._fields(page, query), headers
+        if match := re.fullmatch(r"/products/(\d+)", path):
+            product = shop.products.get(int(match[1]))
+            if product is None:
+                return HTTPStatus.NOT_FOUND, {"code": "not_found"}, {}
+            return HTTPStatus.OK, product, {}
+        return HTTPStatus.NOT_FOUND, {"code": "rest_no_route"}, {}
+
+    def _create_coupon(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        with self.shop.lock:
+            if data["code"] in self.shop.coupons:
+                return {
+                    "id": 0,
+                    "error": {"code": "woocommerce_rest_coupon_code_already_exists"},
+                }
+            coupon = {"id": len(self.shop.coupons) + 1, **data}
+            self.shop.coupons[data["code"]] = coupon
+            return coupon
+
+    def _update_order(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        with self.shop.lock:
+            order = self.shop.orders.get(int(data["id"]))
+            if order is None:
+                return {
+                    "id": data["id"],
+                    "error": {"code": "woocommerce_rest_shop_order_invalid_id"},
+                }
+            order.update({key: value for key, value in data.items() if key != "id"})
+            order["date_modified_gmt"] = time.strftime(
+                "%Y-%m-%dT%H:%M:%S", time.gmtime()
+            )
+            return order
+
+    def write(self, method: str, path: str, query: Dict[str, str], data: Any):
+        if path == "/coupons":
+            return (
+                HTTPStatus.CREATED,
+                self._create_coupon({**query, **(data or {})}),
+                {},
+            )
+        if path == "/coupons/batch":
+            return (
+                HTTPStatus.OK,
+                {
+                    "create": [
+                        self._create_coupon(item) for item in data.get("create", [])
+                    ]
+                },
+                {},
+            )
+        if path == "/orders/batch":
+            return (
+                HTTPStatus.OK,
+                {
+                    "update": [
+                        self._update_order(item) for item in data.get("update", [])
+                    ]
+                },
+                {},
+            )
+        if match := re.fullmatch(r"/orders/(\d+)", path):
+            return HTTPStatus.OK, self._update_order({"id": match[1], **query}), {}
+        if re.fullmatch(r"/bot[^/]+/sendMessage", path):
+            message = {**query, **(data or {})}
+            with self.shop.lock:
+                self.shop.telegram_messages.append(message)
+            return (
+                HTTPStatus.OK,
+                {
+                    "ok": True,
+                    "result": {
+                        "message_id": len(self.shop.telegram_messages),
+                        "date": int(time.time()),
+                        "chat": {
+                            "id": int(message.get("chat_id", 0)),
+                            "type": "private",
+                        },
+                        "text": message.get("text", ""),
+                    },
+                },
+                {},
+            )
+        return HTTPStatus.NOT_FOUND, {"code": "rest_no_route"}, {}
+
+    def _make_request_handler(self) -> type:
+        fake = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args) -> None:
+                pass
+
+            def _handle(self, method: str) -> None:
+                if fake.latency:
+                    time.sleep(fake.latency)
+                url = urlparse(self.path)
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                path = url.path.removeprefix(API_PREFIX)
+                fake._count(f"{method} {re.sub(r'/[0-9]+$', '/{id}', path)}")
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                data = None
+                if body:
+                    try:
+                        data = json.loads(body)
+                    except ValueError:
+                        data = {
+                            key: values[0]
+                            for key, values in parse_qs(body.decode()).items()
+                        }
+                if method == "GET" and not path.startswith("/bot"):
+                    status, payload, headers = fake.get(path, query)
+                else:
+                    status, payload, headers = fake.write(method, path, query, data)
+                response = json.dumps(payload, ensure_ascii=False).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(response)))
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(response)
+
+            def do_GET(self) -> None:
+                self._handle("GET")
+
+            def do_POST(self) -> None:
+                self._handle("POST")
+
+            def do_PUT(self) -> None:
+                self._handle("PUT")
+
+        return RequestHandler
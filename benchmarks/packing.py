@@ -0,0 +1,177 @@
+"""Attachment packing over realistic product catalogs
+
+Generates orders of a catalog with typical product files sizes and
+compares emails count, rejected (too large after encoding) emails
+and packing time of the attachment packer and the previous
+binpacking split with raw sizes and 0.8 fill factor. Files which
+don't fit into an email even alone are counted apart.
+
+    python -m benchmarks.packing --orders 2000
+"""
+
+import argparse
+import random
+import time
+from math import ceil
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from benchmarks.run import store_result
+from models.order import ProductFile
+from services.attachment_packer import (
+    BODY_OVERHEAD_FACTOR,
+    MESSAGE_HEADERS_SIZE,
+    AttachmentPacker,
+    part_size,
+)
+
+MB: int = 1024 * 1024
+MAX_MESSAGE_SIZE: int = 20 * MB
+BODY_SIZE: int = 20 * 1024
+
+# catalog profile: files per product and lognormal size parameters
+CATALOGS: Dict[str, Dict[str, Any]] = {
+    # worksheets and presentations, mostly a few MB
+    "materials": {"products": 300, "files": (1, 4), "mu": 0.5, "sigma": 1.0},
+    # video lessons and scans, a part is larger than an email
+    "courses": {"products": 60, "files": (2, 8), "mu": 1.3, "sigma": 0.8},
+}
+
+
+def generate_orders(
+    *, catalog: str, orders_count: int, seed: int = 42
+) -> List[List[ProductFile]]:
+    """Generate files of orders
+
+    Args:
+        catalog (str): catalog profile
+        orders_count (int): orders count
+        seed (int, optional): random seed. Defaults to 42.
+
+    Returns:
+        List[List[ProductFile]]: files of every order
+    """
+    rnd = random.Random(seed)
+    profile = CATALOGS[catalog]
+    products: List[List[ProductFile]] = []
+    for product_id in range(profile["products"]):
+        products.append(
+            [
+                ProductFile(
+                    file_name=f"/srv/files/product_{product_id}_{file_index}.pdf",
+                    file_size=int(
+                        rnd.lognormvariate(profile["mu"], profile["sigma"]) * MB
+                    ),
+                    mime_type="application/pdf",
+                )
+                for file_index in range(rnd.randint(*profile["files"]))
+            ]
+        )
+    return [
+        [
+            file
+            for product in rnd.sample(products, rnd.choice((1, 1, 1, 2, 2, 3, 5)))
+            for file in product
+        ]
+        for _ in range(orders_count)
+    ]
+
+
+def message_size(files: List[ProductFile]) -> int:
+    return (
+        MESSAGE_HEADERS_SIZE
+        + BODY_SIZE * BODY_OVERHEAD_FACTOR
+        + sum(part_size(file) for file in files)
+    )
+
+
+def pack_with_packer(files: List[ProductFile]) -> List[List[ProductFile]]:
+    packing = AttachmentPacker(
+        max_message_size=MAX_MESSAGE_SIZE, body_size=BODY_SIZE
+    ).pack(files)
+    return packing.packs
+
+
+def pack_with_binpacking(files: List[ProductFile]) -> List[List[ProductFile]]:
+    import binpacking
+
+    if sum(file.file_size for file in files) <= MAX_MESSAGE_SIZE:
+        return [files]
+    files_by_name = {file.file_name: file for file in files}
+    bins = binpacking.to_constant_volume(
+        d={file.file_name: file.file_size for file in files},
+        V_max=int(MAX_MESSAGE_SIZE * 0.8),
+    )
+    return [[files_by_name[file_name] for file_name in bin] for bin in bins]
+
+
+def measure(
+    orders: List[List[ProductFile]],
+    pack: Callable[[List[ProductFile]], List[List[ProductFile]]],
+) -> Dict[str, Any]:
+    emails = rejected = 0
+    started = time.perf_counter()
+    packs_by_order = [pack(files) for files in orders]
+    seconds = time.perf_counter() - started
+    for packs in packs_by_order:
+        emails += len(packs)
+        rejected += sum(1 for pack in packs if message_size(pack) > MAX_MESSAGE_SIZE)
+    return {
+        "emails": emails,
+        "rejected": rejected,
+        "ms_per_order": round(seconds * 1000 / len(orders), 4),
+    }
+
+
+def lower_bound(orders: List[List[ProductFile]]) -> Tuple[int, int]:
+    """Minimum emails count and count of files larger than an email"""
+    capacity = (
+        MAX_MESSAGE_SIZE - MESSAGE_HEADERS_SIZE - BODY_SIZE * BODY_OVERHEAD_FACTOR
+    )
+    emails = oversized = 0
+    for files in orders:
+        sizes = [part_size(file) for file in files]
+        oversized += sum(1 for size in sizes if size > capacity)
+        emails += ceil(sum(size for size in sizes if size <= capacity) / capacity)
+    return emails, oversized
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--orders", type=int, default=2000)
+    parser.add_argument("--catalog", choices=CATALOGS, action="append")
+    args = parser.parse_args(argv)
+    for catalog in args.catalog or list(CATALOGS):
+        orders = generate_orders(catalog=catalog, orders_count=args.orders)
+        lower_bound_emails, oversized_files = lower_bound(orders)
+        result: Dict[str, Any] = {
+            "scenario": f"packing-{catalog}",
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "orders": args.orders,
+            "lower_bound_emails": lower_bound_emails,
+            "oversized_files": oversized_files,
+            "packer": measure(orders, pack_with_packer),
+        }
+        try:
+            result["binpacking"] = measure(orders, pack_with_binpacking)
+        except ImportError:
+            result["binpacking"] = None
+        previous = store_result(result)
+        print(f"== {result['scenario']} ({args.orders} orders)")
+        print(f"{'lower bound emails':>20}: {result['lower_bound_emails']}")
+        print(f"{'oversized files':>20}: {result['oversized_files']}")
+        for packer in ("packer", "binpacking"):
+            if result[packer] is None:
+                print(f"{packer:>20}: binpacking is not installed")
+                continue
+            change = ""
+            if previous and previous.get(packer):
+                change = f" (was {previous[packer]['emails']})"
+            print(
+                f"{packer:>20}: {result[packer]['emails']} emails{change}, "
+                f"{result[packer]['rejected']} rejected, "
+                f"{result[packer]['ms_per_order']} ms/order"
+            )
+
+
+if __name__ == "__main__":
+    main()
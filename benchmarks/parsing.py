@@ -0,0 +1,138 @@
+"""Orders page parsing: memory and time
+
+Compares the previous parsing (whole response with json.loads and
+pydantic models) with the streaming parser and slotted order records
+on pages with large meta_data, as WooCommerce returns without _fields.
+
+    python -m benchmarks.parsing --orders 5000
+"""
+
+import argparse
+import codecs
+import json
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional
+
+from benchmarks.run import store_result
+from models.order import Order
+from utils.json_stream import iter_json_array
+
+CHUNK_SIZE: int = 64 * 1024
+
+
+def generate_page(*, orders_count: int, meta_size: int) -> bytes:
+    orders: List[Dict[str, Any]] = [
+        {
+            "id": order_id,
+            "status": "processing",
+            "total": "1500.00",
+            "date_modified_gmt": "2024-01-01T00:00:00",
+            "billing": {
+                "email": f"customer{order_id}@example.com",
+                "first_name": "Иван",
+                "last_name": f"Покупатель{order_id}",
+                "address_1": "ул. Ленина, 1",
+            },
+            "line_items": [
+                {
+                    "product_id": product_id,
+                    "name": f"Product {product_id}",
+                    "meta_data": [{"key": "_reduced_stock", "value": "1"}],
+                }
+                for product_id in range(1, order_id % 3 + 2)
+            ],
+            "meta_data": [
+                {"key": f"_meta_{index}", "value": "x" * (meta_size // 8)}
+                for index in range(8)
+            ],
+        }
+        for order_id in range(1, orders_count + 1)
+    ]
+    return json.dumps(orders, ensure_ascii=False).encode()
+
+
+def parse_with_pydantic(body: bytes) -> List[Any]:
+    from pydantic import BaseModel
+
+    class Product(BaseModel):
+        name: str = ""
+        purchase_note: str = ""
+
+    class PydanticOrder(BaseModel):
+        id: str
+        total: float
+        email: str
+        first_name: str
+        last_name: str
+        products: List[Product] = []
+
+    items = json.loads(body)
+    return [
+        PydanticOrder(
+            id=item["id"],
+            total=item["total"],
+            email=item["billing"]["email"],
+            first_name=item["billing"]["first_name"],
+            last_name=item["billing"]["last_name"],
+            products=[Product(name=product["name"]) for product in item["line_items"]],
+        )
+        for item in items
+    ]
+
+
+def parse_streaming(body: bytes) -> List[Any]:
+    # the body is read by chunks like response.iter_content does
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    chunks = (
+        decoder.decode(body[start : start + CHUNK_SIZE])
+        for start in range(0, len(body), CHUNK_SIZE)
+    )
+    return [Order.from_api(item) for item in iter_json_array(chunks)]
+
+
+def measure(body: bytes, parse: Callable[[bytes], List[Any]]) -> Dict[str, Any]:
+    tracemalloc.start()
+    started = time.perf_counter()
+    orders = parse(body)
+    seconds = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "orders": len(orders),
+        "ms": round(seconds * 1000, 1),
+        "peak_mb": round(peak / 1024 / 1024, 1),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--orders", type=int, default=5000)
+    parser.add_argument(
+        "--meta-size", type=int, default=4096, help="order meta_data size, bytes"
+    )
+    args = parser.parse_args(argv)
+    body = generate_page(orders_count=args.orders, meta_size=args.meta_size)
+    result: Dict[str, Any] = {
+        "scenario": "parsing",
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "orders": args.orders,
+        "body_mb": round(len(body) / 1024 / 1024, 1),
+        "pydantic": measure(body, parse_with_pydantic),
+        "streaming": measure(body, parse_streaming),
+    }
+    previous = store_result(result)
+    print(f"== parsing ({args.orders} orders, {result['body_mb']} MB)")
+    for parser_name in ("pydantic", "streaming"):
+        stats = result[parser_name]
+        change = ""
+        if previous and previous.get(parser_name):
+            change = f" (was {previous[parser_name]['ms']} ms)"
+        print(
+            f"{parser_name:>20}: {stats['ms']} ms{change}, "
+            f"peak {stats['peak_mb']} MB"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+"""Offline end-to-end benchmark of the real main() pipeline
+
+Runs main() against a local fake woocommerce (with telegram bot api)
+and a local SMTP sink, reports orders/sec, bytes/sec, wall time per
+stage and peak RSS and stores results for comparison across runs.
+
+    python -m benchmarks.run --orders 100 --attachments small
+    python -m benchmarks.run --suite
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from functools import wraps
+from pathlib import Path
+from threading import Lock
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+ROOT: Path = Path(__file__).resolve().parent.parent
+RESULTS_DIR: Path = ROOT / "benchmarks" / "results"
+
+# attachments profile: products count, files per product, file size
+ATTACHMENTS: Dict[str, Tuple[int, int, int]] = {
+    "small": (20, 2, 200 * 1024),
+    "mixed": (10, 2, 8 * 1024 * 1024),
+    "large": (2, 1, 100 * 1024 * 1024),
+}
+SUITE: Tuple[Tuple[int, str], ...] = (
+    (1, "small"),
+    (100, "small"),
+    (5000, "small"),
+    (1, "large"),
+    (100, "large"),
+)
+NO_RATE_LIMIT: Dict[str, Any] = {
+    "messages_per_minute": 10**9,
+    "bytes_per_hour": 10**15,
+    "burst_size": 10**9,
+}
+
+
+class StageTimer:
+    """Wall time and calls count of instrumented methods"""
+
+    def __init__(self) -> None:
+        self.lock: Lock = Lock()
+        self.stages: Dict[str, Dict[str, float]] = {}
+
+    def wrap(self, stage: str, owner: type, method_name: str) -> None:
+        method: Callable = getattr(owner, method_name)
+
+        @wraps(method)
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                with self.lock:
+                    stats = self.stages.setdefault(stage, {"seconds": 0.0, "calls": 0})
+                    stats["seconds"] += elapsed
+                    stats["calls"] += 1
+
+        setattr(owner, method_name, timed)
+
+    def install(self) -> None:
+        from services.coupon_creater import CouponCreater
+        from services.order_closer import OrderCloser
+        from services.orders_handler import OrdersHandler
+        from services.rate_limiter import SendRateLimiter
+        from services.smtp_session import SmtpSession
+        from services.telegram_noticifier import TelegramNoticifier
+        from services.woocommerce_fetcher import WoocommerceFetcher
+
+        self.wrap("woocommerce_get", WoocommerceFetcher, "_fetch_wc_response")
+        self.wrap("products", WoocommerceFetcher, "_get_products_info")
+        self.wrap("coupons", CouponCreater, "_upload_coupons")
+        self.wrap("order_info", OrdersHandler, "_get_order_info")
+        self.wrap("smtp_prepare", SmtpSession, "prepare")
+        self.wrap("smtp_send", SmtpSession, "sendmail")
+        self.wrap("throttle", SendRateLimiter, "acquire")
+        self.wrap("close_orders", OrderCloser, "_close_batch")
+        self.wrap("telegram", TelegramNoticifier, "send_result_to_telegram")
+
+
+def generate_files(*, directory: Path, attachments: str) -> List[List[str]]:
+    """Create product files
+
+    Args:
+        directory (Path): files directory
+        attachments (str): attachments profile
+
+    Returns:
+        List[List[str]]: files of every product
+    """
+    products_count, files_per_product, file_size = ATTACHMENTS[attachments]
+    chunk = os.urandom(1024 * 1024)
+    product_files: List[List[str]] = []
+    for product_id in range(1, products_count + 1):
+        files: List[str] = []
+        for file_index in range(files_per_product):
+            path = directory / f"product_{product_id}_{file_index}.pdf"
+            with open(path, "wb") as f:
+                left = file_size
+                while left > 0:
+                    f.write(chunk[: min(left, len(chunk))])
+                    left -= len(chunk)
+            files.append(str(path))
+        product_files.append(files)
+    return product_files
+
+
+def configure_env(
+    *,
+    work_dir: Path,
+    wc_url: str,
+    smtp_port: int,
+    keep_rate_limits: bool,
+    links: bool = False,
+) -> None:
+    """Point settings to the stand-ins, must be done before app imports"""
+    os.environ.update(
+        {
+            "TELEGRAM_BOT_TOKEN": "0:benchmark",
+            "TELEGRAM_USERS_ID": '["1"]',
+            "TELEGRAM_API_URL": wc_url,
+            "WC_USER_KEY": "ck_benchmark",
+            "WC_SECRET_KEY": "cs_benchmark",
+            "WC_URL": wc_url,
+            "WC_DOWNLOAD_DIRS": json.dumps([str(work_dir / "files")]),
+            "WC_PRODUCTS_CACHE_PATH": str(work_dir / "cache" / "products.json"),
+            "WC_FILES_CATALOG_PATH": str(work_dir / "cache" / "files.json"),
+            "WC_ORDERS_CURSOR_PATH": str(work_dir / "cache" / "orders_cursor.json"),
+            "EMAIL_SENDER": "shop@example.com",
+            "EMAIL_PASSWORD": "benchmark",
+            "EMAIL_DISPLAY_NAME": "Benchmark",
+            "EMAIL_SMTP_SERVER": "127.0.0.1",
+            "EMAIL_SMTP_PORT": str(smtp_port),
+            "EMAIL_SMTP_SSL": "false",
+            "EMAIL_ATTACHMENTS_CACHE_DIR": str(work_dir / "cache" / "attachments"),
+            "COUPON_POOL_PATH": str(work_dir / "cache" / "coupons_pool.json"),
+            "JOURNAL_PATH": str(work_dir / "cache" / "journal.sqlite3"),
+            "WORKER_QUEUE_PATH": str(work_dir / "cache" / "work_queue.sqlite3"),
+            "METRICS_PATH": str(work_dir / "cache" / "metrics.prom"),
+        }
+    )
+    if links:
+        os.environ.update(
+            {
+                "LINK_BASE_URL": "https://shop.example.com/files",
+                "LINK_SECRET": "benchmark",
+                "LINK_STATIC_DIR": str(work_dir / "static"),
+            }
+        )
+    else:
+        os.environ["LINK_BASE_URL"] = ""
+    if not keep_rate_limits:
+        os.environ["EMAIL_RATE_LIMITS"] = json.dumps({"127.0.0.1": NO_RATE_LIMIT})
+
+
+def stub_web_fonts() -> None:
+    from premailer import Premailer
+
+    # template web fonts stylesheets are the only remaining network calls
+    Premailer._load_external_url = lambda self, url: ""
+
+
+def run_scenario(args: argparse.Namespace) -> Dict[str, Any]:
+    sys.path.insert(0, str(ROOT))
+    os.chdir(ROOT)
+    from benchmarks.fake_woocommerce import FakeShop, FakeWoocommerceServer
+    from benchmarks.smtp_sink import SmtpSink
+
+    with tempfile.TemporaryDirectory(prefix="wc-bench-") as tmp:
+        work_dir = Path(tmp)
+        (work_dir / "files").mkdir()
+        product_files = generate_files(
+            directory=work_dir / "files", attachments=args.attachments
+        )
+        shop = FakeShop.generate(orders_count=args.orders, product_files=product_files)
+        with FakeWoocommerceServer(
+            shop=shop, latency=args.latency
+        ) as fake, SmtpSink() as sink:
+            configure_env(
+                work_dir=work_dir,
+                wc_url=fake.url,
+                smtp_port=sink.port,
+                keep_rate_limits=args.keep_rate_limits,
+                links=args.links,
+            )
+            stub_web_fonts()
+            import main as app
+
+            timer = StageTimer()
+            timer.install()
+            started = time.perf_counter()
+            if args.workers:
+                app.main(["--mode", "worker", "--workers", str(args.workers)])
+            else:
+                app.main(["--engine", args.engine])
+            wall = time.perf_counter() - started
+            if args.metrics:
+                print(Path(os.environ["METRICS_PATH"]).read_text(encoding="utf-8"))
+
+        completed = sum(
+            1 for order in shop.orders.values() if order["status"] == "completed"
+        )
+        return {
+            "scenario": f"{args.orders}-{args.attachments}-{args.engine}"
+            + (f"-{args.workers}workers" if args.workers else "")
+            + ("-links" if args.links else ""),
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "orders": args.orders,
+            "attachments": args.attachments,
+            "engine": args.engine,
+            "workers": args.workers,
+            "latency": args.latency,
+            "completed_orders": completed,
+            "emails": sink.messages_count,
+            "smtp_connections": sink.connections_count,
+            "smtp_bytes": sink.bytes_count,
+            "wall_seconds": round(wall, 3),
+            "orders_per_second": round(completed / wall, 3) if wall else 0,
+            "bytes_per_second": round(sink.bytes_count / wall) if wall else 0,
+            "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+            "requests": fake.requests_count,
+            "stages": {
+                stage: {"seconds": round(stats["seconds"], 3), "calls": stats["calls"]}
+                for stage, stats in sorted(timer.stages.items())
+            },
+        }
+
+
+def store_result(result: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Append result to the scenario history
+
+    Returns:
+        Optional[Dict[str, Any]]: previous result of the same scenario
+    """
+    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    history_path = RESULTS_DIR / f"{result['scenario']}.jsonl"
+    previous = None
+    if history_path.exists():
+        lines = history_path.read_text(encoding="utf-8").splitlines()
+        previous = json.loads(lines[-1]) if lines else None
+    with open(history_path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(result) + "\n")
+    return previous
+
+
+def print_result(result: Dict[str, Any], previous: Optional[Dict[str, Any]]) -> None:
+    def delta(key: str) -> str:
+        if not previous or not previous.get(key):
+            return ""
+        return f" ({(result[key] - previous[key]) / previous[key]:+.1%})"
+
+    print(f"== {result['scenario']}")
+    for key in (
+        "completed_orders",
+        "emails",
+        "wall_seconds",
+        "orders_per_second",
+        "bytes_per_second",
+        "peak_rss_bytes",
+    ):
+        print(f"{key:>20}: {result[key]}{delta(key)}")
+    for stage, stats in result["stages"].items():
+        print(f"{stage:>20}: {stats['seconds']:.3f} s / {stats['calls']} calls")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--orders", type=int, default=100)
+    parser.add_argument("--attachments", choices=ATTACHMENTS, default="small")
+    parser.add_argument("--engine", choices=("sync", "async"), default="sync")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="run the worker mode with this processes count",
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.02, help="fake woocommerce latency, s"
+    )
+    parser.add_argument(
+        "--keep-rate-limits",
+        action="store_true",
+        help="throttle with the configured smtp rate limits",
+    )
+    parser.add_argument(
+        "--links", action="store_true", help="deliver large files by links"
+    )
+    parser.add_argument(
+        "--metrics", action="store_true", help="print the run metrics file"
+    )
+    parser.add_argument(
+        "--suite", action="store_true", help="run standard scenarios matrix"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    if args.suite:
+        # settings are read once per process, so every scenario runs apart
+        for orders, attachments in SUITE:
+            subprocess.run(
+                [
+                    sys.executable,
+                    "-m",
+                    "benchmarks.run",
+                    f"--orders={orders}",
+                    f"--attachments={attachments}",
+                    f"--engine={args.engine}",
+                    f"--latency={args.latency}",
+                ]
+                + (["--keep-rate-limits"] if args.keep_rate_limits else [])
+                + (["--links"] if args.links else [])
+                + ([f"--workers={args.workers}"] if args.workers else []),
+                cwd=ROOT,
+                check=True,
+            )
+        return
+    result = run_scenario(args)
+    print_result(result, store_result(result))
+
+
+if __name__ == "__main__":
+    main()
+elif __name__ == "__mp_main__":
+    # spawned worker processes import the benchmark as their main module
+    stub_web_fonts()
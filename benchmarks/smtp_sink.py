@@ -0,0 +1,77 @@
+import socketserver
+from threading import Lock, Thread
+
+
+class SmtpSink:
+    """Local plain SMTP server which accepts and drops every message
+
+    `drop_after_data` messages are read and then the connection
+    is closed without a reply, as a server which dies during DATA"""
+
+    def __init__(self, *, drop_after_data: int = 0) -> None:
+        self.drop_after_data: int = drop_after_data
+        self.lock: Lock = Lock()
+        self.messages_count: int = 0
+        self.bytes_count: int = 0
+        self.connections_count: int = 0
+        self.server: socketserver.ThreadingTCPServer = socketserver.ThreadingTCPServer(
+            ("127.0.0.1", 0), self._make_request_handler()
+        )
+        self.server.daemon_threads = True
+        self.thread: Thread = Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self.server.server_address[1]
+
+    def __enter__(self) -> "SmtpSink":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _make_request_handler(self) -> type:
+        sink = self
+
+        class RequestHandler(socketserver.StreamRequestHandler):
+            def _reply(self, line: str) -> None:
+                self.wfile.write(f"{line}\r\n".encode())
+
+            def _read_data(self) -> int:
+                size = 0
+                while line := self.rfile.readline():
+                    if line == b".\r\n":
+                        break
+                    size += len(line)
+                return size
+
+            def handle(self) -> None:
+                with sink.lock:
+                    sink.connections_count += 1
+                self._reply("220 sink ESMTP")
+                while line := self.rfile.readline():
+                    command = line.decode(errors="replace").strip().upper()
+                    if command.startswith(("EHLO", "HELO")):
+                        self.wfile.write(b"250-sink\r\n250-AUTH PLAIN LOGIN\r\n")
+                        self._reply("250 SIZE 0")
+                    elif command.startswith("AUTH"):
+                        self._reply("235 2.7.0 Authentication successful")
+                    elif command == "DATA":
+                        self._reply("354 End data with <CR><LF>.<CR><LF>")
+                        size = self._read_data()
+                        with sink.lock:
+                            sink.messages_count += 1
+                            sink.bytes_count += size
+                            is_dropped = sink.messages_count <= sink.drop_after_data
+                        if is_dropped:
+                            return
+                        self._reply("250 2.0.0 Ok: queued")
+                    elif command == "QUIT":
+                        self._reply("221 2.0.0 Bye")
+                        return
+                    else:
+                        self._reply("250 2.0.0 Ok")
+
+        return RequestHandler
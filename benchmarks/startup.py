@@ -0,0 +1,125 @@
+"""Startup time of an empty cron cycle
+
+Runs main.py in a fresh interpreter against the fake woocommerce
+without processing orders and reports wall time, import time and
+handling modules which were imported anyway. Results are stored
+next to the end-to-end ones.
+
+    python -m benchmarks.startup --runs 5
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from benchmarks.fake_woocommerce import FakeShop, FakeWoocommerceServer
+from benchmarks.run import ROOT, configure_env, store_result
+
+# modules needed only to handle orders
+HANDLING_MODULES: Tuple[str, ...] = (
+    "yagmail",
+    "jinja2",
+    "premailer",
+    "lxml",
+    "binpacking",
+    "transliterate",
+    "backoff",
+    "telebot",
+)
+
+
+def parse_importtime(stderr: str) -> Tuple[float, Set[str]]:
+    """Parse `python -X importtime` output
+
+    Args:
+        stderr (str): interpreter stderr
+
+    Returns:
+        Tuple[float, Set[str]]: total import seconds and imported modules
+    """
+    total_us: int = 0
+    modules: Set[str] = set()
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, module = line[len("import time:") :].split("|")
+        total_us += int(self_us)
+        modules.add(module.strip())
+    return total_us / 1_000_000, modules
+
+
+def run_once(env: Dict[str, str]) -> Tuple[float, float, Set[str]]:
+    started = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "main.py"],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    wall = time.perf_counter() - started
+    import_seconds, modules = parse_importtime(completed.stderr)
+    return wall, import_seconds, modules
+
+
+def run_startup(runs: int) -> Dict[str, Any]:
+    walls: List[float] = []
+    imports: List[float] = []
+    handling_modules: Set[str] = set()
+    with tempfile.TemporaryDirectory(prefix="wc-bench-") as tmp:
+        work_dir = Path(tmp)
+        (work_dir / "files").mkdir()
+        shop = FakeShop.generate(orders_count=0, product_files=[])
+        with FakeWoocommerceServer(shop=shop, latency=0.0) as fake:
+            configure_env(
+                work_dir=work_dir,
+                wc_url=fake.url,
+                smtp_port=25,
+                keep_rate_limits=True,
+            )
+            env = {**os.environ, "PYTHONWARNINGS": "ignore"}
+            for _ in range(runs):
+                wall, import_seconds, modules = run_once(env)
+                walls.append(wall)
+                imports.append(import_seconds)
+                handling_modules.update(
+                    module for module in modules if module in HANDLING_MODULES
+                )
+    return {
+        "scenario": "startup",
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "runs": runs,
+        "wall_seconds": round(statistics.median(walls), 3),
+        "min_wall_seconds": round(min(walls), 3),
+        "import_seconds": round(statistics.median(imports), 3),
+        "handling_modules": sorted(handling_modules),
+    }
+
+
+def print_result(result: Dict[str, Any], previous: Optional[Dict[str, Any]]) -> None:
+    print(f"== {result['scenario']} ({result['runs']} runs)")
+    for key in ("wall_seconds", "min_wall_seconds", "import_seconds"):
+        change = ""
+        if previous and previous.get(key):
+            change = f" ({(result[key] - previous[key]) / previous[key]:+.1%})"
+        print(f"{key:>20}: {result[key]}{change}")
+    print(f"{'handling_modules':>20}: {', '.join(result['handling_modules']) or '-'}")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args(argv)
+    result = run_startup(args.runs)
+    print_result(result, store_result(result))
+
+
+if __name__ == "__main__":
+    main()
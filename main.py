@@ -1,41 +1,316 @@
+import argparse
 import logging.config
-from typing import List
+import signal
+import tempfile
+from itertools import chain
+from typing import Dict, Iterator, List
 
 from models.order import Order
-from services.orders_handler import OrdersHandler
-from services.telegram_noticifier import TelegramNoticifier
+from services.file_catalog import FileCatalog
+from services.woocommerce_client import WoocommerceClient
 from services.woocommerce_fetcher import WoocommerceFetcher
+from utils.cassette import cassette
 from utils.config import AppSettings, get_settings
-from utils.logger import logger_config
+from utils.logger import get_logger_config
+from utils.metrics import metrics
+from utils.resilience import configure_resilience, resilience
 
 app_logger = logging.getLogger("app_logger")
 
 
-def main():
+ENGINES = ("sync", "async")
+MODES = ("once", "serve", "worker")
+
+
+def parse_args(argv: List[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="WooCommerce orders files sender")
+    parser.add_argument(
+        "--engine",
+        choices=ENGINES,
+        default="sync",
+        help="sync handles orders one by one, async runs stages concurrently",
+    )
+    parser.add_argument(
+        "--mode",
+        choices=MODES,
+        default="once",
+        help="once handles processing orders and exits (cron), "
+        "serve runs a daemon with a webhook receiver, "
+        "worker handles orders by worker processes with order leases",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="worker processes count for the worker mode, WORKER_WORKERS by default",
+    )
+    cassette_group = parser.add_mutually_exclusive_group()
+    cassette_group.add_argument(
+        "--record",
+        metavar="CASSETTE",
+        help="write woocommerce and smtp traffic to a cassette, e.g. run.jsonl.gz",
+    )
+    cassette_group.add_argument(
+        "--replay",
+        metavar="CASSETTE",
+        help="serve woocommerce and smtp traffic from a cassette, "
+        "journal, cursor and caches are kept in a temporary directory",
+    )
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="replay speed, 0 - don't wait for recorded durations",
+    )
+    args = parser.parse_args(argv)
+    if args.mode == "worker" and (args.record or args.replay):
+        parser.error("worker processes can't record or replay a cassette")
+    return args
+
+
+def state_files(app_settings: AppSettings) -> Dict[str, str]:
+    """Local state which defines requests of a run"""
+    return {
+        "orders_cursor": app_settings.woocommerce_settings.orders_cursor_path,
+        "products_cache": app_settings.woocommerce_settings.products_cache_path,
+    }
+
+
+def replay_settings(*, app_settings: AppSettings, state_dir: str) -> AppSettings:
+    """Settings of a replay run: recorded cursor and products cache
+    are restored into `state_dir`, the real journal and caches aren't touched
+
+    Args:
+        app_settings (AppSettings): settings
+        state_dir (str): temporary directory
+
+    Returns:
+        AppSettings: settings with state paths in `state_dir`
+    """
+    settings: AppSettings = app_settings.copy(
+        update={
+            "journal_path": f"{state_dir}/journal.sqlite3",
+            "metrics_path": f"{state_dir}/metrics.prom",
+            "woocommerce_settings": app_settings.woocommerce_settings.copy(
+                update={
+                    "orders_cursor_path": f"{state_dir}/orders_cursor.json",
+                    "products_cache_path": f"{state_dir}/products.json",
+                    # products revalidation depends on the wall clock
+                    "products_cache_ttl": 10 * 365 * 24 * 60 * 60,
+                }
+            ),
+            # coupons are created by the recorded batches only
+            "coupon_settings": app_settings.coupon_settings.copy(
+                update={"pool_size": 0, "pool_path": f"{state_dir}/coupons_pool.json"}
+            ),
+        }
+    )
+    for name, path in state_files(settings).items():
+        cassette.restore_state(name=name, path=path)
+    return settings
+
+
+def create_fetcher(
+    *, app_settings: AppSettings, wc_client: WoocommerceClient
+) -> WoocommerceFetcher:
+    return WoocommerceFetcher(
+        app_logger=app_logger,
+        woocommerce_settings=app_settings.woocommerce_settings,
+        wc_client=wc_client,
+        file_catalog=FileCatalog(
+            index_path=app_settings.woocommerce_settings.files_catalog_path,
+            download_dirs=app_settings.woocommerce_settings.download_dirs,
+            app_logger=app_logger,
+        ),
+        debug=app_settings.debug,
+    )
+
+
+def serve(*, app_settings: AppSettings, wc_client: WoocommerceClient) -> None:
+    from services.daemon import OrdersDaemon
+
+    daemon: OrdersDaemon = OrdersDaemon(
+        app_settings=app_settings,
+        wc_client=wc_client,
+        orders_fetcher=create_fetcher(app_settings=app_settings, wc_client=wc_client),
+        app_logger=app_logger,
+    )
+    signal.signal(signal.SIGTERM, lambda *_: daemon.stop())
     try:
-        logging.config.dictConfig(logger_config)
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
 
-        app_settings: AppSettings = get_settings()
-        orders_fetcher: WoocommerceFetcher = WoocommerceFetcher(
+
+def send_report(
+    *, app_settings: AppSettings, message: str, stage_seconds: Dict[str, float]
+) -> None:
+    """Send run result with stages timings to telegram,
+    replay results are only logged"""
+    timings: str = metrics.format_timings(since=stage_seconds)
+    if timings:
+        message = f"{message}\n{timings}"
+    if cassette.is_replaying:
+        app_logger.info("Replay result:\n%s", message)
+        return
+
+    from services.telegram_noticifier import TelegramNoticifier
+
+    telegram_noticifier: TelegramNoticifier = TelegramNoticifier(
+        app_logger=app_logger, settings=app_settings.telegram_settings
+    )
+    telegram_noticifier.send_result_to_telegram(message=message)
+    telegram_noticifier.close()
+
+
+def run(
+    *, app_settings: AppSettings, wc_client: WoocommerceClient, engine: str = "sync"
+) -> None:
+    orders_fetcher: WoocommerceFetcher = create_fetcher(
+        app_settings=app_settings, wc_client=wc_client
+    )
+    stage_seconds = metrics.stage_seconds()
+    orders: Iterator[Order] = orders_fetcher.iter_orders()
+
+    first_order: Order | None = next(orders, None)
+    if first_order is None:
+        orders_fetcher.commit_cursor(orders=[])
+        return
+
+    # handling modules pull yagmail, jinja2, premailer, transliterate etc.
+    # and are imported only when there are orders to handle
+    from services.orders_handler import OrdersHandler
+
+    orders_handler: OrdersHandler = OrdersHandler(
+        orders=chain((first_order,), orders),
+        app_logger=app_logger,
+        settings=app_settings,
+        wc_client=wc_client,
+    )
+    if engine == "async":
+        from services.async_pipeline import AsyncOrdersPipeline
+
+        result_message: str = AsyncOrdersPipeline(
+            orders=orders_handler.pending_orders,
+            orders_handler=orders_handler,
+            settings=app_settings.pipeline_settings,
             app_logger=app_logger,
-            woocommerce_settings=app_settings.woocommerce_settings,
-            debug=app_settings.debug,
-        )
-        orders: List[Order] = orders_fetcher.fetch_orders()
+        ).handle()
+    else:
+        result_message = orders_handler.handle()
+    if orders_handler.is_aborted:
+        # not handled orders are fetched again by the next run
+        app_logger.warning("Orders cursor is kept, handling was stopped")
+    else:
+        orders_fetcher.commit_cursor(orders=orders_handler.orders)
+    send_report(
+        app_settings=app_settings,
+        message=result_message,
+        stage_seconds=stage_seconds,
+    )
+
 
-        if not orders:
+def work(
+    *, app_settings: AppSettings, wc_client: WoocommerceClient, workers: int
+) -> None:
+    from services.work_queue import WorkQueue
+
+    settings = app_settings.worker_settings
+    orders_fetcher: WoocommerceFetcher = create_fetcher(
+        app_settings=app_settings, wc_client=wc_client
+    )
+    stage_seconds = metrics.stage_seconds()
+    queue: WorkQueue = WorkQueue(
+        path=settings.queue_path,
+        worker="main",
+        lease_seconds=settings.lease_seconds,
+        max_attempts=settings.max_attempts,
+    )
+    try:
+        if not queue.put(orders_fetcher.iter_orders()):
+            orders_fetcher.commit_cursor(orders=[])
             return
 
-        orders_handler: OrdersHandler = OrdersHandler(
-            orders=orders, app_logger=app_logger, settings=app_settings
+        from services.orders_handler import create_result_message
+        from services.workers import WorkerResult, run_workers
+
+        remaining: float = resilience.deadline.remaining()
+        result: WorkerResult = run_workers(
+            workers=workers,
+            app_logger=app_logger,
+            deadline=None if remaining == float("inf") else remaining,
         )
-        result_message: str = orders_handler.handle()
-        telegram_noticifier: TelegramNoticifier = TelegramNoticifier(
-            app_logger=app_logger, settings=app_settings.telegram_settings
+        handled_ids = {order.id for order in result.orders}
+        # orders leased by another run or left by a failed worker
+        # stay processing for the next cycle
+        unfinished: List[Order] = [
+            order for order in queue.unfinished() if order.id not in handled_ids
+        ]
+        orders_fetcher.commit_cursor(orders=result.orders + unfinished)
+    finally:
+        queue.close()
+    if not result.orders and not result.abort_reason:
+        return
+    send_report(
+        app_settings=app_settings,
+        message=create_result_message(
+            orders=result.orders,
+            throttled_seconds=result.throttled_seconds,
+            abort_reason=result.abort_reason,
+        ),
+        stage_seconds=stage_seconds,
+    )
+
+
+def main(argv: List[str] | None = None):
+    args: argparse.Namespace = parse_args(argv)
+    try:
+        app_settings: AppSettings = get_settings()
+        telegram_settings = app_settings.telegram_settings
+        if args.replay:
+            # replay logs stay local
+            telegram_settings = telegram_settings.copy(update={"users_id": []})
+        logging.config.dictConfig(get_logger_config(telegram_settings))
+        run_deadline: float = app_settings.resilience_settings.run_deadline
+        configure_resilience(
+            settings=app_settings.resilience_settings,
+            # the daemon runs forever, only its calls are limited
+            deadline=None if args.mode == "serve" else run_deadline or None,
         )
-        telegram_noticifier.send_result_to_telegram(message=result_message)
+        if args.record:
+            cassette.record(args.record, state_files=state_files(app_settings))
+        elif args.replay:
+            cassette.replay(args.replay, speed=args.speed)
+            state_dir: str = tempfile.mkdtemp(prefix="woo-sender-replay-")
+            app_logger.info("Replay %s, state is in %s", args.replay, state_dir)
+            app_settings = replay_settings(
+                app_settings=app_settings, state_dir=state_dir
+            )
+        with WoocommerceClient(settings=app_settings.woocommerce_settings) as wc_client:
+            if args.mode == "serve":
+                serve(app_settings=app_settings, wc_client=wc_client)
+            elif args.mode == "worker":
+                try:
+                    work(
+                        app_settings=app_settings,
+                        wc_client=wc_client,
+                        workers=args.workers or app_settings.worker_settings.workers,
+                    )
+                finally:
+                    metrics.write(app_settings.metrics_path)
+            else:
+                try:
+                    run(
+                        app_settings=app_settings,
+                        wc_client=wc_client,
+                        engine=args.engine,
+                    )
+                finally:
+                    metrics.write(app_settings.metrics_path)
     except Exception as ex:
         app_logger.exception("Everything is bad: %s", ex)
+    finally:
+        cassette.close()
 
 
 if __name__ == "__main__":
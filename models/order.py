@@ -1,24 +1,109 @@
-from typing import List
+import json
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List
 
-from pydantic import BaseModel
 
+class OrderValidationError(ValueError):
+    pass
 
-class ProductFile(BaseModel):
+
+def _require(data: Dict[str, Any], key: str) -> Any:
+    if not isinstance(data, dict) or key not in data or data[key] is None:
+        raise OrderValidationError(f"Field {key} is missing")
+    return data[key]
+
+
+def _as_str(value: Any, key: str) -> str:
+    if isinstance(value, (str, int)) and not isinstance(value, bool):
+        return str(value)
+    raise OrderValidationError(f"Field {key} is not a string: {value!r}")
+
+
+def _as_float(value: Any, key: str) -> float:
+    if isinstance(value, bool):
+        raise OrderValidationError(f"Field {key} is not a number: {value!r}")
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise OrderValidationError(f"Field {key} is not a number: {value!r}")
+
+
+@dataclass(slots=True)
+class ProductFile:
     file_name: str = ""
     file_size: int = 0
+    content_hash: str = ""
+    mime_type: str = ""
+    mtime: int = 0  # ns, catalog entry is checked by it when the file is read
 
 
-class Product(BaseModel):
+@dataclass(slots=True)
+class Product:
     name: str = ""
     purchase_note: str = ""
+    product_id: int = 0
 
 
-class Order(BaseModel):
+@dataclass(slots=True)
+class Order:
+    """Order record, woocommerce data is validated once by `from_api`,
+    then fields are trusted"""
+
     id: str
     total: float
     email: str
     first_name: str
     last_name: str
-    total_files: List[ProductFile] = []
+    total_files: List[ProductFile] = field(default_factory=list)
+    missing_files: List[str] = field(default_factory=list)
+    oversized_files: List[str] = field(default_factory=list)
     status: bool = False
-    products: List[Product] = []
+    products: List[Product] = field(default_factory=list)
+    date_modified: str = ""
+
+    @classmethod
+    def from_api(cls, order_info: Dict[str, Any]) -> "Order":
+        """Build order from woocommerce api data
+
+        Args:
+            order_info (Dict[str, Any]): order with ORDER_FIELDS
+
+        Raises:
+            OrderValidationError: required field is missing or has a wrong type
+
+        Returns:
+            Order: order with products without purchase notes
+        """
+        billing = _require(order_info, "billing")
+        line_items = _require(order_info, "line_items")
+        if not isinstance(line_items, list):
+            raise OrderValidationError("Field line_items is not a list")
+        return cls(
+            id=_as_str(_require(order_info, "id"), "id"),
+            total=_as_float(_require(order_info, "total"), "total"),
+            email=_as_str(_require(billing, "email"), "billing.email"),
+            first_name=_as_str(billing.get("first_name") or "", "billing.first_name"),
+            last_name=_as_str(billing.get("last_name") or "", "billing.last_name"),
+            products=[
+                Product(
+                    name=_as_str(_require(item, "name"), "line_items.name"),
+                    product_id=int(
+                        _as_float(_require(item, "product_id"), "line_items.product_id")
+                    ),
+                )
+                for item in line_items
+            ],
+            date_modified=_as_str(
+                order_info.get("date_modified_gmt") or "", "date_modified_gmt"
+            ),
+        )
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self), ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, payload: str) -> "Order":
+        data: Dict[str, Any] = json.loads(payload)
+        data["total_files"] = [ProductFile(**file) for file in data["total_files"]]
+        data["products"] = [Product(**product) for product in data["products"]]
+        return cls(**data)
@@ -0,0 +1,201 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Tuple
+
+from models.order import Order
+from services.coupon_creater import COUPONS_BATCH_SIZE
+from services.orders_handler import OrdersHandler
+from services.smtp_session import SmtpSession
+from utils.config import PipelineSettings
+from utils.resilience import ResilienceError
+
+# (order position, order, prepared order info)
+OrderJob = Tuple[int, Order, Dict[str, Any] | None]
+
+STAGE_DONE = None
+
+
+class AsyncOrdersPipeline:
+    """Run orders handling as stages connected by bounded queues
+
+    fetch (products are already fetched, coupons of every batch of orders)
+    -> prepare (order info) -> send -> close. Blocking stage functions of OrdersHandler run
+    in threads, each stage has its own workers count, so preparing and
+    closing later orders overlaps with smtp sending of earlier ones.
+    Every send worker has its own smtp session"""
+
+    def __init__(
+        self,
+        *,
+        orders: Iterable[Order],
+        orders_handler: OrdersHandler,
+        settings: PipelineSettings,
+        app_logger: logging.Logger,
+    ) -> None:
+        self.orders: Iterable[Order] = orders
+        self.orders_handler: OrdersHandler = orders_handler
+        self.settings: PipelineSettings = settings
+        self.app_logger: logging.Logger = app_logger
+        self.handled_orders: List[Tuple[int, Order]] = []
+
+    def handle(self) -> str:
+        """Sync entry point, same contract as OrdersHandler.handle
+
+        Returns:
+            str: result message
+        """
+        return asyncio.run(self._handle())
+
+    async def _handle(self) -> str:
+        settings = self.settings
+        executor = ThreadPoolExecutor(
+            max_workers=1
+            + settings.prepare_workers
+            + settings.send_workers
+            + settings.close_workers
+        )
+        asyncio.get_running_loop().set_default_executor(executor)
+        prepare_queue: asyncio.Queue = asyncio.Queue(maxsize=settings.queue_size)
+        send_queue: asyncio.Queue = asyncio.Queue(maxsize=settings.queue_size)
+        close_queue: asyncio.Queue = asyncio.Queue(maxsize=settings.queue_size)
+        if self.orders_handler.coupon_pool is not None:
+            self.orders_handler.coupon_pool.refill_in_background()
+        smtp_sessions: List[SmtpSession] = [
+            SmtpSession(
+                settings=self.orders_handler.settings.email_settings,
+                app_logger=self.app_logger,
+                attachment_cache=self.orders_handler.smtp_session.attachment_cache,
+            )
+            for _ in range(settings.send_workers)
+        ]
+        tasks = [
+            asyncio.create_task(self._fetch_stage(out_queue=prepare_queue)),
+            asyncio.create_task(
+                self._run_stage(
+                    in_queue=prepare_queue,
+                    out_queue=send_queue,
+                    workers=[self._prepare] * settings.prepare_workers,
+                )
+            ),
+            asyncio.create_task(
+                self._run_stage(
+                    in_queue=send_queue,
+                    out_queue=close_queue,
+                    workers=[
+                        self._make_sender(smtp_session=smtp_session)
+                        for smtp_session in smtp_sessions
+                    ],
+                )
+            ),
+            asyncio.create_task(
+                self._run_stage(
+                    in_queue=close_queue,
+                    out_queue=None,
+                    workers=[self._close] * settings.close_workers,
+                )
+            ),
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        except ResilienceError as ex:
+            for task in tasks:
+                task.cancel()
+            self.orders_handler.abort(ex)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        finally:
+            # cancelled tasks don't stop their threads, sends and journal
+            # writes in flight are finished before sessions and journal close
+            executor.shutdown(wait=True, cancel_futures=True)
+            self.orders_handler.flush_closer()
+            if self.orders_handler.coupon_pool is not None:
+                self.orders_handler.coupon_pool.wait()
+            for smtp_session in smtp_sessions:
+                smtp_session.close()
+            if self.orders_handler.owns_journal:
+                self.orders_handler.journal.close()
+
+        self.orders_handler.orders = [
+            order for _, order in sorted(self.handled_orders, key=lambda job: job[0])
+        ]
+        return self.orders_handler._create_result_message()
+
+    async def _fetch_stage(self, *, out_queue: asyncio.Queue) -> None:
+        orders = iter(self.orders)
+
+        def next_orders() -> List[Order]:
+            return list(islice(orders, COUPONS_BATCH_SIZE))
+
+        position = 0
+        while orders_batch := await asyncio.to_thread(next_orders):
+            # coupons of the batch are created with one request
+            await asyncio.to_thread(self.orders_handler._prepare_coupons, orders_batch)
+            for order in orders_batch:
+                await out_queue.put((position, order, None))
+                position += 1
+        await out_queue.put(STAGE_DONE)
+
+    async def _run_stage(
+        self,
+        *,
+        in_queue: asyncio.Queue,
+        out_queue: asyncio.Queue | None,
+        workers: List[Callable[[OrderJob], Awaitable[OrderJob | None]]],
+    ) -> None:
+        async def worker(process: Callable[[OrderJob], Awaitable[Any]]) -> None:
+            while True:
+                job = await in_queue.get()
+                if job is STAGE_DONE:
+                    # let sibling workers see the end of the stage too
+                    await in_queue.put(STAGE_DONE)
+                    return
+                next_job = await process(job)
+                if next_job is not None and out_queue is not None:
+                    await out_queue.put(next_job)
+
+        await asyncio.gather(*(worker(process) for process in workers))
+        if out_queue is not None:
+            await out_queue.put(STAGE_DONE)
+
+    async def _prepare(self, job: OrderJob) -> OrderJob:
+        position, order, _ = job
+        if order.missing_files:
+            # nothing to prepare, sending will fail the order
+            return job
+        if await asyncio.to_thread(self.orders_handler.journal.is_sent, order.id):
+            # sent by an interrupted run, it's only closed,
+            # no coupon is created and no email is rendered for it
+            return job
+        order_info = await asyncio.to_thread(
+            self.orders_handler._get_order_info, order=order
+        )
+        return position, order, order_info
+
+    def _make_sender(
+        self, *, smtp_session: SmtpSession
+    ) -> Callable[[OrderJob], Awaitable[OrderJob | None]]:
+        def send_order(
+            position: int, order: Order, order_info: Dict[str, Any] | None
+        ) -> bool:
+            order.status = False
+            is_sent = self.orders_handler._send_order_email(
+                order=order, order_info=order_info, smtp_session=smtp_session
+            )
+            # recorded by the thread, an order sent after the stage is
+            # cancelled gets to the report too, its status is set on closing
+            self.handled_orders.append((position, order))
+            return is_sent
+
+        async def send(job: OrderJob) -> OrderJob | None:
+            is_sent = await asyncio.to_thread(send_order, *job)
+            return job if is_sent else None
+
+        return send
+
+    async def _close(self, job: OrderJob) -> None:
+        _, order, _ = job
+        await asyncio.to_thread(self.orders_handler._close_order, order=order)
@@ -0,0 +1,175 @@
+import base64
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+from email.mime.base import MIMEBase
+from email.policy import SMTP
+from pathlib import Path
+from threading import Lock
+from typing import Dict, List
+
+from models.order import ProductFile
+
+# 57 bytes are encoded into one 76 chars base64 line
+ENCODE_CHUNK_SIZE: int = 57 * 1024
+HASH_CHUNK_SIZE: int = 1024 * 1024
+# parts are sent as bytes, smtplib doesn't fix their line endings,
+# so they are stored with CRLF, parts of older versions are not reused
+PART_VERSION: int = 2
+
+
+class AttachmentCache:
+    """Content-addressed cache of ready base64 encoded MIME parts
+
+    Parts are stored on disk by file content hash, content hash is
+    remembered by path, size and mtime, so a file is hashed and encoded
+    only once until it's changed. Parts and assembled messages have
+    CRLF line endings as they go to smtp as is"""
+
+    def __init__(self, *, cache_dir: str, app_logger: logging.Logger) -> None:
+        self.cache_dir: Path = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.index_path: Path = self.cache_dir / "index.json"
+        self.app_logger: logging.Logger = app_logger
+        self.lock: Lock = Lock()
+        self.index: Dict[str, Dict] = self._load_index()
+
+    def _load_index(self) -> Dict[str, Dict]:
+        if not self.index_path.exists():
+            return {}
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as ex:
+            self.app_logger.warning("Attachments index is broken, drop it: %s", ex)
+            return {}
+
+    def _save_index(self) -> None:
+        tmp_path = self.index_path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.index, f, ensure_ascii=False)
+        os.replace(tmp_path, self.index_path)
+
+    @staticmethod
+    def _hash_file(path: str) -> str:
+        file_hash = hashlib.sha256()
+        with open(path, "rb") as f:
+            while chunk := f.read(HASH_CHUNK_SIZE):
+                file_hash.update(chunk)
+        return file_hash.hexdigest()
+
+    def content_hash(self, path: str) -> str:
+        """Get file content hash, rehashing only changed files
+
+        Args:
+            path (str): file path
+
+        Returns:
+            str: sha256 hex digest
+        """
+        stat = os.stat(path)
+        with self.lock:
+            entry = self.index.get(path)
+        if (
+            entry is not None
+            and entry["size"] == stat.st_size
+            and entry["mtime"] == stat.st_mtime_ns
+        ):
+            return entry["hash"]
+        content_hash = self._hash_file(path)
+        with self.lock:
+            self.index[path] = {
+                "size": stat.st_size,
+                "mtime": stat.st_mtime_ns,
+                "hash": content_hash,
+            }
+            self._save_index()
+        return content_hash
+
+    @staticmethod
+    def part_headers(path: str, mime_type: str) -> bytes:
+        file_name = os.path.basename(path)
+        mime_type = (
+            mime_type
+            or mimetypes.guess_type(file_name)[0]
+            or "application/octet-stream"
+        )
+        part = MIMEBase(
+            *mime_type.split("/", 1), policy=SMTP, name=("utf-8", "", file_name)
+        )
+        part["Content-Transfer-Encoding"] = "base64"
+        part.add_header(
+            "Content-Disposition", "attachment", filename=("utf-8", "", file_name)
+        )
+        part.set_payload("")
+        return part.as_bytes()
+
+    def _part_path(self, path: str, content_hash: str) -> Path:
+        name_hash = hashlib.sha256(os.path.basename(path).encode()).hexdigest()[:8]
+        return (
+            self.cache_dir
+            / content_hash[:2]
+            / f"{content_hash}-{name_hash}.v{PART_VERSION}.part"
+        )
+
+    def _encode(self, file: ProductFile, part_path: Path) -> None:
+        part_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = part_path.with_suffix(f".{os.getpid()}.tmp")
+        with open(file.file_name, "rb") as source, open(tmp_path, "wb") as part:
+            part.write(self.part_headers(file.file_name, file.mime_type))
+            while chunk := source.read(ENCODE_CHUNK_SIZE):
+                part.write(base64.encodebytes(chunk).replace(b"\n", b"\r\n"))
+        os.replace(tmp_path, part_path)
+
+    @staticmethod
+    def _is_unchanged(file: ProductFile) -> bool:
+        # the files catalog trusts its index, a file rewritten in place
+        # is noticed only here, when it's read
+        stat = os.stat(file.file_name)
+        return stat.st_size == file.file_size and stat.st_mtime_ns == file.mtime
+
+    def get_part(self, file: ProductFile) -> bytes:
+        """Get encoded MIME part of file, encoding it on first use
+
+        Args:
+            file (ProductFile): file, its content hash is counted
+                if the files catalog has not provided it or the file
+                is changed since the catalog entry
+
+        Returns:
+            bytes: MIME part with headers and base64 body
+        """
+        content_hash = file.content_hash
+        if not content_hash or not self._is_unchanged(file):
+            content_hash = self.content_hash(file.file_name)
+        part_path = self._part_path(file.file_name, content_hash)
+        if not part_path.exists():
+            self._encode(file, part_path)
+        return part_path.read_bytes()
+
+    def attach(self, *, message: str, attachments: List[ProductFile]) -> bytes:
+        """Insert cached parts into multipart/mixed message
+
+        Args:
+            message (str): message with multipart/mixed root and no attachments
+            attachments (List[ProductFile]): files
+
+        Returns:
+            bytes: message with attachments and CRLF line endings
+        """
+        boundary_start = message.index('boundary="') + len('boundary="')
+        boundary = message[boundary_start : message.index('"', boundary_start)]
+        closing = f"--{boundary}--"
+        head = message[: message.rindex(closing)]
+        chunks: List[bytes] = [
+            head.replace("\r\n", "\n").replace("\n", "\r\n").encode("ascii")
+        ]
+        delimiter = f"--{boundary}\r\n".encode("ascii")
+        for file in attachments:
+            chunks.append(delimiter)
+            chunks.append(self.get_part(file))
+            chunks.append(b"\r\n")
+        chunks.append(f"{closing}\r\n".encode("ascii"))
+        return b"".join(chunks)
@@ -0,0 +1,183 @@
+from dataclasses import dataclass, field
+from functools import lru_cache
+from math import ceil
+from typing import List, Tuple
+
+from models.order import ProductFile
+from services.attachment_cache import AttachmentCache
+
+# base64 encodes 57 bytes into a 76 chars line, lines end with CRLF
+# on the wire: cached parts are stored so, smtplib converts str messages
+BASE64_LINE_INPUT: int = 57
+NEWLINE_SIZE: int = 2
+BASE64_LINE_SIZE: int = 76 + NEWLINE_SIZE
+# "--" + boundary + CRLF before a part and CRLF after it
+PART_DELIMITER_SIZE: int = 64
+# message headers, multipart/alternative scaffolding and the closing boundary
+MESSAGE_HEADERS_SIZE: int = 4 * 1024
+# html body is sent as html and plain text alternatives, both base64 encoded,
+# css is inlined into html by premailer
+BODY_OVERHEAD_FACTOR: int = 4
+# optimal packing is searched for orders up to this files count
+EXACT_SEARCH_LIMIT: int = 12
+EXACT_SEARCH_STEPS: int = 100_000
+
+
+def encoded_size(size: int) -> int:
+    """Size of base64 encoded data with 76 chars CRLF lines
+
+    Args:
+        size (int): raw size
+
+    Returns:
+        int: encoded size
+    """
+    full_lines, rest = divmod(size, BASE64_LINE_INPUT)
+    return full_lines * BASE64_LINE_SIZE + (
+        ceil(rest / 3) * 4 + NEWLINE_SIZE if rest else 0
+    )
+
+
+@lru_cache(maxsize=4096)
+def _part_headers_size(file_name: str, mime_type: str) -> int:
+    return len(AttachmentCache.part_headers(file_name, mime_type))
+
+
+def part_size(file: ProductFile) -> int:
+    """Size of file MIME part in the message
+
+    Args:
+        file (ProductFile): attachment
+
+    Returns:
+        int: part size with headers and delimiters
+    """
+    return (
+        _part_headers_size(file.file_name, file.mime_type)
+        + encoded_size(file.file_size)
+        + PART_DELIMITER_SIZE
+    )
+
+
+@dataclass(slots=True)
+class PackingResult:
+    packs: List[List[ProductFile]] = field(default_factory=list)
+    # files which don't fit into a message even alone
+    oversized: List[ProductFile] = field(default_factory=list)
+
+
+class AttachmentPacker:
+    """Pack order files into the minimum number of emails
+
+    Every file is weighted by its encoded MIME part size, so a message
+    never exceeds `max_message_size`. First fit decreasing is used and
+    if it's worse than the lower bound, packs of a typical order are
+    improved by exact search"""
+
+    def __init__(self, *, max_message_size: int, body_size: int = 0) -> None:
+        self.capacity: int = (
+            max_message_size - MESSAGE_HEADERS_SIZE - body_size * BODY_OVERHEAD_FACTOR
+        )
+
+    @staticmethod
+    def _first_fit_decreasing(
+        items: List[Tuple[int, ProductFile]], capacity: int
+    ) -> List[List[Tuple[int, ProductFile]]]:
+        bins: List[List[Tuple[int, ProductFile]]] = []
+        loads: List[int] = []
+        for item in items:
+            for index, load in enumerate(loads):
+                if load + item[0] <= capacity:
+                    bins[index].append(item)
+                    loads[index] += item[0]
+                    break
+            else:
+                bins.append([item])
+                loads.append(item[0])
+        return bins
+
+    @staticmethod
+    def _exact(
+        items: List[Tuple[int, ProductFile]], capacity: int, bins_count: int
+    ) -> List[List[Tuple[int, ProductFile]]] | None:
+        """Depth-first search of packing into `bins_count` bins,
+        items are sorted by size descending
+
+        Returns:
+            List[List[Tuple[int, ProductFile]]] | None: bins or None
+                if impossible or not found in EXACT_SEARCH_STEPS
+        """
+        bins: List[List[Tuple[int, ProductFile]]] = [[] for _ in range(bins_count)]
+        loads: List[int] = [0] * bins_count
+        rest: List[int] = [0] * (len(items) + 1)
+        for index in range(len(items) - 1, -1, -1):
+            rest[index] = rest[index + 1] + items[index][0]
+
+        steps: List[int] = [0]
+
+        def place(index: int) -> bool:
+            if index == len(items):
+                return True
+            steps[0] += 1
+            if steps[0] > EXACT_SEARCH_STEPS:
+                return False
+            if rest[index] > bins_count * capacity - sum(loads):
+                return False
+            size = items[index][0]
+            tried_loads = set()
+            for bin_index in range(bins_count):
+                load = loads[bin_index]
+                # bins with the same load are interchangeable
+                if load in tried_loads or load + size > capacity:
+                    continue
+                tried_loads.add(load)
+                loads[bin_index] += size
+                bins[bin_index].append(items[index])
+                if place(index + 1):
+                    return True
+                loads[bin_index] -= size
+                bins[bin_index].pop()
+            return False
+
+        return bins if place(0) else None
+
+    def pack(self, files: List[ProductFile]) -> PackingResult:
+        """Split files into emails
+
+        Args:
+            files (List[ProductFile]): order files
+
+        Returns:
+            PackingResult: packs in files order and oversized files
+        """
+        result = PackingResult()
+        items: List[Tuple[int, ProductFile]] = []
+        for file in files:
+            size = part_size(file)
+            if size > self.capacity:
+                result.oversized.append(file)
+                continue
+            items.append((size, file))
+        if not items:
+            return result
+        items.sort(key=lambda item: item[0], reverse=True)
+
+        bins = self._first_fit_decreasing(items, self.capacity)
+        lower_bound = ceil(sum(size for size, _ in items) / self.capacity)
+        if len(bins) > lower_bound and len(items) <= EXACT_SEARCH_LIMIT:
+            for bins_count in range(lower_bound, len(bins)):
+                exact_bins = self._exact(items, self.capacity, bins_count)
+                if exact_bins is not None:
+                    bins = exact_bins
+                    break
+
+        positions = {id(file): position for position, file in enumerate(files)}
+        result.packs = sorted(
+            (
+                sorted((file for _, file in bin), key=lambda file: positions[id(file)])
+                for bin in bins
+                if bin
+            ),
+            key=lambda pack: positions[id(pack[0])],
+        )
+        return result
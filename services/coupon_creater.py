@@ -1,17 +1,24 @@
+import json
+import logging
+import os
 import re
 from dataclasses import dataclass
 from datetime import date, timedelta
+from pathlib import Path
 from sys import maxsize
+from threading import Lock, Thread
+from typing import Any, Dict, List, Set, Tuple
 from uuid import uuid4
 
-import backoff
 import requests
 from transliterate import translit
 
-from utils.config import WoocommerceSettings
-from utils.http import HEADERS
+from services.woocommerce_client import WoocommerceClient
+from utils.metrics import metrics
+from utils.resilience import ResilienceError
 
 COUPON_DAYS: int = 7
+COUPONS_BATCH_SIZE: int = 100
 
 
 @dataclass(frozen=True, slots=True)
@@ -47,16 +54,37 @@ class Coupon:
 
 @dataclass
 class CouponCreater:
-    total: int | float
-    name: str
-    settings: WoocommerceSettings
+    client: WoocommerceClient
     days: int = COUPON_DAYS
+    app_logger: logging.Logger = logging.getLogger("app_logger")
 
-    def __call__(self) -> Coupon | None:
-        return self._get_coupon(
-            total=self.total,
-            name=self.name,
+    def __call__(self, *, total: int | float, name: str) -> Coupon | None:
+        return self.create_batch(customers=[(total, name)])[0]
+
+    def create_batch(
+        self,
+        *,
+        customers: List[Tuple[int | float, str]],
+    ) -> List[Coupon | None]:
+        """Create coupons for many orders with /coupons/batch
+
+        Args:
+            customers (List[Tuple[int | float, str]]): orders totals and names
+
+        Returns:
+            List[Coupon | None]: coupons in the same order,
+                None if no discount or coupon is rejected by woocommerce
+        """
+        coupons: List[Coupon | None] = [
+            self._get_coupon(total=total, name=name) for total, name in customers
+        ]
+        uploaded: Set[str] = self._upload_coupons(
+            coupons=[coupone for coupone in coupons if coupone is not None]
         )
+        return [
+            coupone if coupone is not None and coupone.coupon_name in uploaded else None
+            for coupone in coupons
+        ]
 
     def _get_coupon(
         self,
@@ -67,16 +95,11 @@ class CouponCreater:
         if discount_percent == 0:
             return None
 
-        coupon_name = self._get_coupon_name(name=name)
-        days = self.days
-        coupone: Coupon = Coupon(
-            coupon_name=coupon_name,
+        return Coupon(
+            coupon_name=self._get_coupon_name(name=name),
             discount_percent=discount_percent,
-            days=days,
+            days=self.days,
         )
-        self._upload_coupone(coupone=coupone)
-
-        return coupone
 
     def _get_coupon_name(
         self,
@@ -101,33 +124,171 @@ class CouponCreater:
                 return discount.discount_percent
         return 0
 
-    def _count_date_expires(
-        self,
-    ) -> str:
-        end_date = date.today() + timedelta(days=self.days)
+    @staticmethod
+    def _count_date_expires(days: int) -> str:
+        end_date = date.today() + timedelta(days=days)
         return end_date.strftime("%Y-%m-%d")
 
-    @backoff.on_exception(
-        backoff.expo,
-        requests.exceptions.RequestException,
-        raise_on_giveup=True,
-        max_tries=3,
-    )
-    def _upload_coupone(self, coupone: Coupon) -> None:
-        auth_pair = (self.settings.user_key, self.settings.secret_key)
-        url = f"{self.settings.url}/coupons"
-        with requests.Session() as session:
-            session.headers = HEADERS
-            response = session.post(
-                url,
-                auth=auth_pair,
-                params={
-                    "code": coupone.coupon_name,
-                    "discount_type": "percent",
-                    "amount": coupone.discount_percent,
-                    "date_expires": self._count_date_expires(),
-                    "individual_use": True,
-                    "usage_limit": "1",
-                },
+    def _coupon_data(self, coupone: Coupon) -> Dict[str, Any]:
+        return {
+            "code": coupone.coupon_name,
+            "discount_type": "percent",
+            "amount": str(coupone.discount_percent),
+            "date_expires": self._count_date_expires(coupone.days),
+            "individual_use": True,
+            "usage_limit": 1,
+        }
+
+    def _upload_coupons(self, coupons: List[Coupon]) -> Set[str]:
+        """Upload coupons in batches
+
+        Args:
+            coupons (List[Coupon]): coupons to create
+
+        Returns:
+            Set[str]: names of created coupons
+        """
+        uploaded: Set[str] = set()
+        for start in range(0, len(coupons), COUPONS_BATCH_SIZE):
+            uploaded.update(
+                self._upload_coupons_batch(
+                    coupons=coupons[start : start + COUPONS_BATCH_SIZE]
+                )
             )
-            response.raise_for_status()
+        return uploaded
+
+    @metrics.timed("coupon_upload")
+    def _upload_coupons_batch(self, coupons: List[Coupon]) -> Set[str]:
+        if not coupons:
+            return set()
+        response = self.client.post(
+            "coupons/batch",
+            json={"create": [self._coupon_data(coupone) for coupone in coupons]},
+        )
+        response.raise_for_status()
+        uploaded: Set[str] = set()
+        for coupone, item in zip(coupons, response.json().get("create", [])):
+            if "error" in item:
+                self.app_logger.error(
+                    "Coupon %s is not created: %s", coupone.coupon_name, item["error"]
+                )
+                continue
+            uploaded.add(coupone.coupon_name)
+        return uploaded
+
+
+class CouponPool:
+    """Pre-generated coupons for every discount tier
+
+    Coupons are created in advance with a validity extended by
+    `max_age_days` and are taken only while they are younger than that,
+    so a customer always gets at least `days` of validity.
+    The pool is refilled in a background thread"""
+
+    def __init__(
+        self,
+        *,
+        creater: CouponCreater,
+        path: str,
+        size: int,
+        max_age_days: int,
+        app_logger: logging.Logger,
+    ) -> None:
+        self.creater: CouponCreater = creater
+        self.path: Path = Path(path)
+        self.size: int = size
+        self.max_age_days: int = max_age_days
+        self.app_logger: logging.Logger = app_logger
+        self.lock: Lock = Lock()
+        self.refill_thread: Thread | None = None
+        self.coupons: Dict[str, List[Dict[str, str]]] = self._load()
+
+    def _load(self) -> Dict[str, List[Dict[str, str]]]:
+        if not self.path.exists():
+            return {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as ex:
+            self.app_logger.warning("Coupons pool is broken, drop it: %s", ex)
+            return {}
+
+    def _save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(f"{self.path.suffix}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.coupons, f)
+        os.replace(tmp_path, self.path)
+
+    def _fresh(self, discount_percent: int) -> List[Dict[str, str]]:
+        oldest = (date.today() - timedelta(days=self.max_age_days)).isoformat()
+        return [
+            coupone
+            for coupone in self.coupons.get(str(discount_percent), [])
+            if coupone["created"] >= oldest
+        ]
+
+    def take(self, *, total: int | float) -> Coupon | None:
+        """Take pre-generated coupon for order total
+
+        Args:
+            total (int | float): order total
+
+        Returns:
+            Coupon | None: coupon or None if the tier is empty
+        """
+        discount_percent = self.creater._get_discount_percent(total=total)
+        if discount_percent == 0:
+            return None
+        with self.lock:
+            fresh = self._fresh(discount_percent)
+            if not fresh:
+                return None
+            coupone = fresh.pop(0)
+            self.coupons[str(discount_percent)] = fresh
+            self._save()
+        return Coupon(
+            coupon_name=coupone["code"],
+            discount_percent=discount_percent,
+            days=self.creater.days,
+        )
+
+    def refill_in_background(self) -> None:
+        """Start pool refilling if it is not running"""
+        if self.refill_thread is not None and self.refill_thread.is_alive():
+            return
+        self.refill_thread = Thread(target=self._refill, daemon=True)
+        self.refill_thread.start()
+
+    def wait(self, timeout: float | None = None) -> None:
+        if self.refill_thread is not None:
+            self.refill_thread.join(timeout)
+
+    def _refill(self) -> None:
+        try:
+            for discount in COUPONE_DICSOUNT:
+                with self.lock:
+                    missing = self.size - len(self._fresh(discount.discount_percent))
+                if missing <= 0:
+                    continue
+                coupons: List[Coupon] = [
+                    Coupon(
+                        coupon_name=self.creater._get_coupon_name(name="gift"),
+                        discount_percent=discount.discount_percent,
+                        days=self.creater.days + self.max_age_days,
+                    )
+                    for _ in range(missing)
+                ]
+                uploaded = self.creater._upload_coupons(coupons=coupons)
+                created = date.today().isoformat()
+                with self.lock:
+                    self.coupons[str(discount.discount_percent)] = self._fresh(
+                        discount.discount_percent
+                    ) + [
+                        {"code": coupone.coupon_name, "created": created}
+                        for coupone in coupons
+                        if coupone.coupon_name in uploaded
+                    ]
+                    self._save()
+        except (requests.exceptions.RequestException, ResilienceError):
+            self.app_logger.exception("Coupons pool is not refilled:")
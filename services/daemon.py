@@ -0,0 +1,303 @@
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import mimetypes
+import shutil
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Empty, Queue
+from threading import Event, Thread
+from typing import Dict, Iterable, List, Set
+from urllib.parse import parse_qs, quote, unquote, urlparse
+
+from models.order import Order
+from services.delivery_journal import DeliveryJournal
+from services.link_publisher import LinkPublisher
+from services.order_closer import OrderCloser
+from services.orders_handler import OrdersHandler
+from services.rate_limiter import SendRateLimiter
+from services.smtp_session import SmtpSession
+from services.telegram_noticifier import TelegramNoticifier
+from services.woocommerce_client import WoocommerceClient
+from services.woocommerce_fetcher import WoocommerceFetcher
+from utils.config import AppSettings
+from utils.metrics import metrics
+from utils.resilience import ResilienceError
+
+# queue item which asks for a full poll instead of a single order
+POLL = ""
+WEBHOOK_TOPICS = ("order.created", "order.updated")
+FILE_CHUNK_SIZE: int = 1024 * 1024
+
+# every request incl. /metrics scrapes, kept out of the telegram handler
+access_logger = logging.getLogger("webhook.access")
+
+
+class OrdersDaemon:
+    """Long-running service mode
+
+    Keeps warm woocommerce and smtp connections, receives woocommerce
+    order webhooks and handles orders right away. A low-frequency poll
+    of processing orders stays as a safety net"""
+
+    def __init__(
+        self,
+        *,
+        app_settings: AppSettings,
+        wc_client: WoocommerceClient,
+        orders_fetcher: WoocommerceFetcher,
+        app_logger: logging.Logger,
+    ) -> None:
+        self.app_settings: AppSettings = app_settings
+        self.settings = app_settings.daemon_settings
+        self.wc_client: WoocommerceClient = wc_client
+        self.orders_fetcher: WoocommerceFetcher = orders_fetcher
+        self.app_logger: logging.Logger = app_logger
+        self.queue: Queue[str] = Queue()
+        self.stopped: Event = Event()
+        self.smtp_session: SmtpSession = SmtpSession(
+            settings=app_settings.email_settings, app_logger=app_logger
+        )
+        self.journal: DeliveryJournal = DeliveryJournal(path=app_settings.journal_path)
+        self.rate_limiter: SendRateLimiter = SendRateLimiter(
+            rate_limit=app_settings.email_settings.rate_limit,
+            server=app_settings.email_settings.smtp_server,
+            app_logger=app_logger,
+            journal=self.journal,
+        )
+        self.order_closer: OrderCloser = OrderCloser(
+            wc_client=wc_client,
+            journal=self.journal,
+            app_logger=app_logger,
+            batch_size=app_settings.woocommerce_settings.close_batch_size,
+            flush_interval=app_settings.woocommerce_settings.close_flush_interval,
+        )
+        self.telegram_noticifier: TelegramNoticifier = TelegramNoticifier(
+            app_logger=app_logger, settings=app_settings.telegram_settings
+        )
+        self.link_publisher: LinkPublisher = LinkPublisher(
+            settings=app_settings.link_settings,
+            max_message_size=app_settings.email_settings.max_attachment_size,
+            app_logger=app_logger,
+        )
+        self.server: ThreadingHTTPServer = ThreadingHTTPServer(
+            (self.settings.host, self.settings.port), self._make_request_handler()
+        )
+
+    def _make_request_handler(self) -> type:
+        daemon = self
+
+        class WebhookRequestHandler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args) -> None:
+                access_logger.debug("webhook: %s", format % args)
+
+            def _reply(self, status: HTTPStatus) -> None:
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def _send_file(self) -> None:
+                url = urlparse(self.path)
+                path = unquote(url.path[len(daemon.settings.files_path) + 1 :])
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                if not daemon.link_publisher.verify(
+                    path=path,
+                    expires=query.get("expires", ""),
+                    token=query.get("token", ""),
+                ):
+                    self._reply(HTTPStatus.FORBIDDEN)
+                    return
+                file_path = daemon.link_publisher.resolve(path)
+                if file_path is None:
+                    self._reply(HTTPStatus.NOT_FOUND)
+                    return
+                self.send_response(HTTPStatus.OK)
+                self.send_header(
+                    "Content-Type",
+                    mimetypes.guess_type(file_path.name)[0]
+                    or "application/octet-stream",
+                )
+                self.send_header("Content-Length", str(file_path.stat().st_size))
+                self.send_header(
+                    "Content-Disposition",
+                    f"attachment; filename*=UTF-8''{quote(file_path.name)}",
+                )
+                self.end_headers()
+                with open(file_path, "rb") as f:
+                    shutil.copyfileobj(f, self.wfile, FILE_CHUNK_SIZE)
+
+            def do_GET(self) -> None:
+                if self.path.startswith(f"{daemon.settings.files_path}/"):
+                    self._send_file()
+                    return
+                if self.path.rstrip("/") != daemon.settings.metrics_path:
+                    self._reply(HTTPStatus.NOT_FOUND)
+                    return
+                body = metrics.render().encode()
+                self.send_response(HTTPStatus.OK)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self) -> None:
+                if self.path.rstrip("/") != daemon.settings.webhook_path:
+                    self._reply(HTTPStatus.NOT_FOUND)
+                    return
+                try:
+                    content_length = int(self.headers.get("Content-Length", 0))
+                except ValueError:
+                    content_length = -1
+                if content_length < 0:
+                    self._reply(HTTPStatus.BAD_REQUEST)
+                    return
+                if content_length > daemon.settings.max_webhook_size:
+                    daemon.app_logger.warning(
+                        "Webhook of %s bytes is rejected", content_length
+                    )
+                    self._reply(HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+                    return
+                body = self.rfile.read(content_length)
+                self._reply(
+                    daemon.handle_webhook(
+                        body=body,
+                        signature=self.headers.get("X-WC-Webhook-Signature", ""),
+                        topic=self.headers.get("X-WC-Webhook-Topic", ""),
+                    )
+                )
+
+        return WebhookRequestHandler
+
+    def _is_signature_valid(self, *, body: bytes, signature: str) -> bool:
+        if not self.settings.webhook_secret:
+            return False
+        expected = base64.b64encode(
+            hmac.new(
+                self.settings.webhook_secret.encode(), body, hashlib.sha256
+            ).digest()
+        ).decode()
+        return hmac.compare_digest(expected, signature)
+
+    def handle_webhook(self, *, body: bytes, signature: str, topic: str) -> HTTPStatus:
+        """Verify woocommerce webhook and queue processing order
+
+        Args:
+            body (bytes): raw request body
+            signature (str): X-WC-Webhook-Signature header
+            topic (str): X-WC-Webhook-Topic header
+
+        Returns:
+            HTTPStatus: response status
+        """
+        if not topic and body.startswith(b"webhook_id="):
+            # woocommerce pings a new webhook without topic
+            return HTTPStatus.OK
+        if not self._is_signature_valid(body=body, signature=signature):
+            self.app_logger.warning("Webhook with a wrong signature is rejected")
+            return HTTPStatus.UNAUTHORIZED
+        if topic not in WEBHOOK_TOPICS:
+            return HTTPStatus.OK
+        try:
+            order_info = json.loads(body)
+        except ValueError:
+            return HTTPStatus.BAD_REQUEST
+        if not isinstance(order_info, dict) or "id" not in order_info:
+            self.app_logger.warning("Webhook without order id is rejected")
+            return HTTPStatus.BAD_REQUEST
+        if order_info.get("status") == "processing":
+            self.queue.put(str(order_info["id"]))
+        return HTTPStatus.ACCEPTED
+
+    def _poll_forever(self) -> None:
+        while not self.stopped.is_set():
+            self.queue.put(POLL)
+            self.stopped.wait(self.settings.poll_interval)
+
+    def _take_batch(self) -> List[str]:
+        """Wait for queue items and coalesce everything already queued"""
+        items: List[str] = [self.queue.get()]
+        while True:
+            try:
+                items.append(self.queue.get_nowait())
+            except Empty:
+                return items
+
+    def _handle_orders(
+        self, orders: Iterable[Order], stage_seconds: Dict[str, float]
+    ) -> OrdersHandler:
+        orders_handler: OrdersHandler = OrdersHandler(
+            orders=orders,
+            settings=self.app_settings,
+            wc_client=self.wc_client,
+            app_logger=self.app_logger,
+            smtp_session=self.smtp_session,
+            rate_limiter=self.rate_limiter,
+            order_closer=self.order_closer,
+            journal=self.journal,
+        )
+        result_message: str = orders_handler.handle()
+        timings: str = metrics.format_timings(since=stage_seconds)
+        if timings:
+            result_message = f"{result_message}\n{timings}"
+        if orders_handler.orders or orders_handler.is_aborted:
+            self.telegram_noticifier.send_result_to_telegram(message=result_message)
+        return orders_handler
+
+    def _work_forever(self) -> None:
+        while not self.stopped.is_set():
+            items: List[str] = self._take_batch()
+            if self.stopped.is_set():
+                return
+            stage_seconds: Dict[str, float] = metrics.stage_seconds()
+            try:
+                if POLL in items:
+                    self.orders_fetcher.file_catalog.scan()
+                    orders: List[Order] = self.orders_fetcher.fetch_orders()
+                    orders_handler = self._handle_orders(orders, stage_seconds)
+                    # stopped handling is repeated by the next poll
+                    if not orders_handler.is_aborted:
+                        self.orders_fetcher.commit_cursor(orders=orders)
+                    continue
+                order_ids: Set[str] = set(items)
+                self._handle_orders(
+                    self.orders_fetcher.fetch_orders_by_ids(
+                        order_ids=sorted(order_ids)
+                    ),
+                    stage_seconds,
+                )
+            except Exception as ex:
+                self.app_logger.exception("Orders are not handled: %s", ex)
+
+    def serve_forever(self) -> None:
+        """Run webhook server, poller and orders worker until stop"""
+        if not self.settings.webhook_secret:
+            self.app_logger.warning("DAEMON_WEBHOOK_SECRET is empty, webhooks are off")
+        threads: List[Thread] = [
+            Thread(target=self._poll_forever, daemon=True),
+            Thread(target=self._work_forever, daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+        self.app_logger.info(
+            "Daemon is listening on %s:%s", self.settings.host, self.settings.port
+        )
+        try:
+            self.server.serve_forever()
+        finally:
+            self.stopped.set()
+            self.queue.put(POLL)  # wake up the worker
+            threads[1].join()
+            self.server.server_close()
+            try:
+                self.order_closer.flush()
+            except ResilienceError as ex:
+                self.app_logger.error("Orders are not closed on stop: %s", ex)
+            self.smtp_session.close()
+            self.telegram_noticifier.close()
+            self.journal.close()
+
+    def stop(self) -> None:
+        """Stop serving, can be called from a signal handler"""
+        Thread(target=self.server.shutdown).start()
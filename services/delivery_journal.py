@@ -0,0 +1,169 @@
+import hashlib
+import sqlite3
+from pathlib import Path
+from threading import Lock
+from time import time
+from typing import Callable, List, Tuple
+
+from models.order import ProductFile
+from services.coupon_creater import Coupon
+
+SCHEMA: str = """
+CREATE TABLE IF NOT EXISTS orders (
+    order_id TEXT PRIMARY KEY,
+    coupon_name TEXT,
+    discount_percent INTEGER,
+    parts_total INTEGER,
+    is_sent INTEGER NOT NULL DEFAULT 0,
+    is_closed INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS parts (
+    order_id TEXT NOT NULL,
+    part_key TEXT NOT NULL,
+    sent_at REAL NOT NULL,
+    PRIMARY KEY (order_id, part_key)
+);
+CREATE TABLE IF NOT EXISTS buckets (
+    name TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+class DeliveryJournal:
+    """SQLite journal of orders delivery
+
+    Records coupon, every sent part of an order, full sending and closing,
+    so a restarted run skips delivered parts and only retries closing.
+    Also keeps rate limiter buckets shared by runs and worker processes"""
+
+    def __init__(self, *, path: str) -> None:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.connection: sqlite3.Connection = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None, timeout=30
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+        self.lock: Lock = Lock()
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
+
+    @staticmethod
+    def part_key(files: List[ProductFile]) -> str:
+        """Stable part id which doesn't depend on packing order
+
+        Args:
+            files (List[ProductFile]): files of the part
+
+        Returns:
+            str: part key
+        """
+        names = "\n".join(sorted(file.file_name for file in files))
+        return hashlib.sha256(names.encode()).hexdigest()
+
+    def _upsert(self, order_id: str, **fields) -> None:
+        columns = ", ".join(fields)
+        updates = ", ".join(f"{column} = excluded.{column}" for column in fields)
+        with self.lock:
+            self.connection.execute(
+                f"INSERT INTO orders (order_id, {columns}, updated_at) "
+                f"VALUES (?, {', '.join('?' * len(fields))}, ?) "
+                f"ON CONFLICT (order_id) DO UPDATE SET {updates}, "
+                "updated_at = excluded.updated_at",
+                (order_id, *fields.values(), time()),
+            )
+
+    def _get(self, order_id: str, column: str):
+        with self.lock:
+            row = self.connection.execute(
+                f"SELECT {column} FROM orders WHERE order_id = ?", (order_id,)
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def get_coupon(self, order_id: str) -> Coupon | None:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT coupon_name, discount_percent FROM orders "
+                "WHERE order_id = ? AND coupon_name IS NOT NULL",
+                (order_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        return Coupon(coupon_name=row[0], discount_percent=row[1])
+
+    def record_coupon(self, order_id: str, coupon: Coupon) -> None:
+        self._upsert(
+            order_id,
+            coupon_name=coupon.coupon_name,
+            discount_percent=coupon.discount_percent,
+        )
+
+    def record_rendered(self, order_id: str, parts_total: int) -> None:
+        self._upsert(order_id, parts_total=parts_total)
+
+    def is_part_sent(self, order_id: str, part_key: str) -> bool:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT 1 FROM parts WHERE order_id = ? AND part_key = ?",
+                (order_id, part_key),
+            ).fetchone()
+        return row is not None
+
+    def record_part_sent(self, order_id: str, part_key: str) -> None:
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR IGNORE INTO parts (order_id, part_key, sent_at) "
+                "VALUES (?, ?, ?)",
+                (order_id, part_key, time()),
+            )
+
+    def is_sent(self, order_id: str) -> bool:
+        return bool(self._get(order_id, "is_sent"))
+
+    def record_sent(self, order_id: str) -> None:
+        self._upsert(order_id, is_sent=1)
+
+    def is_closed(self, order_id: str) -> bool:
+        return bool(self._get(order_id, "is_closed"))
+
+    def record_closed(self, order_id: str) -> None:
+        self._upsert(order_id, is_closed=1)
+
+    def update_bucket(
+        self,
+        name: str,
+        update: Callable[[float | None, float | None], Tuple[float, float]],
+    ) -> Tuple[float, float]:
+        """Read and write token bucket state in one write transaction,
+        so every process sharing the journal takes tokens from the same bucket
+
+        Args:
+            name (str): bucket name
+            update (Callable[[float | None, float | None], Tuple[float, float]]):
+                gets stored tokens and update time (None for a new bucket),
+                returns new ones
+
+        Returns:
+            Tuple[float, float]: stored tokens and update time
+        """
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.connection.execute(
+                    "SELECT tokens, updated_at FROM buckets WHERE name = ?", (name,)
+                ).fetchone()
+                tokens, updated_at = update(*(row or (None, None)))
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO buckets (name, tokens, updated_at) "
+                    "VALUES (?, ?, ?)",
+                    (name, tokens, updated_at),
+                )
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+        return tokens, updated_at
@@ -0,0 +1,195 @@
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, List, Set
+
+HASH_CHUNK_SIZE: int = 1024 * 1024
+
+
+@dataclass(slots=True)
+class CatalogEntry:
+    path: str
+    size: int
+    mtime: int
+    mime_type: str
+    content_hash: str = ""
+
+
+class FileCatalog:
+    """Index of product files: path -> size, mtime, content hash, mime type
+
+    Index is kept on disk and trusted by lookups. Download directories
+    are rescanned incrementally: only directories with a changed mtime,
+    i.e. with added, removed or renamed files, are listed and their files
+    are checked. Files rewritten in place are noticed when they are read
+    for attaching. Hashes are counted lazily when a file is requested"""
+
+    def __init__(
+        self,
+        *,
+        index_path: str,
+        download_dirs: List[str],
+        app_logger: logging.Logger,
+    ) -> None:
+        self.index_path: Path = Path(index_path)
+        self.download_dirs: List[str] = download_dirs
+        self.app_logger: logging.Logger = app_logger
+        self.entries: Dict[str, CatalogEntry] = {}
+        # directory -> mtime of the last listing
+        self.dirs: Dict[str, int] = {}
+        self.is_changed: bool = False
+        self.is_dirs_scanned: bool = False
+        self._load()
+
+    def _load(self) -> None:
+        if not self.index_path.exists():
+            return
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+            self.entries = {
+                path: CatalogEntry(**entry) for path, entry in index["files"].items()
+            }
+            self.dirs = {path: int(mtime) for path, mtime in index["dirs"].items()}
+        except (OSError, ValueError, TypeError, KeyError, AttributeError) as ex:
+            self.app_logger.warning("Files catalog is broken, drop it: %s", ex)
+            self.entries = {}
+            self.dirs = {}
+
+    def save(self) -> None:
+        """Atomically write index if something was changed"""
+        if not self.is_changed:
+            return
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.index_path.with_suffix(f"{self.index_path.suffix}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "dirs": self.dirs,
+                    "files": {
+                        path: asdict(entry) for path, entry in self.entries.items()
+                    },
+                },
+                f,
+                ensure_ascii=False,
+            )
+        os.replace(tmp_path, self.index_path)
+        self.is_changed = False
+
+    def _update(self, path: str, stat: os.stat_result) -> CatalogEntry:
+        entry = self.entries.get(path)
+        if (
+            entry is not None
+            and entry.size == stat.st_size
+            and entry.mtime == stat.st_mtime_ns
+        ):
+            return entry
+        entry = CatalogEntry(
+            path=path,
+            size=stat.st_size,
+            mtime=stat.st_mtime_ns,
+            mime_type=mimetypes.guess_type(path)[0] or "application/octet-stream",
+        )
+        self.entries[path] = entry
+        self.is_changed = True
+        return entry
+
+    def _drop(self, path: str) -> None:
+        if self.entries.pop(path, None) is not None:
+            self.is_changed = True
+
+    def _scan_dir(self, directory: str, seen_dirs: Set[str]) -> None:
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+            with os.scandir(directory) as dir_entries:
+                items = list(dir_entries)
+        except OSError:
+            return
+        seen_dirs.add(directory)
+        is_dir_changed = self.dirs.get(directory) != mtime
+        file_paths: Set[str] = set()
+        for item in items:
+            if item.is_dir():
+                self._scan_dir(item.path, seen_dirs)
+                continue
+            file_paths.add(item.path)
+            if not is_dir_changed and item.path in self.entries:
+                continue
+            try:
+                self._update(item.path, item.stat())
+            except OSError:
+                self._drop(item.path)
+        if not is_dir_changed:
+            return
+        for path in [
+            path for path in self.entries if os.path.dirname(path) == directory
+        ]:
+            if path not in file_paths:
+                self._drop(path)
+        self.dirs[directory] = mtime
+        self.is_changed = True
+
+    def scan(self) -> None:
+        """Sync index with download directories, files are checked
+        only in directories changed since the previous scan"""
+        seen_dirs: Set[str] = set()
+        for download_dir in self.download_dirs:
+            self._scan_dir(os.path.normpath(download_dir), seen_dirs)
+        for directory in list(self.dirs):
+            if directory in seen_dirs:
+                continue
+            # removed directory
+            del self.dirs[directory]
+            for path in [
+                path for path in self.entries if os.path.dirname(path) == directory
+            ]:
+                self._drop(path)
+            self.is_changed = True
+        self.is_dirs_scanned = True
+        self.save()
+
+    def _is_scanned(self, path: str) -> bool:
+        download_dirs: List[str] = [
+            os.path.normpath(download_dir) for download_dir in self.download_dirs
+        ]
+        return any(
+            os.path.commonpath([path, download_dir]) == download_dir
+            for download_dir in download_dirs
+            if os.path.isabs(path) == os.path.isabs(download_dir)
+        )
+
+    @staticmethod
+    def _hash_file(path: str) -> str:
+        file_hash = hashlib.sha256()
+        with open(path, "rb") as f:
+            while chunk := f.read(HASH_CHUNK_SIZE):
+                file_hash.update(chunk)
+        return file_hash.hexdigest()
+
+    def lookup(self, path: str) -> CatalogEntry | None:
+        """Get file entry from the index, files outside download
+        directories aren't scanned and are checked on every request
+
+        Args:
+            path (str): file path
+
+        Returns:
+            CatalogEntry | None: entry or None if file is missing
+        """
+        if not self.is_dirs_scanned:
+            self.scan()
+        try:
+            entry = self.entries.get(path)
+            if entry is None or not self._is_scanned(path):
+                entry = self._update(path, os.stat(path))
+            if not entry.content_hash:
+                entry.content_hash = self._hash_file(path)
+                self.is_changed = True
+        except OSError:
+            self._drop(path)
+            return None
+        return entry
@@ -0,0 +1,188 @@
+import hashlib
+import hmac
+import json
+import logging
+import os
+import shutil
+from datetime import datetime
+from pathlib import Path
+from threading import Lock
+from time import time
+from typing import Dict, List
+from urllib.parse import quote, urlencode
+
+from models.order import ProductFile
+from services.attachment_packer import MESSAGE_HEADERS_SIZE, part_size
+from utils.config import LinkSettings
+
+TOKEN_LENGTH: int = 32
+
+
+class LinkPublisher:
+    """Deliver large files by expiring signed links instead of attachments
+
+    Files are published into the static directory by content hash
+    (hard linked, copied if the directory is on another device).
+    Links are signed with HMAC of the file path and expiration time,
+    so they are checked without any state. Files are removed from
+    the static directory when all their links are expired"""
+
+    def __init__(
+        self,
+        *,
+        settings: LinkSettings,
+        max_message_size: int,
+        app_logger: logging.Logger,
+    ) -> None:
+        self.settings: LinkSettings = settings
+        self.max_message_size: int = max_message_size
+        self.app_logger: logging.Logger = app_logger
+        self.static_dir: Path = Path(settings.static_dir)
+        self.index_path: Path = self.static_dir / "links.json"
+        self.lock: Lock = Lock()
+        self.is_pruned: bool = False
+
+    @property
+    def is_enabled(self) -> bool:
+        return bool(
+            self.settings.threshold and self.settings.base_url and self.settings.secret
+        )
+
+    def should_link(self, file: ProductFile) -> bool:
+        """Check if file is delivered by link
+
+        Args:
+            file (ProductFile): order file
+
+        Returns:
+            bool: True for files over the threshold
+                and files which don't fit into an email
+        """
+        if not self.is_enabled:
+            return False
+        return (
+            file.file_size >= self.settings.threshold
+            or part_size(file) > self.max_message_size - MESSAGE_HEADERS_SIZE
+        )
+
+    def _sign(self, path: str, expires: int) -> str:
+        return hmac.new(
+            self.settings.secret.encode(),
+            f"{path}\n{expires}".encode(),
+            hashlib.sha256,
+        ).hexdigest()[:TOKEN_LENGTH]
+
+    def verify(self, *, path: str, expires: str, token: str) -> bool:
+        """Check link signature and expiration
+
+        Args:
+            path (str): published file path relative to the static directory
+            expires (str): expiration unix time from the link
+            token (str): signature from the link
+
+        Returns:
+            bool: True if link is valid
+        """
+        if not self.settings.secret or not expires.isdigit():
+            return False
+        if int(expires) < time():
+            return False
+        return hmac.compare_digest(self._sign(path, int(expires)), token)
+
+    def resolve(self, path: str) -> Path | None:
+        """Get published file, paths outside the static directory are refused
+
+        Args:
+            path (str): published file path relative to the static directory
+
+        Returns:
+            Path | None: file path or None
+        """
+        static_dir = self.static_dir.resolve()
+        file_path = (static_dir / path).resolve()
+        if static_dir not in file_path.parents or not file_path.is_file():
+            return None
+        return file_path
+
+    def _load_index(self) -> Dict[str, int]:
+        if not self.index_path.exists():
+            return {}
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as ex:
+            self.app_logger.warning("Links index is broken, drop it: %s", ex)
+            return {}
+
+    def _save_index(self, index: Dict[str, int]) -> None:
+        tmp_path = self.index_path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(index, f, ensure_ascii=False)
+        os.replace(tmp_path, self.index_path)
+
+    def _prune(self, index: Dict[str, int]) -> None:
+        now = time()
+        for path, expires in list(index.items()):
+            if expires >= now:
+                continue
+            del index[path]
+            file_path = self.static_dir / path
+            try:
+                file_path.unlink()
+                file_path.parent.rmdir()
+            except OSError:
+                pass
+
+    def _place(self, file: ProductFile, path: str) -> None:
+        target = self.static_dir / path
+        if target.exists():
+            return
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = target.with_name(f".{target.name}.{os.getpid()}.tmp")
+        try:
+            os.link(file.file_name, tmp_path)
+        except OSError:
+            shutil.copyfile(file.file_name, tmp_path)
+        os.replace(tmp_path, target)
+
+    def publish(self, files: List[ProductFile]) -> List[Dict[str, str]]:
+        """Publish files and make their links
+
+        Args:
+            files (List[ProductFile]): files to deliver by link
+
+        Returns:
+            List[Dict[str, str]]: file_name, name, size, url and expires
+                of every link for the email template
+        """
+        expires = int(time()) + self.settings.ttl_days * 24 * 60 * 60
+        links: List[Dict[str, str]] = []
+        with self.lock:
+            self.static_dir.mkdir(parents=True, exist_ok=True)
+            index = self._load_index()
+            if not self.is_pruned:
+                self._prune(index)
+                self.is_pruned = True
+            for file in files:
+                name = os.path.basename(file.file_name)
+                content_hash = (
+                    file.content_hash
+                    or hashlib.sha256(file.file_name.encode()).hexdigest()
+                )
+                path = f"{content_hash}/{name}"
+                self._place(file, path)
+                index[path] = max(index.get(path, 0), expires)
+                query = urlencode(
+                    {"expires": expires, "token": self._sign(path, expires)}
+                )
+                links.append(
+                    {
+                        "file_name": file.file_name,
+                        "name": name,
+                        "size": f"{file.file_size / 1024 / 1024:.1f} МБ",
+                        "url": f"{self.settings.base_url.rstrip('/')}/{quote(path)}?{query}",
+                        "expires": datetime.fromtimestamp(expires).strftime("%d.%m.%Y"),
+                    }
+                )
+            self._save_index(index)
+        return links
@@ -0,0 +1,143 @@
+import logging
+from http import HTTPStatus
+from threading import Lock
+from time import monotonic
+from typing import Any, Dict, List
+
+import requests
+
+from models.order import Order
+from services.delivery_journal import DeliveryJournal
+from services.woocommerce_client import WoocommerceClient
+from utils.metrics import metrics
+from utils.resilience import ResilienceError
+
+MAX_BATCH_SIZE: int = 100
+
+
+class OrderCloser:
+    """Complete orders in bulk through /orders/batch
+
+    Sent orders are queued and flushed when the batch is full
+    or the oldest queued order waits longer than flush interval,
+    so a crash loses at most one small batch. `order.status` is set
+    per order from the batch response. Orders closed by a previous
+    batch according to the journal aren't updated again"""
+
+    def __init__(
+        self,
+        *,
+        wc_client: WoocommerceClient,
+        journal: DeliveryJournal,
+        app_logger: logging.Logger,
+        batch_size: int = 10,
+        flush_interval: float = 60.0,
+    ) -> None:
+        self.wc_client: WoocommerceClient = wc_client
+        self.journal: DeliveryJournal = journal
+        self.app_logger: logging.Logger = app_logger
+        self.batch_size: int = min(batch_size, MAX_BATCH_SIZE)
+        self.flush_interval: float = flush_interval
+        self.queue: List[Order] = []
+        self.first_queued_at: float = 0.0
+        self.lock: Lock = Lock()
+
+    def enqueue(self, order: Order) -> None:
+        """Queue order for closing
+
+        Args:
+            order (Order): successfully sent order
+        """
+        if self.journal.is_closed(order.id):
+            # e.g. a webhook or a stale fetch brings a completed order again
+            self.app_logger.info("Order %s is already closed", order.id)
+            order.status = True
+            return
+        with self.lock:
+            if not self.queue:
+                self.first_queued_at = monotonic()
+            self.queue.append(order)
+        self.flush_if_due()
+
+    def flush_if_due(self) -> None:
+        """Flush queue if size or time threshold is reached"""
+        with self.lock:
+            is_due = len(self.queue) >= self.batch_size or (
+                self.queue and monotonic() - self.first_queued_at >= self.flush_interval
+            )
+        if is_due:
+            self.flush()
+
+    def flush(self) -> None:
+        """Close all queued orders
+
+        Raises:
+            ResilienceError: woocommerce circuit is open or the run deadline
+                is exceeded, the batch orders are left unclosed
+        """
+        with self.lock:
+            batch, self.queue = self.queue, []
+        if not batch:
+            return
+        try:
+            results: Dict[str, bool] = self._close_batch(batch)
+        except ResilienceError:
+            for order in batch:
+                order.status = False
+            raise
+        for order in batch:
+            order.status = results.get(order.id, False)
+            if order.status:
+                self.journal.record_closed(order.id)
+
+    @metrics.timed("close_orders")
+    def _close_batch(self, batch: List[Order]) -> Dict[str, bool]:
+        """Send batch update
+
+        Args:
+            batch (List[Order]): orders to complete
+
+        Raises:
+            ResilienceError: woocommerce circuit is open or the run deadline
+                is exceeded, the run is stopped
+
+        Returns:
+            Dict[str, bool]: closing result by order id
+        """
+        try:
+            r = self.wc_client.post(
+                "orders/batch",
+                json={
+                    "update": [
+                        {"id": int(order.id), "status": "completed"} for order in batch
+                    ]
+                },
+            )
+            if r.status_code != HTTPStatus.OK:
+                metrics.inc("errors_total", stage="close_orders")
+                self.app_logger.error(
+                    "Orders batch is failed with %s: %s", r.status_code, r.text
+                )
+                return {}
+            updated: List[Dict[str, Any]] = r.json().get("update", [])
+        except (
+            requests.exceptions.ConnectionError,
+            requests.exceptions.Timeout,
+            ValueError,
+        ):
+            metrics.inc("errors_total", stage="close_orders")
+            self.app_logger.exception("Something bad:")
+            return {}
+
+        results: Dict[str, bool] = {}
+        for item in updated:
+            order_id = str(item.get("id"))
+            if "error" in item:
+                metrics.inc("errors_total", stage="close_orders")
+                self.app_logger.error(
+                    "Order %s is not closed: %s", order_id, item["error"]
+                )
+                results[order_id] = False
+                continue
+            results[order_id] = item.get("status") == "completed"
+        return results
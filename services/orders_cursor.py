@@ -0,0 +1,115 @@
+import json
+import logging
+import os
+from pathlib import Path
+from time import time
+from typing import Any, Dict, List
+
+
+class OrdersCursor:
+    """Persisted high-water mark of fetched orders
+
+    Keeps the `date_modified_gmt` up to which all orders were fetched, ids of
+    orders which are still to be retried, validators of the last
+    orders response (ETag, Last-Modified) and the time of the last full
+    fetch, which is done periodically as a safety net"""
+
+    def __init__(
+        self,
+        *,
+        path: str,
+        full_sync_interval: int,
+        app_logger: logging.Logger,
+    ) -> None:
+        self.path: Path = Path(path)
+        self.full_sync_interval: int = full_sync_interval
+        self.app_logger: logging.Logger = app_logger
+        self.modified_after: str = ""
+        self.pending_ids: List[str] = []
+        self.etag: str = ""
+        self.last_modified: str = ""
+        self.last_full_sync: float = 0.0
+        self._load()
+
+    def _load(self) -> None:
+        if not self.path.exists():
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                state: Dict[str, Any] = json.load(f)
+        except (OSError, ValueError) as ex:
+            self.app_logger.warning("Orders cursor is broken, drop it: %s", ex)
+            return
+        self.modified_after = state.get("modified_after", "")
+        self.pending_ids = state.get("pending_ids", [])
+        self.etag = state.get("etag", "")
+        self.last_modified = state.get("last_modified", "")
+        self.last_full_sync = state.get("last_full_sync", 0.0)
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(f"{self.path.suffix}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "modified_after": self.modified_after,
+                    "pending_ids": self.pending_ids,
+                    "etag": self.etag,
+                    "last_modified": self.last_modified,
+                    "last_full_sync": self.last_full_sync,
+                },
+                f,
+            )
+        os.replace(tmp_path, self.path)
+
+    @property
+    def is_full_sync_due(self) -> bool:
+        return (
+            not self.modified_after
+            or time() - self.last_full_sync >= self.full_sync_interval
+        )
+
+    def conditional_headers(self) -> Dict[str, str]:
+        """Validators of the previous response for the same query
+
+        Returns:
+            Dict[str, str]: If-None-Match / If-Modified-Since headers
+        """
+        headers: Dict[str, str] = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+    def advance(
+        self,
+        *,
+        modified_after: str,
+        pending_ids: List[str],
+        etag: str,
+        last_modified: str,
+        is_full_sync: bool,
+    ) -> None:
+        """Move cursor after a fully fetched and handled run
+
+        Args:
+            modified_after (str): watermark, every processing order
+                modified up to it was fetched
+            pending_ids (List[str]): orders which should be fetched again
+            etag (str): ETag of orders response
+            last_modified (str): Last-Modified of orders response
+            is_full_sync (bool): orders were fetched without cursor
+        """
+        if modified_after > self.modified_after:
+            # validators belong to the query with the previous cursor
+            self.modified_after = modified_after
+            self.etag = ""
+            self.last_modified = ""
+        else:
+            self.etag = etag or self.etag
+            self.last_modified = last_modified or self.last_modified
+        self.pending_ids = pending_ids
+        if is_full_sync:
+            self.last_full_sync = time()
+        self.save()
@@ -1,24 +1,35 @@
 import logging
-from http import HTTPStatus
+from itertools import islice
 from smtplib import (
     SMTPAuthenticationError,
     SMTPDataError,
+    SMTPResponseException,
     SMTPSenderRefused,
     SMTPServerDisconnected,
 )
-from time import sleep
-from typing import Dict, List, Tuple
+from typing import Any, Dict, Iterable, List, Set
 
-import binpacking
 import requests
-from jinja2 import Template
-from yagmail import SMTP
 from yagmail.error import YagAddressError, YagConnectionClosed, YagInvalidEmailAddress
 
 from models.order import Order, Product, ProductFile
-from services.coupon_creater import Coupon, CouponCreater
+from services.attachment_packer import AttachmentPacker, PackingResult
+from services.coupon_creater import (
+    COUPONS_BATCH_SIZE,
+    Coupon,
+    CouponCreater,
+    CouponPool,
+)
+from services.delivery_journal import DeliveryJournal
+from services.link_publisher import LinkPublisher
+from services.order_closer import OrderCloser
+from services.rate_limiter import SendRateLimiter
+from services.smtp_session import SmtpSession
+from services.woocommerce_client import WoocommerceClient
 from utils.config import AppSettings
-from utils.http import HEADERS
+from utils.metrics import metrics
+from utils.resilience import ResilienceError
+from utils.templates import template_registry
 
 EMAIL_SENDING_ERRORS = (
     YagInvalidEmailAddress,
@@ -28,6 +39,8 @@ EMAIL_SENDING_ERRORS = (
     SMTPDataError,
     SMTPServerDisconnected,
     SMTPSenderRefused,
+    SMTPResponseException,
+    OSError,  # network errors left after retries
 )
 
 PRODUCTS_WITHOUT_COUPON: List[str] = [
@@ -44,21 +57,67 @@ class OrdersHandler:
     def __init__(
         self,
         *,
-        orders: List[Order],
+        orders: Iterable[Order],
         settings: AppSettings,
+        wc_client: WoocommerceClient,
         app_logger: logging.Logger,
+        smtp_session: SmtpSession | None = None,
+        rate_limiter: SendRateLimiter | None = None,
+        order_closer: OrderCloser | None = None,
+        journal: DeliveryJournal | None = None,
         email_template: str = "email_template.html",
     ) -> None:
-        self.orders: List[Order] = orders
+        self.pending_orders: Iterable[Order] = orders
+        self.orders: List[Order] = []
+        # a dependency is down or the run deadline is exceeded,
+        # not handled orders are left for the next run
+        self.abort_error: ResilienceError | None = None
         self.settings: AppSettings = settings
         self.app_logger: logging.Logger = app_logger
-        self.auth_pair: Tuple[str, str] = (
-            settings.woocommerce_settings.user_key,
-            settings.woocommerce_settings.secret_key,
-        )
+        self.wc_client: WoocommerceClient = wc_client
         self.email_template = email_template
+        self.owns_smtp_session: bool = smtp_session is None
+        self.smtp_session: SmtpSession = smtp_session or SmtpSession(
+            settings=settings.email_settings, app_logger=app_logger
+        )
+        self.owns_journal: bool = journal is None
+        self.journal: DeliveryJournal = journal or DeliveryJournal(
+            path=settings.journal_path
+        )
+        self.rate_limiter: SendRateLimiter = rate_limiter or SendRateLimiter(
+            rate_limit=settings.email_settings.rate_limit,
+            server=settings.email_settings.smtp_server,
+            app_logger=app_logger,
+            journal=self.journal,
+        )
+        self.order_closer: OrderCloser = order_closer or OrderCloser(
+            wc_client=wc_client,
+            journal=self.journal,
+            app_logger=app_logger,
+            batch_size=settings.woocommerce_settings.close_batch_size,
+            flush_interval=settings.woocommerce_settings.close_flush_interval,
+        )
+        self.coupon_creater: CouponCreater = CouponCreater(
+            client=wc_client, app_logger=app_logger
+        )
+        self.coupon_pool: CouponPool | None = None
+        if settings.coupon_settings.pool_size:
+            self.coupon_pool = CouponPool(
+                creater=self.coupon_creater,
+                path=settings.coupon_settings.pool_path,
+                size=settings.coupon_settings.pool_size,
+                max_age_days=settings.coupon_settings.pool_max_age_days,
+                app_logger=app_logger,
+            )
+        # orders whose coupons batch is rejected, they are sent without coupons
+        self.no_coupon_ids: Set[str] = set()
+        self.link_publisher: LinkPublisher = LinkPublisher(
+            settings=settings.link_settings,
+            max_message_size=settings.email_settings.max_attachment_size,
+            app_logger=app_logger,
+        )
 
-    def _get_order_info(self, *, order: Order) -> Dict[str, str]:
+    def _get_order_info(self, *, order: Order) -> Dict[str, Any]:
         email_lines: List[str] = ['<p><b color="blue">Состав заказа:</b></p><ul>']
         for product in order.products:
             product_description = (
@@ -72,11 +131,21 @@ class OrdersHandler:
         self._add_coupon_if_order_ok(order, email_lines)
 
         email_message: str = "".join(email_lines)
+        links: List[Dict[str, str]] = []
+        if not order.missing_files:
+            links = self.link_publisher.publish(
+                [
+                    file
+                    for file in order.total_files
+                    if self.link_publisher.should_link(file)
+                ]
+            )
         return {
             "first_name": order.first_name,
             "last_name": order.last_name,
             "id": order.id,
             "email_message": email_message,
+            "links": links,
         }
 
     def _check_products_for_discount(self, order: Order) -> bool:
@@ -92,19 +161,95 @@ class OrdersHandler:
 
         return len(products_without_discount) == len(order.products)
 
+    def _is_coupon_allowed(self, order: Order) -> bool:
+        return not (
+            order.total <= 0
+            or order.missing_files
+            or self._check_products_for_discount(order)
+        )
+
+    def _create_coupons(self, orders: List[Order]) -> List[Coupon | None]:
+        """Create coupons in one batch, if woocommerce rejects the batch
+        orders are sent without coupons
+
+        Args:
+            orders (List[Order]): orders without coupons
+
+        Returns:
+            List[Coupon | None]: coupons in the same order
+        """
+        try:
+            return self.coupon_creater.create_batch(
+                customers=[(order.total, order.first_name) for order in orders]
+            )
+        except requests.exceptions.RequestException as ex:
+            metrics.inc("errors_total", stage="coupon_upload")
+            for order in orders:
+                self.app_logger.error(
+                    "Order %s is sent without coupon: %s", order.id, ex
+                )
+            return [None] * len(orders)
+
+    def _prepare_coupons(self, orders: List[Order]) -> None:
+        """Create coupons for orders in advance,
+        pooled coupons are used first, the rest are created in one batch.
+        Coupons are journaled right away, so an interrupted run doesn't
+        leave them orphaned and a retried order gets the same coupon.
+        Orders which are already sent get no coupons
+
+        Args:
+            orders (List[Order]): orders to prepare coupons for
+        """
+        orders_without_coupon: List[Order] = []
+        for order in orders:
+            if (
+                not self._is_coupon_allowed(order)
+                or self.journal.is_sent(order.id)
+                or self.journal.get_coupon(order.id)
+            ):
+                continue
+            coupon: Coupon | None = None
+            if self.coupon_pool is not None:
+                coupon = self.coupon_pool.take(total=order.total)
+            if coupon is None:
+                orders_without_coupon.append(order)
+                continue
+            self.journal.record_coupon(order.id, coupon)
+
+        if not orders_without_coupon:
+            return
+        coupons: List[Coupon | None] = self._create_coupons(orders_without_coupon)
+        for order, coupon in zip(orders_without_coupon, coupons):
+            if coupon is None:
+                self.no_coupon_ids.add(order.id)
+                continue
+            self.journal.record_coupon(order.id, coupon)
+
+    def _get_coupon(self, order: Order) -> Coupon | None:
+        # the same coupon is resent if the order is resumed
+        coupon = self.journal.get_coupon(order.id)
+        if coupon is not None:
+            return coupon
+        if order.id in self.no_coupon_ids:
+            self.no_coupon_ids.discard(order.id)
+            return None
+        if self.coupon_pool is not None:
+            coupon = self.coupon_pool.take(total=order.total)
+        if coupon is None:
+            coupon = self._create_coupons([order])[0]
+        if coupon is not None:
+            self.journal.record_coupon(order.id, coupon)
+        return coupon
+
     def _add_coupon_if_order_ok(
         self,
         order: Order,
         email_lines: List[str],
     ):
-        if order.total <= 0 or self._check_products_for_discount(order):
+        if not self._is_coupon_allowed(order):
             return
 
-        coupon: Coupon | None = CouponCreater(
-            total=order.total,
-            name=order.first_name,
-            settings=self.settings.woocommerce_settings,
-        )()
+        coupon: Coupon | None = self._get_coupon(order)
         if coupon is None:
             return
 
@@ -120,69 +265,102 @@ class OrdersHandler:
             )
         )
 
-    @staticmethod
-    def _split_files(
-        *,
-        files: List[ProductFile],
-        max_attachment_size: int,
-        maximum_filling: float = 0.8,
-    ) -> List[List[str]]:
-        """Split list of files by max capacity
+    def _split_files(self, *, files: List[ProductFile], body: str) -> PackingResult:
+        """Split files into the minimum number of emails,
+        every email fits max_attachment_size after encoding
 
         Args:
-            files (List[ProductFile]): _description_
-            max_attachment_size (int): _description_
-            maximum_filling (float, optional): _description_. Defaults to 0.8.
+            files (List[ProductFile]): order files
+            body (str): rendered email body
 
         Returns:
-            List[List[str]]: _description_
+            PackingResult: files of every email and files
+                which don't fit into an email even alone
         """
+        return AttachmentPacker(
+            max_message_size=self.settings.email_settings.max_attachment_size,
+            body_size=len(body.encode()),
+        ).pack(files)
 
-        bins = binpacking.to_constant_volume(
-            d={file.file_name: file.file_size for file in files},
-            V_max=int(max_attachment_size * maximum_filling),
-        )
-        return [[file_name for file_name in bin] for bin in bins]
-
-    def _send_order_email(self, *, order: Order) -> bool:
+    def _send_order_email(
+        self,
+        *,
+        order: Order,
+        order_info: Dict[str, Any] | None = None,
+        smtp_session: SmtpSession | None = None,
+    ) -> bool:
         """Create email message and send it
 
         Args:
             order (Order): _description_
+            order_info (Dict[str, Any] | None, optional): prepared order info.
+                Defaults to None, then it's prepared here.
+            smtp_session (SmtpSession | None, optional): session to send with.
+                Defaults to None, then the handler session is used.
 
         Returns:
             bool: _description_
         """
-        order_info: Dict[str, str] = self._get_order_info(order=order)
-        with open("email_template.html", "rb") as f:
-            html = f.read().decode("UTF-8")
-        template: Template = Template(html)
-
-        if (
-            sum((file.file_size for file in order.total_files))
-            <= self.settings.email_settings.max_attachment_size
-        ):
-            return self._send_email(
-                to_email=order.email,
-                subject=f"Заказ №{order.id}",
-                contents=[template.render(**order_info)],
-                attachments=[file.file_name for file in order.total_files],
+        if order.missing_files:
+            self.app_logger.error(
+                "Order %s is not sent, files are missing: %s",
+                order.id,
+                ", ".join(order.missing_files),
             )
-        # Splitted logic
-        splitted_files: List[List[str]] = OrdersHandler._split_files(
-            files=order.total_files,
-            max_attachment_size=self.settings.email_settings.max_attachment_size,
+            return False
+        if self.journal.is_sent(order.id):
+            self.app_logger.info("Order %s is already sent, only close it", order.id)
+            return True
+        if order_info is None:
+            order_info = self._get_order_info(order=order)
+        # rendered once, all parts of a splitted order share the body
+        body: str = template_registry.get(self.email_template).render(**order_info)
+
+        # large files are delivered by links from the rendered body
+        linked_files: Set[str] = {link["file_name"] for link in order_info["links"]}
+        packing: PackingResult = self._split_files(
+            files=[
+                file for file in order.total_files if file.file_name not in linked_files
+            ],
+            body=body,
         )
+        if packing.oversized:
+            order.oversized_files = [file.file_name for file in packing.oversized]
+            self.app_logger.error(
+                "Order %s is not sent, files are larger than an email: %s",
+                order.id,
+                ", ".join(order.oversized_files),
+            )
+            return False
+        splitted_files: List[List[ProductFile]] = packing.packs or [[]]
+        if len(splitted_files) == 1:
+            subjects: List[str] = [f"Заказ №{order.id}"]
+        else:
+            subjects = [
+                f"Заказ №{order.id} - часть {pack_index+1}"
+                for pack_index in range(len(splitted_files))
+            ]
+        self.journal.record_rendered(order.id, parts_total=len(splitted_files))
+
         results: List[bool] = []
-        for pack_index, file_pack in enumerate(splitted_files):
-            results.append(
-                self._send_email(
-                    to_email=order.email,
-                    subject=f"Заказ №{order.id} - часть {pack_index+1}",
-                    contents=[template.render(**order_info)],
-                    attachments=file_pack,
-                )
+        for subject, file_pack in zip(subjects, splitted_files):
+            part_key: str = self.journal.part_key(file_pack)
+            if self.journal.is_part_sent(order.id, part_key):
+                self.app_logger.info("Order %s: %s is already sent", order.id, subject)
+                results.append(True)
+                continue
+            is_sent: bool = self._send_email(
+                to_email=order.email,
+                subject=subject,
+                contents=[body],
+                attachments=file_pack,
+                smtp_session=smtp_session,
             )
+            if is_sent:
+                self.journal.record_part_sent(order.id, part_key)
+            results.append(is_sent)
+        if all(results):
+            self.journal.record_sent(order.id)
         return all(results)
 
     def _send_email(
@@ -190,76 +368,67 @@ class OrdersHandler:
         *,
         to_email: str,
         subject: str,
-        attachments: List[str],
+        attachments: List[ProductFile],
         contents,
+        smtp_session: SmtpSession | None = None,
     ) -> bool:
-        """Send email with yagmail
+        """Send email over the shared smtp session
 
         Args:
             to_email (str): _description_
             subject (str): _description_
-            attachments (List[str]): _description_
+            attachments (List[ProductFile]): _description_
             contents (_type_): _description_
+            smtp_session (SmtpSession | None, optional): Defaults to None.
 
         Returns:
             bool: _description_
         """
+        smtp_session = smtp_session or self.smtp_session
         try:
-            email_settings = self.settings.email_settings
-
-            yag = SMTP(
-                user={email_settings.sender: email_settings.display_name},
-                password=email_settings.password,
-                smtp_ssl=True,
-                host=email_settings.smtp_server,
-                port=int(email_settings.smtp_port),
-            )
-            yag.send(
-                to=to_email,
+            recipients, message = smtp_session.prepare(
+                to_email=to_email,
                 subject=subject,
                 contents=contents,
                 attachments=attachments,
             )
+            # throttling isn't a part of sending latency
+            self.rate_limiter.acquire(len(message))
+            with metrics.timer("send_email"):
+                smtp_session.sendmail(recipients=recipients, message=message)
+            metrics.inc("bytes_total", len(message), stage="send_email")
             return True
 
         except EMAIL_SENDING_ERRORS as ex:
             self.app_logger.exception(f"Everything is bad:{ex}")
             return False
 
-    def _handle_order(self, *, order: Order) -> bool:
-        """Send email and change status if email is ok
+    def _handle_order(self, *, order: Order) -> None:
+        """Send email and queue order closing if email is ok,
+        order status is set when the closing batch is flushed
 
         Args:
             order (Order): _description_
-
-        Returns:
-            bool: _description_
         """
-
+        order.status = False
         if self._send_order_email(order=order):
-            return self._close_order(order=order)
-
-        return False
+            self._close_order(order=order)
 
-    def _close_order(self, *, order: Order) -> bool:
-        """Close woocommerce order
+    def _close_order(self, *, order: Order) -> None:
+        """Queue woocommerce order closing
 
         Args:
             order (Order): _description_
         """
-        try:
-            put_url = f"{self.settings.woocommerce_settings.url}/orders/{order.id}"
-            session = requests.Session()
-            session.headers = HEADERS
-            r = session.put(
-                put_url, auth=self.auth_pair, params={"status": "completed"}
-            )
-            if r.status_code == HTTPStatus.OK:
-                return True
-        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
-            self.app_logger.exception("Something bad:")
+        self.order_closer.enqueue(order)
 
-        return False
+    @staticmethod
+    def _format_missing_files(order: Order) -> str:
+        if order.oversized_files:
+            return f" (слишком большие файлы: {', '.join(order.oversized_files)})"
+        if not order.missing_files:
+            return ""
+        return f" (нет файлов: {', '.join(order.missing_files)})"
 
     def _create_result_message(self) -> str:
         """Create result handle meassage
@@ -267,33 +436,114 @@ class OrdersHandler:
         Returns:
             str: _description_
         """
-        message_lines: List[str] = []
-        total: float = 0.0
-        bad_orders = []
-        for order in self.orders:
-            if order.status is False:
-                bad_orders.append(order)
-                continue
-            products = "\n".join([f" · {product.name}" for product in order.products])
-            message_lines.append(
-                f"№ {order.id} - {order.first_name} {order.last_name}, {order.email}\n{products}\n{order.total} руб."
-            )
-            total += order.total
-        if len(self.orders) > 1:
-            message_lines.append(f"Всего {len(self.orders)} заказов на {total} руб.")
-        if bad_orders:
-            message_lines.append("Ошибки:")
-            message_lines.append(
-                ", ".join(
-                    [f"{bad_order.id} - {bad_order.email}" for bad_order in bad_orders]
-                )
-            )
-        return "\n".join(message_lines)
-
-    def handle(self, *, timeout=45) -> str:
-        for order_index, order in enumerate(self.orders):
-            self.orders[order_index].status = self._handle_order(order=order)
-            if order_index + 1 == len(self.orders):
-                break
-            sleep(timeout)
+        return create_result_message(
+            orders=self.orders,
+            throttled_seconds=self.rate_limiter.throttled_seconds,
+            abort_reason=str(self.abort_error or ""),
+        )
+
+    @property
+    def is_aborted(self) -> bool:
+        return self.abort_error is not None
+
+    def abort(self, error: ResilienceError) -> None:
+        """Stop handling, the run fails fast instead of waiting for every order
+
+        Args:
+            error (ResilienceError): unavailable dependency or exceeded deadline
+        """
+        self.abort_error = error
+        self.app_logger.error(
+            "Handling is stopped after %s orders: %s", len(self.orders), error
+        )
+
+    def flush_closer(self) -> None:
+        """Close queued orders at the end of handling,
+        an unavailable woocommerce stops the run like other stages"""
+        try:
+            self.order_closer.flush()
+        except ResilienceError as ex:
+            if not self.is_aborted:
+                self.abort(ex)
+
+    def handle(self) -> str:
+        """Handle orders as they come from the fetcher,
+        sending is throttled by the rate limiter only when needed
+
+        Returns:
+            str: result message
+        """
+        if self.coupon_pool is not None:
+            self.coupon_pool.refill_in_background()
+        pending_orders = iter(self.pending_orders)
+        try:
+            while orders := list(islice(pending_orders, COUPONS_BATCH_SIZE)):
+                self._prepare_coupons(orders)
+                for order in orders:
+                    self._handle_order(order=order)
+                    self.orders.append(order)
+                    self.order_closer.flush_if_due()
+        except ResilienceError as ex:
+            self.abort(ex)
+        finally:
+            self.flush_closer()
+            if self.coupon_pool is not None:
+                self.coupon_pool.wait()
+            if self.owns_smtp_session:
+                self.smtp_session.close()
+            if self.owns_journal:
+                self.journal.close()
         return self._create_result_message()
+
+
+def create_result_message(
+    *,
+    orders: List[Order],
+    throttled_seconds: float = 0.0,
+    abort_reason: str = "",
+) -> str:
+    """Create result handle meassage
+
+    Args:
+        orders (List[Order]): handled orders
+        throttled_seconds (float, optional): time waited for smtp limits.
+            Defaults to 0.0.
+        abort_reason (str, optional): reason of the stopped handling.
+            Defaults to "".
+
+    Returns:
+        str: _description_
+    """
+    message_lines: List[str] = []
+    total: float = 0.0
+    bad_orders = []
+    for order in orders:
+        if order.status is False:
+            bad_orders.append(order)
+            continue
+        products = "\n".join([f" · {product.name}" for product in order.products])
+        message_lines.append(
+            f"№ {order.id} - {order.first_name} {order.last_name}, {order.email}\n{products}\n{order.total} руб."
+        )
+        total += order.total
+    if len(orders) > 1:
+        message_lines.append(f"Всего {len(orders)} заказов на {total} руб.")
+    if bad_orders:
+        message_lines.append("Ошибки:")
+        message_lines.append(
+            ", ".join(
+                [
+                    f"{bad_order.id} - {bad_order.email}"
+                    + OrdersHandler._format_missing_files(bad_order)
+                    for bad_order in bad_orders
+                ]
+            )
+        )
+    if throttled_seconds:
+        message_lines.append(f"Ожидание лимитов SMTP: {throttled_seconds:.0f} с.")
+    if abort_reason:
+        message_lines.append(
+            f"Обработка остановлена: {abort_reason}. "
+            "Остальные заказы будут отправлены в следующем запуске."
+        )
+    return "\n".join(message_lines)
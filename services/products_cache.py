@@ -0,0 +1,116 @@
+import json
+import logging
+import os
+from pathlib import Path
+from time import time
+from typing import Any, Dict, Iterable, List
+
+ProductInfo = Dict[str, Any]
+
+
+class ProductsCache:
+    """On-disk cache of products metadata (purchase_note, downloads)
+
+    Entries are kept with the time they were fetched and
+    the product `date_modified_gmt`, so expired entries can be
+    revalidated with a cheap `modified_after` request"""
+
+    def __init__(
+        self,
+        *,
+        path: str,
+        ttl: int,
+        app_logger: logging.Logger,
+    ) -> None:
+        self.path: Path = Path(path)
+        self.ttl: int = ttl
+        self.app_logger: logging.Logger = app_logger
+        self.entries: Dict[str, ProductInfo] = {}
+        self.is_changed: bool = False
+        self.load()
+
+    def load(self) -> None:
+        """Read cache file if it exists"""
+        if not self.path.exists():
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError) as ex:
+            self.app_logger.warning("Products cache is broken, drop it: %s", ex)
+            self.entries = {}
+
+    def save(self) -> None:
+        """Atomically write cache file if something was changed"""
+        if not self.is_changed:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(f"{self.path.suffix}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        self.is_changed = False
+
+    def get(self, product_id: int) -> ProductInfo | None:
+        """Get cached product regardless of its age
+
+        Args:
+            product_id (int): woocommerce product id
+
+        Returns:
+            ProductInfo | None: cached product
+        """
+        return self.entries.get(str(product_id))
+
+    def is_expired(self, product_id: int) -> bool:
+        """Check if product should be revalidated
+
+        Args:
+            product_id (int): woocommerce product id
+
+        Returns:
+            bool: True if entry is older than ttl
+        """
+        entry = self.get(product_id)
+        return entry is None or time() - entry["fetched_at"] > self.ttl
+
+    def oldest_modified(self, product_ids: Iterable[int]) -> str:
+        """Get the earliest modification date of cached products
+
+        Args:
+            product_ids (Iterable[int]): cached products ids
+
+        Returns:
+            str: date in woocommerce gmt format
+        """
+        return min(
+            self.entries[str(product_id)]["modified"] for product_id in product_ids
+        )
+
+    def put(self, product_info: ProductInfo) -> None:
+        """Store product from woocommerce response
+
+        Args:
+            product_info (ProductInfo): woocommerce product
+        """
+        self.entries[str(product_info["id"])] = {
+            "purchase_note": product_info.get("purchase_note", ""),
+            "downloads": [
+                {"file": download["file"]}
+                for download in product_info.get("downloads", [])
+            ],
+            "modified": product_info.get("date_modified_gmt") or "",
+            "fetched_at": time(),
+        }
+        self.is_changed = True
+
+    def touch(self, product_ids: List[int]) -> None:
+        """Mark products as revalidated without changes
+
+        Args:
+            product_ids (List[int]): unchanged products ids
+        """
+        now = time()
+        for product_id in product_ids:
+            self.entries[str(product_id)]["fetched_at"] = now
+        self.is_changed = bool(product_ids) or self.is_changed
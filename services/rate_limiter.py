@@ -0,0 +1,115 @@
+import logging
+from functools import partial
+from threading import Lock
+from time import sleep, time
+from typing import Tuple
+
+from services.delivery_journal import DeliveryJournal
+from utils.config import SmtpRateLimit
+
+
+class TokenBucket:
+    """Token bucket which allows a deficit
+
+    A request bigger than the bucket isn't rejected,
+    it just makes the next requests wait longer.
+    With a journal the bucket state is kept in it, so the next run
+    or another worker process doesn't start with a full bucket"""
+
+    def __init__(
+        self,
+        *,
+        rate: float,
+        capacity: float,
+        name: str = "",
+        journal: DeliveryJournal | None = None,
+    ) -> None:
+        self.rate: float = rate
+        self.capacity: float = capacity
+        self.name: str = name
+        self.journal: DeliveryJournal | None = journal
+        self.tokens: float = capacity
+        self.updated_at: float = time()
+
+    def _take(
+        self, amount: float, tokens: float | None, updated_at: float | None
+    ) -> Tuple[float, float]:
+        now = time()
+        if tokens is None or updated_at is None:
+            return self.capacity - amount, now
+        # wall clock is shared by processes, but it can go back
+        refilled = max(0.0, now - updated_at) * self.rate
+        return min(self.capacity, tokens + refilled) - amount, now
+
+    def reserve(self, amount: float) -> float:
+        """Take tokens
+
+        Args:
+            amount (float): tokens to take
+
+        Returns:
+            float: seconds to wait before the reserved amount is available
+        """
+        if self.journal is None:
+            self.tokens, self.updated_at = self._take(
+                amount, self.tokens, self.updated_at
+            )
+        else:
+            self.tokens, self.updated_at = self.journal.update_bucket(
+                self.name, partial(self._take, amount)
+            )
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+
+class SendRateLimiter:
+    """Limit emails sending by messages and bytes budget of smtp provider
+
+    Buckets are kept in the journal when it's given, so the budget
+    is shared by cron runs, the daemon and worker processes.
+    Buckets are named by smtp server, every provider has its own budget"""
+
+    def __init__(
+        self,
+        *,
+        rate_limit: SmtpRateLimit,
+        server: str,
+        app_logger: logging.Logger,
+        journal: DeliveryJournal | None = None,
+    ) -> None:
+        self.app_logger: logging.Logger = app_logger
+        self.messages_bucket: TokenBucket = TokenBucket(
+            rate=rate_limit.messages_per_minute / 60,
+            capacity=rate_limit.burst_size,
+            name=f"smtp_messages:{server}",
+            journal=journal,
+        )
+        self.bytes_bucket: TokenBucket = TokenBucket(
+            rate=rate_limit.bytes_per_hour / 3600,
+            capacity=rate_limit.bytes_per_hour,
+            name=f"smtp_bytes:{server}",
+            journal=journal,
+        )
+        self.lock: Lock = Lock()
+        self.throttled_seconds: float = 0.0
+
+    def acquire(self, message_size: int) -> float:
+        """Wait until message can be sent
+
+        Args:
+            message_size (int): message size in bytes
+
+        Returns:
+            float: seconds spent in throttling
+        """
+        with self.lock:
+            wait = max(
+                self.messages_bucket.reserve(1),
+                self.bytes_bucket.reserve(message_size),
+            )
+            self.throttled_seconds += wait
+        if wait > 0:
+            self.app_logger.info("SMTP budget is used up, wait %.1f s", wait)
+            sleep(wait)
+        return wait
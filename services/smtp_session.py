@@ -0,0 +1,232 @@
+import logging
+import smtplib
+from smtplib import SMTPServerDisconnected
+from time import monotonic
+from typing import List, Tuple
+
+from yagmail import SMTP
+from yagmail.error import YagConnectionClosed
+
+from models.order import ProductFile
+from services.attachment_cache import AttachmentCache
+from utils.cassette import cassette
+from utils.config import EmailSettings
+from utils.metrics import metrics
+from utils.resilience import resilience
+
+
+class DeliveryUnknownError(smtplib.SMTPException):
+    """Connection is lost after DATA was sent, the message could be
+    delivered, so it isn't sent again"""
+
+
+class SmtpConnection(smtplib.SMTP):
+    """Smtp connection which tells if DATA of the current message was sent"""
+
+    is_data_sent: bool = False
+
+    def data(self, msg):
+        self.is_data_sent = True
+        return super().data(msg)
+
+
+class SmtpSslConnection(SmtpConnection, smtplib.SMTP_SSL):
+    pass
+
+
+def _is_network_error(error: Exception) -> bool:
+    """Lost connection or socket error, smtplib errors are OSError as well,
+    but only a disconnect of them leaves the connection state unknown"""
+    if isinstance(error, (SMTPServerDisconnected, YagConnectionClosed)):
+        return True
+    return isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException)
+
+
+def _is_transient(error: Exception) -> bool:
+    """Network errors before DATA and 4xx replies, e.g. 421 service not available"""
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    return _is_network_error(error)
+
+
+class SmtpSession:
+    """Long-lived authenticated smtp connection
+
+    yagmail logins on every `send`, so it's used only to build messages.
+    Messages are sent over one connection which is reopened when
+    the server drops it and recycled after `messages_per_connection`.
+    Attachments are taken ready encoded from the attachment cache"""
+
+    def __init__(
+        self,
+        *,
+        settings: EmailSettings,
+        app_logger: logging.Logger,
+        attachment_cache: AttachmentCache | None = None,
+    ) -> None:
+        self.settings: EmailSettings = settings
+        self.app_logger: logging.Logger = app_logger
+        if attachment_cache is None and settings.attachments_cache_dir:
+            attachment_cache = AttachmentCache(
+                cache_dir=settings.attachments_cache_dir, app_logger=app_logger
+            )
+        self.attachment_cache: AttachmentCache | None = attachment_cache
+        self.yag: SMTP = SMTP(
+            user={settings.sender: settings.display_name},
+            password=settings.password,
+            smtp_ssl=True,
+            host=settings.smtp_server,
+            port=int(settings.smtp_port),
+        )
+        self.connection: SmtpConnection | None = None
+        self.sent_on_connection: int = 0
+
+    def __enter__(self) -> "SmtpSession":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def _connect(self, timeout: float) -> SmtpConnection:
+        smtp_class = SmtpSslConnection if self.settings.smtp_ssl else SmtpConnection
+        connection = smtp_class(
+            host=self.settings.smtp_server,
+            port=int(self.settings.smtp_port),
+            timeout=timeout,
+        )
+        connection.login(self.settings.sender, self.settings.password)
+        self.sent_on_connection = 0
+        return connection
+
+    def close(self) -> None:
+        """Quit smtp server, connection errors are ignored"""
+        if self.connection is None:
+            return
+        try:
+            self.connection.quit()
+        except (smtplib.SMTPException, OSError):
+            self.connection.close()
+        self.connection = None
+
+    def prepare(
+        self,
+        *,
+        to_email: str,
+        subject: str,
+        contents,
+        attachments: List[ProductFile],
+    ) -> Tuple[List[str], str | bytes]:
+        """Build message with yagmail, attachments are added from the cache
+
+        Returns:
+            Tuple[List[str], str | bytes]: recipients and message
+        """
+        if self.attachment_cache is None:
+            return self.yag.prepare_send(
+                to=to_email,
+                subject=subject,
+                contents=contents,
+                attachments=[file.file_name for file in attachments],
+            )
+        recipients, message = self.yag.prepare_send(
+            to=to_email,
+            subject=subject,
+            contents=contents,
+        )
+        return recipients, self.attachment_cache.attach(
+            message=message, attachments=attachments
+        )
+
+    def sendmail(self, *, recipients: List[str], message: str | bytes) -> None:
+        """Send prepared message, reconnecting once if connection is lost
+
+        Args:
+            recipients (List[str]): envelope recipients
+            message (str | bytes): prepared message
+
+        Raises:
+            ResilienceError: smtp circuit is open or the run deadline
+                is exceeded
+        """
+        resilience.call(
+            "smtp",
+            lambda timeout: self._send_recorded(
+                recipients=recipients, message=message, timeout=timeout
+            ),
+            timeout=self.settings.smtp_timeout,
+            is_transient=_is_transient,
+        )
+
+    def _send_recorded(
+        self, *, recipients: List[str], message: str | bytes, timeout: float
+    ) -> None:
+        if cassette.is_replaying:
+            cassette.replay_smtp()
+            return
+        if not cassette.is_recording:
+            self._sendmail(recipients=recipients, message=message, timeout=timeout)
+            return
+        started = monotonic()
+        try:
+            self._sendmail(recipients=recipients, message=message, timeout=timeout)
+        except (smtplib.SMTPException, OSError) as ex:
+            cassette.record_smtp(
+                recipients=len(recipients),
+                size=len(message),
+                started=started,
+                error=ex,
+            )
+            raise
+        cassette.record_smtp(
+            recipients=len(recipients), size=len(message), started=started
+        )
+
+    def _sendmail(
+        self, *, recipients: List[str], message: str | bytes, timeout: float
+    ) -> None:
+        if self.sent_on_connection >= self.settings.messages_per_connection:
+            self.close()
+        for attempt in range(2):
+            is_reused: bool = self.connection is not None
+            if self.connection is None:
+                self.connection = self._connect(timeout)
+            elif self.connection.sock is not None:
+                self.connection.sock.settimeout(timeout)
+            connection: SmtpConnection = self.connection
+            connection.is_data_sent = False
+            try:
+                connection.sendmail(self.settings.sender, recipients, message)
+                self.sent_on_connection += 1
+                return
+            except Exception as ex:
+                if not _is_network_error(ex):
+                    raise
+                # the connection is in an unknown state, e.g. in the middle
+                # of DATA, it's never reused
+                connection.close()
+                self.connection = None
+                if connection.is_data_sent:
+                    raise DeliveryUnknownError(
+                        f"Connection is lost after DATA, "
+                        f"the message could be delivered: {ex}"
+                    ) from ex
+                if attempt or not is_reused:
+                    raise
+                metrics.inc("retries_total", stage="send_email")
+                self.app_logger.warning("SMTP connection is lost, reconnect: %s", ex)
+
+    def send(
+        self,
+        *,
+        to_email: str,
+        subject: str,
+        contents,
+        attachments: List[ProductFile],
+    ) -> None:
+        recipients, message = self.prepare(
+            to_email=to_email,
+            subject=subject,
+            contents=contents,
+            attachments=attachments,
+        )
+        self.sendmail(recipients=recipients, message=message)
@@ -1,31 +1,137 @@
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from time import sleep
+from typing import Dict, List
 
-import telebot
-from telebot import apihelper
+import requests
 
 from utils.config import TelegramSettrings
+from utils.metrics import metrics
+from utils.resilience import ResilienceError
+from utils.telegram import MESSAGE_LIMIT, TelegramClient, TelegramError, split_message
+
+ORDER_PREFIX: str = "№ "
+MAX_RETRIES: int = 3
+
+
+@dataclass(frozen=True, slots=True)
+class DeliveryResult:
+    chat_id: str
+    sent_chunks: int
+    total_chunks: int
+    error: str = ""
+
+    @property
+    def is_delivered(self) -> bool:
+        return self.sent_chunks == self.total_chunks
 
 
 class TelegramNoticifier:
-    """Simple telegram noticifier"""
+    """Simple telegram noticifier
+
+    Long reports are split on orders boundaries, all users
+    get them concurrently over one pooled client"""
 
     def __init__(
         self, *, settings: TelegramSettrings, app_logger: logging.Logger
     ) -> None:
         self.settings: TelegramSettrings = settings
-        if settings.proxy:
-            apihelper.proxy = {
-                "http": settings.proxy,
-                "https": settings.proxy,
-            }
         self.app_logger: logging.Logger = app_logger
-        self.bot = telebot.TeleBot(self.settings.bot_token)
+        self.client: TelegramClient = TelegramClient(
+            bot_token=settings.bot_token,
+            api_url=settings.api_url,
+            proxy=settings.proxy,
+            pool_size=max(len(settings.users_id), 1),
+        )
+
+    @staticmethod
+    def _split_report(message: str, limit: int = MESSAGE_LIMIT) -> List[str]:
+        """Split report into messages, an order is never torn apart
+        unless it alone is longer than the limit
+
+        Args:
+            message (str): report
+            limit (int, optional): message limit. Defaults to MESSAGE_LIMIT.
 
-    def send_result_to_telegram(self, *, message: str):
+        Returns:
+            List[str]: messages
+        """
+        blocks: List[str] = []
+        for line in message.split("\n"):
+            if blocks and not line.startswith(ORDER_PREFIX):
+                blocks[-1] = f"{blocks[-1]}\n{line}"
+                continue
+            blocks.append(line)
+
+        chunks: List[str] = []
+        for block in blocks:
+            if chunks and len(chunks[-1]) + 1 + len(block) <= limit:
+                chunks[-1] = f"{chunks[-1]}\n{block}"
+                continue
+            chunks.extend(split_message(block, limit=limit))
+        return chunks
+
+    def _send_chunk(self, *, chat_id: str, text: str) -> None:
+        for attempt in range(MAX_RETRIES):
+            try:
+                self.client.send_message(chat_id=chat_id, text=text)
+                metrics.inc("bytes_total", len(text.encode()), stage="telegram")
+                return
+            except TelegramError as ex:
+                if not ex.retry_after or attempt == MAX_RETRIES - 1:
+                    raise
+                metrics.inc("retries_total", stage="telegram")
+                self.app_logger.warning(
+                    "Telegram asks to retry after %s s", ex.retry_after
+                )
+                sleep(ex.retry_after)
+
+    def _deliver(self, *, chat_id: str, chunks: List[str]) -> DeliveryResult:
+        for sent_chunks, chunk in enumerate(chunks):
+            try:
+                self._send_chunk(chat_id=chat_id, text=chunk)
+            except (
+                TelegramError,
+                requests.exceptions.RequestException,
+                ResilienceError,
+            ) as ex:
+                metrics.inc("errors_total", stage="telegram")
+                self.app_logger.error("Report is not sent to %s: %s", chat_id, ex)
+                return DeliveryResult(
+                    chat_id=chat_id,
+                    sent_chunks=sent_chunks,
+                    total_chunks=len(chunks),
+                    error=str(ex),
+                )
+        return DeliveryResult(
+            chat_id=chat_id, sent_chunks=len(chunks), total_chunks=len(chunks)
+        )
+
+    @metrics.timed("telegram")
+    def send_result_to_telegram(self, *, message: str) -> Dict[str, DeliveryResult]:
         """Send message for users
 
         Args:
             message (str): _description_
+
+        Returns:
+            Dict[str, DeliveryResult]: delivery result by user id
         """
-        for user_id in self.settings.users_id:
-            self.bot.send_message(chat_id=user_id, text=message)
+        chunks: List[str] = self._split_report(message)
+        users_id: List[str] = [user_id for user_id in self.settings.users_id if user_id]
+        if not chunks or not users_id:
+            return {}
+        with ThreadPoolExecutor(
+            max_workers=len(users_id), thread_name_prefix="telegram"
+        ) as executor:
+            results: List[DeliveryResult] = list(
+                executor.map(
+                    lambda user_id: self._deliver(chat_id=user_id, chunks=chunks),
+                    users_id,
+                )
+            )
+        return {result.chat_id: result for result in results}
+
+    def close(self) -> None:
+        self.client.close()
@@ -0,0 +1,132 @@
+from http import HTTPStatus
+from time import monotonic
+from typing import Any, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils.cassette import CassetteMiss, cassette
+from utils.config import WoocommerceSettings
+from utils.http import HEADERS
+from utils.resilience import resilience
+
+TRANSIENT_ERRORS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+)
+
+
+def _is_transient(error: Exception) -> bool:
+    return isinstance(error, TRANSIENT_ERRORS) and not isinstance(error, CassetteMiss)
+
+
+def _is_failed(response: requests.Response) -> bool:
+    return (
+        response.status_code >= HTTPStatus.INTERNAL_SERVER_ERROR
+        or response.status_code == HTTPStatus.TOO_MANY_REQUESTS
+    )
+
+
+class WoocommerceClient:
+    """Shared woocommerce rest api client
+
+    Keeps one pooled keep-alive session for the whole run,
+    so every request doesn't pay for a new TCP and TLS handshake"""
+
+    def __init__(self, *, settings: WoocommerceSettings) -> None:
+        self.url: str = settings.url
+        self.timeout: Tuple[float, float] = (
+            settings.connect_timeout,
+            settings.read_timeout,
+        )
+        self.session: requests.Session = requests.Session()
+        self.session.headers.update(HEADERS)
+        self.session.auth = (settings.user_key, settings.secret_key)
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=settings.pool_size,
+            pool_block=True,
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def __enter__(self) -> "WoocommerceClient":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def request(self, method: str, path: str, **kwargs: Any) -> requests.Response:
+        """Send request to woocommerce api, network errors and 5xx/429
+        responses are retried within the run deadline
+
+        Args:
+            method (str): http method
+            path (str): api path relative to settings url, e.g. "orders"
+
+        Raises:
+            ResilienceError: woocommerce circuit is open or the run deadline
+                is exceeded
+
+        Returns:
+            requests.Response: response
+        """
+        timeout = kwargs.pop("timeout", self.timeout)
+        connect_timeout, read_timeout = (
+            timeout if isinstance(timeout, tuple) else (timeout, timeout)
+        )
+        return resilience.call(
+            "woocommerce",
+            lambda call_timeout: self._request(
+                method,
+                path,
+                timeout=(min(connect_timeout, call_timeout), call_timeout),
+                **kwargs,
+            ),
+            timeout=read_timeout,
+            is_transient=_is_transient,
+            is_failed=_is_failed,
+        )
+
+    def _request(self, method: str, path: str, **kwargs: Any) -> requests.Response:
+        if cassette.is_replaying:
+            return cassette.replay_wc(
+                method=method, path=path, params=kwargs.get("params")
+            )
+        started = monotonic()
+        try:
+            response = self.session.request(
+                method, f"{self.url}/{path.lstrip('/')}", **kwargs
+            )
+        except requests.exceptions.RequestException as error:
+            if cassette.is_recording:
+                cassette.record_wc(
+                    method=method,
+                    path=path,
+                    params=kwargs.get("params"),
+                    started=started,
+                    error=error,
+                )
+            raise
+        if cassette.is_recording:
+            cassette.record_wc(
+                method=method,
+                path=path,
+                params=kwargs.get("params"),
+                started=started,
+                response=response,
+            )
+        return response
+
+    def get(self, path: str, **kwargs: Any) -> requests.Response:
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path: str, **kwargs: Any) -> requests.Response:
+        return self.request("POST", path, **kwargs)
+
+    def put(self, path: str, **kwargs: Any) -> requests.Response:
+        return self.request("PUT", path, **kwargs)
+
+    def close(self) -> None:
+        self.session.close()
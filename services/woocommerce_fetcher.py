@@ -1,12 +1,95 @@
+import codecs
 import logging
-from pathlib import Path
-from typing import List, Set, Tuple
+from datetime import datetime, timedelta
+from http import HTTPStatus
+from typing import Any, Dict, Iterable, Iterator, List, Set
 
 import requests
-from models.order import Order, Product, ProductFile
+from models.order import Order, OrderValidationError, ProductFile
 from requests.exceptions import HTTPError
+from services.file_catalog import CatalogEntry, FileCatalog
+from services.orders_cursor import OrdersCursor
+from services.products_cache import ProductInfo, ProductsCache
+from services.woocommerce_client import WoocommerceClient
 from utils.config import WoocommerceSettings
-from utils.http import HEADERS
+from utils.json_stream import JsonStreamError, iter_json_array
+from utils.metrics import metrics
+from utils.resilience import ResilienceError
+
+PRODUCTS_BATCH_SIZE: int = 100
+INCLUDE_BATCH_SIZE: int = 100
+PRODUCT_FIELDS: str = "id,purchase_note,downloads,date_modified_gmt"
+# orders meta_data, addresses and line items details are never used
+ORDER_FIELDS: str = (
+    "id,total,date_modified_gmt,billing.email,billing.first_name,"
+    "billing.last_name,line_items.product_id,line_items.name"
+)
+STREAM_CHUNK_SIZE: int = 64 * 1024
+
+
+def _second_before(modified: str) -> str:
+    return (datetime.fromisoformat(modified) - timedelta(seconds=1)).strftime(
+        "%Y-%m-%dT%H:%M:%S"
+    )
+
+
+class PageKeyset:
+    """Position of a keyset walk through orders sorted by modification date
+
+    The next page is requested with `modified_after` a second before the
+    last seen date, as woocommerce compares whole seconds, and orders
+    of that last second are excluded by id"""
+
+    def __init__(self, *, modified_after: str = "") -> None:
+        self.modified_after: str = modified_after
+        self.last_modified: str = ""
+        self.last_ids: List[str] = []
+        self.seen_ids: Set[str] = set()
+
+    def __repr__(self) -> str:
+        return f"{self.last_modified} {','.join(self.last_ids)}"
+
+    def params(self) -> Dict[str, str]:
+        if not self.last_modified:
+            return {}
+        return {
+            "modified_after": max(
+                self.modified_after, _second_before(self.last_modified)
+            ),
+            "exclude": ",".join(self.last_ids),
+        }
+
+    def is_seen(self, order_info: Any) -> bool:
+        return isinstance(order_info, dict) and (
+            str(order_info.get("id")) in self.seen_ids
+        )
+
+    def add(self, order_info: Any) -> bool:
+        """Move after the fetched order
+
+        Args:
+            order_info (Any): raw order
+
+        Returns:
+            bool: False if the order has no id or modification date
+        """
+        if not isinstance(order_info, dict) or order_info.get("id") is None:
+            return False
+        order_id = str(order_info["id"])
+        self.seen_ids.add(order_id)
+        modified = order_info.get("date_modified_gmt")
+        if not isinstance(modified, str):
+            return False
+        try:
+            datetime.fromisoformat(modified)
+        except ValueError:
+            return False
+        if modified > self.last_modified:
+            self.last_modified = modified
+            self.last_ids = []
+        if modified == self.last_modified:
+            self.last_ids.append(order_id)
+        return True
 
 
 class WoocommerceFetcher:
@@ -16,19 +99,39 @@ class WoocommerceFetcher:
         self,
         *,
         woocommerce_settings: WoocommerceSettings,
+        wc_client: WoocommerceClient,
+        file_catalog: FileCatalog,
         app_logger: logging.Logger,
         debug: bool = False,
     ) -> None:
-        self.auth_pair: Tuple[str, str] = (
-            woocommerce_settings.user_key,
-            woocommerce_settings.secret_key,
-        )
-        self.url = woocommerce_settings.url
+        self.wc_client: WoocommerceClient = wc_client
+        self.file_catalog: FileCatalog = file_catalog
+        self.orders_per_page: int = woocommerce_settings.orders_per_page
         self.logger = app_logger
         self.debug = debug
         self.redundant_phrase: str = woocommerce_settings.redundant_phrase
         if self.debug:
             self.debug_email: str = woocommerce_settings.debug_email
+        self.products_cache: ProductsCache = ProductsCache(
+            path=woocommerce_settings.products_cache_path,
+            ttl=woocommerce_settings.products_cache_ttl,
+            app_logger=app_logger,
+        )
+        # cursor is not used in debug mode, debug runs see only a part of orders
+        self.cursor: OrdersCursor | None = None
+        if not debug:
+            self.cursor = OrdersCursor(
+                path=woocommerce_settings.orders_cursor_path,
+                full_sync_interval=woocommerce_settings.full_sync_interval,
+                app_logger=app_logger,
+            )
+        self.is_full_sync: bool = False
+        # orders were fetched to the end without errors
+        self.is_fetch_complete: bool = False
+        self.is_fetch_broken: bool = False
+        # every processing order modified up to it was fetched
+        self.watermark: str = ""
+        self.validators: Dict[str, str] = {}
 
     def _sanitaze_order_name(self, *, order_name) -> str:
         """Simple sanitize func
@@ -41,88 +144,436 @@ class WoocommerceFetcher:
         """
         return order_name.replace(self.redundant_phrase, "")
 
-    def _parse_orders(self, *, wc_processing_orders) -> List[Order]:
-        """Get orders with processing status
+    def _complete_orders(self, *, orders: List[Order]) -> Iterator[Order]:
+        """Add purchase notes and files of ordered products
 
         Args:
-            wc_processing_orders (_type_): _description_
+            orders (List[Order]): orders of one page
 
-        Returns:
-            List[Order]: _description_
+        Yields:
+            Order: order ready for handling
         """
-        orders: List[Order] = []
-        for order_info in wc_processing_orders:
-            order: Order = Order(
-                id=order_info["id"],
-                total=order_info["total"],
-                email=order_info["billing"]["email"],
-                first_name=order_info["billing"]["first_name"],
-                last_name=order_info["billing"]["last_name"],
-            )
+        products_info: Dict[int, ProductInfo] = self._get_products_info(
+            product_ids={
+                product.product_id for order in orders for product in order.products
+            }
+        )
+        for order in orders:
             total_files: Set[str] = set()
-            for product in order_info["line_items"]:
-                product_url = f'{self.url}/products/{product["product_id"]}'
-                product_info = self._fetch_wc_url(url=product_url)
-                fetched_product: Product = Product(
-                    name=self._sanitaze_order_name(order_name=product["name"]),
-                    purchase_note=product_info["purchase_note"]
-                    if "purchase_note" in product_info
-                    else "",
+            for product in order.products:
+                product_info = products_info.get(product.product_id, {})
+                product.name = self._sanitaze_order_name(order_name=product.name)
+                product.purchase_note = product_info.get("purchase_note") or ""
+                for file in product_info.get("downloads", []):
+                    total_files.add(file["file"])
+            for file_name in sorted(total_files):
+                entry: CatalogEntry | None = self.file_catalog.lookup(file_name)
+                if entry is None:
+                    self.logger.error(
+                        "Order %s: file %s is missing", order.id, file_name
+                    )
+                    order.missing_files.append(file_name)
+                    continue
+                order.total_files.append(
+                    ProductFile(
+                        file_name=file_name,
+                        file_size=entry.size,
+                        content_hash=entry.content_hash,
+                        mime_type=entry.mime_type,
+                        mtime=entry.mtime,
+                    )
                 )
+            self.file_catalog.save()
+            yield order
 
-                if "downloads" in product_info:
-                    for file in product_info["downloads"]:
-                        total_files.add(file["file"])
-                order.products.append(fetched_product)
-            order.total_files = [
-                ProductFile(
-                    file_name=file_name, file_size=Path(file_name).stat().st_size
-                )
-                for file_name in total_files
-            ]
-            orders.append(order)
-        return orders
+    def _fetch_products(
+        self, *, product_ids: List[int], params: Dict[str, Any] = {}
+    ) -> List[ProductInfo]:
+        """Fetch products in bulk with include= param
 
-    def _fetch_wc_url(self, *, url, params={}):
-        """Fetch woocommerce API
+        Args:
+            product_ids (List[int]): products to fetch
+            params (Dict[str, Any], optional): extra query params. Defaults to {}.
+
+        Raises:
+            HTTPError: products can't be fetched, orders can't be sent without them
+            ResilienceError: woocommerce circuit is open or the run deadline
+                is exceeded, handling is stopped
+
+        Returns:
+            List[ProductInfo]: fetched products
+        """
+        products: List[ProductInfo] = []
+        for start in range(0, len(product_ids), PRODUCTS_BATCH_SIZE):
+            batch = product_ids[start : start + PRODUCTS_BATCH_SIZE]
+            response = self._fetch_wc_url(
+                path="products",
+                params={
+                    **params,
+                    "include": ",".join(str(product_id) for product_id in batch),
+                    "per_page": PRODUCTS_BATCH_SIZE,
+                    "_fields": PRODUCT_FIELDS,
+                },
+            )
+            if response is None:
+                raise HTTPError(f"Can't fetch products {batch}")
+            products.extend(response)
+        return products
+
+    def _get_products_info(self, *, product_ids: Set[int]) -> Dict[int, ProductInfo]:
+        """Get products metadata from cache, fetching only missing
+        and revalidating expired ones
 
         Args:
-            url (_type_): _description_
+            product_ids (Set[int]): unique products ids
+
+        Returns:
+            Dict[int, ProductInfo]: products by id
+        """
+        missing_ids: List[int] = sorted(
+            product_id
+            for product_id in product_ids
+            if self.products_cache.get(product_id) is None
+        )
+        expired_ids: List[int] = sorted(
+            product_id
+            for product_id in product_ids
+            if product_id not in missing_ids
+            and self.products_cache.is_expired(product_id)
+        )
+        if expired_ids:
+            changed_products = self._fetch_products(
+                product_ids=expired_ids,
+                params={
+                    "modified_after": self.products_cache.oldest_modified(expired_ids),
+                    "dates_are_gmt": "true",
+                },
+            )
+            for product_info in changed_products:
+                self.products_cache.put(product_info)
+            changed_ids = {product_info["id"] for product_info in changed_products}
+            self.products_cache.touch(
+                [
+                    product_id
+                    for product_id in expired_ids
+                    if product_id not in changed_ids
+                ]
+            )
+        if missing_ids:
+            for product_info in self._fetch_products(product_ids=missing_ids):
+                self.products_cache.put(product_info)
+        self.products_cache.save()
+
+        products_info: Dict[int, ProductInfo] = {}
+        for product_id in product_ids:
+            cached_info: ProductInfo | None = self.products_cache.get(product_id)
+            if cached_info is None:
+                self.logger.warning("Product %s is not found", product_id)
+                continue
+            products_info[product_id] = cached_info
+        return products_info
+
+    def _fetch_wc_response(
+        self, *, path, params={}, headers={}, stream: bool = False
+    ) -> requests.Response | None:
+        """Fetch woocommerce API and return the raw response
+
+        Args:
+            path (_type_): api path, e.g. "orders"
             params (dict, optional): _description_. Defaults to {}.
+            headers (dict, optional): extra request headers. Defaults to {}.
+            stream (bool, optional): don't read the body, it's counted
+                by the reader. Defaults to False.
+
+        Raises:
+            ResilienceError: woocommerce circuit is open or the run deadline
+                is exceeded
 
         Returns:
-            _type_: _description_
+            requests.Response | None: response or None on errors
         """
         try:
-            session = requests.Session()
-            session.headers = HEADERS
-            r = session.get(url, auth=self.auth_pair, params=params)
+            with metrics.timer("wc_request"):
+                r = self.wc_client.get(
+                    path, params=params, headers=headers, stream=stream
+                )
+            if not stream:
+                metrics.inc("bytes_total", len(r.content), stage="wc_request")
             r.raise_for_status()
 
             if r is None:
                 raise HTTPError
 
-            return r.json()
+            return r
         except (
             requests.exceptions.ConnectionError,
             requests.exceptions.Timeout,
             HTTPError,
         ) as error:
+            metrics.inc("errors_total", stage="wc_request")
             self.logger.exception(f"Something bad: {error}")
             return None
 
+    def _fetch_wc_url(self, *, path, params={}):
+        """Fetch woocommerce API
+
+        Args:
+            path (_type_): api path, e.g. "orders"
+            params (dict, optional): _description_. Defaults to {}.
+
+        Returns:
+            _type_: _description_
+        """
+        response = self._fetch_wc_response(path=path, params=params)
+        if response is None:
+            return None
+        return response.json()
+
+    @staticmethod
+    def _has_next_page(*, response: requests.Response, page: int) -> bool:
+        """Check pagination headers of woocommerce response
+
+        X-WP-TotalPages is preferred, Link rel="next" is used when
+        the total is not exposed (e.g. stripped by a proxy).
+
+        Args:
+            response (requests.Response): fetched page
+            page (int): number of fetched page
+
+        Returns:
+            bool: True if there is one more page
+        """
+        total_pages = response.headers.get("X-WP-TotalPages")
+        if total_pages is not None and total_pages.isdigit():
+            return page < int(total_pages)
+        return "next" in response.links
+
+    @staticmethod
+    def _iter_text(response: requests.Response) -> Iterator[str]:
+        decoder = codecs.getincrementaldecoder(response.encoding or "utf-8")(
+            errors="replace"
+        )
+        for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+            metrics.inc("bytes_total", len(chunk), stage="wc_request")
+            yield decoder.decode(chunk)
+        yield decoder.decode(b"", final=True)
+
+    def _parse_order(self, order_info: Any) -> Order | None:
+        try:
+            return Order.from_api(order_info)
+        except OrderValidationError as error:
+            order_id = order_info.get("id") if isinstance(order_info, dict) else None
+            self.logger.error("Order %s is skipped: %s", order_id, error)
+            return None
+
+    def _iter_wc_pages(
+        self,
+        *,
+        path: str,
+        params: Dict[str, Any],
+        headers: Dict[str, str] = {},
+        keyset: PageKeyset | None = None,
+    ) -> Iterator[List[Order]]:
+        """Walk through all pages of woocommerce orders
+
+        Pages are taken by keyset instead of page numbers: orders are
+        sorted by modification date and every next page is requested
+        after the last fetched order. Handled orders are closed during
+        the walk and leave the processing orders, so numbered pages would
+        shift and skip orders. Every page is decoded as it's received,
+        raw orders are dropped right after the order record is built
+
+        Args:
+            path (str): collection path
+            params (Dict[str, Any]): query params without pagination
+            headers (Dict[str, str], optional): conditional headers
+                for the first page. Defaults to {}.
+            keyset (PageKeyset | None, optional): walk position, it's read
+                after the walk to get its watermark. Defaults to None.
+
+        Yields:
+            List[Order]: orders of one page
+        """
+        if keyset is None:
+            keyset = PageKeyset(modified_after=params.get("modified_after", ""))
+        is_first_page: bool = True
+        while True:
+            try:
+                response = self._fetch_wc_response(
+                    path=path,
+                    params={
+                        **params,
+                        **keyset.params(),
+                        "dates_are_gmt": "true",
+                        "orderby": "modified",
+                        "order": "asc",
+                        "per_page": self.orders_per_page,
+                        "_fields": ORDER_FIELDS,
+                    },
+                    headers=headers if is_first_page else {},
+                    stream=True,
+                )
+            except ResilienceError as error:
+                metrics.inc("errors_total", stage="wc_request")
+                self.logger.error("Orders are not fetched: %s", error)
+                response = None
+            if response is None:
+                self.is_fetch_broken = True
+                return
+            try:
+                if response.status_code == HTTPStatus.NOT_MODIFIED:
+                    return
+                if is_first_page:
+                    self.validators = {
+                        "etag": response.headers.get("ETag", ""),
+                        "last_modified": response.headers.get("Last-Modified", ""),
+                    }
+                orders: List[Order] = []
+                items_count: int = 0
+                is_moved: bool = False
+                for order_info in iter_json_array(self._iter_text(response)):
+                    items_count += 1
+                    if keyset.is_seen(order_info):
+                        continue
+                    is_moved = keyset.add(order_info) or is_moved
+                    order = self._parse_order(order_info)
+                    if order is not None:
+                        orders.append(order)
+            except (JsonStreamError, requests.exceptions.RequestException) as error:
+                metrics.inc("errors_total", stage="wc_request")
+                self.logger.exception(f"Something bad: {error}")
+                self.is_fetch_broken = True
+                return
+            finally:
+                response.close()
+            if not items_count:
+                return
+            if orders:
+                yield orders
+            if not self._has_next_page(response=response, page=1):
+                return
+            if not is_moved:
+                self.logger.error("Orders pages don't move after %s", keyset)
+                self.is_fetch_broken = True
+                return
+            is_first_page = False
+
+    def _iter_wc_orders_pages(self) -> Iterator[List[Order]]:
+        """Pages of processing orders: orders to retry from the previous run,
+        then orders modified after the cursor (or all of them on full sync)
+
+        Yields:
+            List[Order]: orders of one page
+        """
+        params: Dict[str, Any] = {"status": "processing"}
+        if self.debug:
+            params["search"] = self.debug_email
+        if self.cursor is None or self.cursor.is_full_sync_due:
+            self.is_full_sync = True
+            keyset: PageKeyset = PageKeyset()
+            yield from self._iter_wc_pages(path="orders", params=params, keyset=keyset)
+            self.watermark = keyset.last_modified
+            return
+
+        pending_ids: List[str] = self.cursor.pending_ids
+        for start in range(0, len(pending_ids), INCLUDE_BATCH_SIZE):
+            yield from self._iter_wc_pages(
+                path="orders",
+                params={
+                    **params,
+                    "include": ",".join(
+                        pending_ids[start : start + INCLUDE_BATCH_SIZE]
+                    ),
+                },
+            )
+        # pending orders are fetched by ids, only the walk by modification
+        # date tells how far all orders were seen
+        keyset = PageKeyset(modified_after=self.cursor.modified_after)
+        yield from self._iter_wc_pages(
+            path="orders",
+            params={
+                **params,
+                "modified_after": self.cursor.modified_after,
+            },
+            headers=self.cursor.conditional_headers(),
+            keyset=keyset,
+        )
+        self.watermark = keyset.last_modified
+
+    def iter_orders(self) -> Iterator[Order]:
+        """Stream processing orders page by page
+
+        Orders are yielded as soon as their page is parsed,
+        so handling can start before the whole backlog is fetched.
+        The fetch is complete only when the stream is read to the end
+
+        Yields:
+            Order: processing order
+        """
+        self.is_full_sync = False
+        self.is_fetch_complete = False
+        self.is_fetch_broken = False
+        self.watermark = ""
+        self.validators = {}
+        seen_ids: Set[str] = set()
+        for orders in metrics.iter_timed("fetch_orders", self._iter_wc_orders_pages()):
+            # pending orders could be modified after the cursor as well
+            orders = [order for order in orders if order.id not in seen_ids]
+            seen_ids.update(order.id for order in orders)
+            if self.debug:
+                # search also matches names and addresses, keep exact check
+                orders = [order for order in orders if order.email == self.debug_email]
+            yield from self._complete_orders(orders=orders)
+        self.is_fetch_complete = not self.is_fetch_broken
+
+    def fetch_orders_by_ids(self, *, order_ids: List[str]) -> List[Order]:
+        """Fetch processing orders by ids, e.g. from webhooks
+
+        Args:
+            order_ids (List[str]): woocommerce orders ids
+
+        Returns:
+            List[Order]: orders which are still processing
+        """
+        orders: List[Order] = []
+        for start in range(0, len(order_ids), INCLUDE_BATCH_SIZE):
+            for page_orders in metrics.iter_timed(
+                "fetch_orders",
+                self._iter_wc_pages(
+                    path="orders",
+                    params={
+                        "status": "processing",
+                        "include": ",".join(
+                            order_ids[start : start + INCLUDE_BATCH_SIZE]
+                        ),
+                    },
+                ),
+            ):
+                orders.extend(self._complete_orders(orders=page_orders))
+        return orders
+
+    def commit_cursor(self, *, orders: Iterable[Order]) -> None:
+        """Advance the cursor after handling, unclosed orders are kept
+        to be fetched again. Cursor isn't moved if fetching was broken
+        or stopped before the end, skipped orders would be older than it
+
+        Args:
+            orders (Iterable[Order]): handled orders
+        """
+        if self.cursor is None or not self.is_fetch_complete:
+            return
+        self.cursor.advance(
+            modified_after=self.watermark,
+            pending_ids=[order.id for order in orders if not order.status],
+            etag=self.validators.get("etag", ""),
+            last_modified=self.validators.get("last_modified", ""),
+            is_full_sync=self.is_full_sync,
+        )
+
     def fetch_orders(self) -> List[Order]:
         """Main entart point for class
 
         Returns:
             List[Order]: _description_
         """
-        orders: List[Order] = []
-        orders_url = f"{self.url}/orders"
-        params = {"status": "processing"}
-        response = self._fetch_wc_url(url=orders_url, params=params)
-        if response:
-            orders = self._parse_orders(wc_processing_orders=response)
-        if self.debug:
-            orders = [order for order in orders if order.email == self.debug_email]
-        return orders
+        return list(self.iter_orders())
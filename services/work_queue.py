@@ -0,0 +1,171 @@
+import sqlite3
+from pathlib import Path
+from threading import Lock
+from time import time
+from typing import Iterable, List
+
+from models.order import Order
+
+SCHEMA: str = """
+CREATE TABLE IF NOT EXISTS work (
+    order_id TEXT PRIMARY KEY,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL,
+    worker TEXT,
+    lease_until REAL NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS work_state ON work (state, lease_until);
+"""
+
+PENDING: str = "pending"
+LEASED: str = "leased"
+FAILED: str = "failed"
+DONE: str = "done"
+# done and given up orders are kept to see them in the queue for a while
+DONE_TTL: int = 7 * 24 * 60 * 60
+
+
+class WorkQueue:
+    """SQLite work queue of orders shared by worker processes
+
+    A worker claims orders with a lease which it renews while handling them.
+    Leases of a crashed worker expire and its orders are claimed again.
+    Failed orders wait for the next put, when they are fetched again,
+    until `max_attempts` claims, then they are given up: not queued again
+    and not reported as unfinished. Done orders aren't queued again"""
+
+    def __init__(
+        self, *, path: str, worker: str, lease_seconds: float, max_attempts: int = 5
+    ) -> None:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.connection: sqlite3.Connection = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None, timeout=30
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+        self.worker: str = worker
+        self.lease_seconds: float = lease_seconds
+        self.max_attempts: int = max_attempts
+        self.lock: Lock = Lock()
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def put(self, orders: Iterable[Order]) -> int:
+        """Queue fetched processing orders, leased, done and given up
+        orders are left as is, e.g. a replayed webhook isn't sent again
+
+        Args:
+            orders (Iterable[Order]): processing orders
+
+        Returns:
+            int: queued orders count
+        """
+        now = time()
+        count = 0
+        with self.lock:
+            for order in orders:
+                self.connection.execute(
+                    "INSERT INTO work (order_id, payload, state, updated_at) "
+                    "VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (order_id) DO UPDATE SET "
+                    "payload = excluded.payload, "
+                    "state = CASE WHEN state IN (?, ?) THEN state "
+                    "WHEN state = ? AND attempts >= ? THEN state ELSE ? END, "
+                    "updated_at = excluded.updated_at",
+                    (
+                        order.id,
+                        order.to_json(),
+                        PENDING,
+                        now,
+                        LEASED,
+                        DONE,
+                        FAILED,
+                        self.max_attempts,
+                        PENDING,
+                    ),
+                )
+                count += 1
+            self.connection.execute(
+                "DELETE FROM work WHERE state IN (?, ?) AND updated_at < ?",
+                (DONE, FAILED, now - DONE_TTL),
+            )
+        return count
+
+    def claim(self, limit: int) -> List[Order]:
+        """Lease pending orders and orders with expired leases
+
+        Args:
+            limit (int): max orders count
+
+        Returns:
+            List[Order]: leased orders
+        """
+        now = time()
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self.connection.execute(
+                    "SELECT order_id, payload FROM work "
+                    "WHERE state = ? OR (state = ? AND lease_until < ?) "
+                    "ORDER BY updated_at LIMIT ?",
+                    (PENDING, LEASED, now, limit),
+                ).fetchall()
+                self.connection.executemany(
+                    "UPDATE work SET state = ?, worker = ?, lease_until = ?, "
+                    "attempts = attempts + 1, updated_at = ? WHERE order_id = ?",
+                    [
+                        (LEASED, self.worker, now + self.lease_seconds, now, row[0])
+                        for row in rows
+                    ],
+                )
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+        return [Order.from_json(payload) for _, payload in rows]
+
+    def renew(self) -> None:
+        """Extend leases of all orders held by the worker"""
+        with self.lock:
+            self.connection.execute(
+                "UPDATE work SET lease_until = ? WHERE worker = ? AND state = ?",
+                (time() + self.lease_seconds, self.worker, LEASED),
+            )
+
+    def release(self, orders: Iterable[Order]) -> None:
+        """Finish orders handling, closed orders are done
+
+        Args:
+            orders (Iterable[Order]): handled orders
+        """
+        now = time()
+        with self.lock:
+            self.connection.executemany(
+                "UPDATE work SET state = ?, lease_until = 0, updated_at = ? "
+                "WHERE order_id = ? AND worker = ?",
+                [
+                    (DONE if order.status else FAILED, now, order.id, self.worker)
+                    for order in orders
+                ],
+            )
+
+    def unfinished(self) -> List[Order]:
+        """Orders which are not done, e.g. leased by another run
+
+        Returns:
+            List[Order]: queued, leased and failed orders,
+                given up orders aren't included
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT payload FROM work "
+                "WHERE state != ? AND NOT (state = ? AND attempts >= ?)",
+                (DONE, FAILED, self.max_attempts),
+            ).fetchall()
+        orders = [Order.from_json(payload) for payload, in rows]
+        for order in orders:
+            order.status = False
+        return orders
@@ -0,0 +1,161 @@
+import logging
+import logging.config
+import multiprocessing
+import os
+import socket
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from threading import Event, Thread
+from typing import Any, Dict, List
+
+from models.order import Order
+from services.delivery_journal import DeliveryJournal
+from services.order_closer import OrderCloser
+from services.orders_handler import OrdersHandler
+from services.rate_limiter import SendRateLimiter
+from services.smtp_session import SmtpSession
+from services.woocommerce_client import WoocommerceClient
+from services.work_queue import WorkQueue
+from utils.config import AppSettings, get_settings
+from utils.logger import get_logger_config
+from utils.metrics import metrics
+from utils.resilience import configure_resilience
+
+
+@dataclass(slots=True)
+class WorkerResult:
+    orders: List[Order] = field(default_factory=list)
+    throttled_seconds: float = 0.0
+    metrics: Dict[str, Any] = field(default_factory=dict)
+    abort_reason: str = ""
+
+
+def worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _renew_forever(queue: WorkQueue, stopped: Event) -> None:
+    while not stopped.wait(queue.lease_seconds / 3):
+        queue.renew()
+
+
+def run_worker(index: int, deadline: float | None) -> WorkerResult:
+    """Worker process: claim orders from the work queue and handle them
+    until the queue is empty or handling is stopped by an open circuit
+
+    Args:
+        index (int): worker index
+        deadline (float | None): seconds left of the run deadline
+
+    Returns:
+        WorkerResult: handled orders, smtp throttling and metrics
+    """
+    app_settings: AppSettings = get_settings()
+    logging.config.dictConfig(get_logger_config(app_settings.telegram_settings))
+    app_logger = logging.getLogger("app_logger")
+    configure_resilience(settings=app_settings.resilience_settings, deadline=deadline)
+    if index:
+        # coupons pool file is not shared between processes
+        app_settings = app_settings.copy(
+            update={
+                "coupon_settings": app_settings.coupon_settings.copy(
+                    update={"pool_size": 0}
+                )
+            }
+        )
+    settings = app_settings.worker_settings
+    queue: WorkQueue = WorkQueue(
+        path=settings.queue_path,
+        worker=worker_name(),
+        lease_seconds=settings.lease_seconds,
+        max_attempts=settings.max_attempts,
+    )
+    journal: DeliveryJournal = DeliveryJournal(path=app_settings.journal_path)
+    # buckets are shared by all workers through the journal
+    rate_limiter: SendRateLimiter = SendRateLimiter(
+        rate_limit=app_settings.email_settings.rate_limit,
+        server=app_settings.email_settings.smtp_server,
+        app_logger=app_logger,
+        journal=journal,
+    )
+    result: WorkerResult = WorkerResult()
+    stopped: Event = Event()
+    renewer: Thread = Thread(target=_renew_forever, args=(queue, stopped), daemon=True)
+    renewer.start()
+    try:
+        with WoocommerceClient(
+            settings=app_settings.woocommerce_settings
+        ) as wc_client, SmtpSession(
+            settings=app_settings.email_settings, app_logger=app_logger
+        ) as smtp_session:
+            order_closer: OrderCloser = OrderCloser(
+                wc_client=wc_client,
+                journal=journal,
+                app_logger=app_logger,
+                batch_size=app_settings.woocommerce_settings.close_batch_size,
+                flush_interval=app_settings.woocommerce_settings.close_flush_interval,
+            )
+            while orders := queue.claim(settings.claim_size):
+                orders_handler: OrdersHandler = OrdersHandler(
+                    orders=orders,
+                    settings=app_settings,
+                    wc_client=wc_client,
+                    app_logger=app_logger,
+                    smtp_session=smtp_session,
+                    rate_limiter=rate_limiter,
+                    order_closer=order_closer,
+                    journal=journal,
+                )
+                orders_handler.handle()
+                # not handled orders are failed and stay for the next cycle
+                queue.release(orders)
+                result.orders.extend(orders_handler.orders)
+                if orders_handler.is_aborted:
+                    result.abort_reason = str(orders_handler.abort_error)
+                    break
+    finally:
+        stopped.set()
+        renewer.join()
+        journal.close()
+        queue.close()
+    result.throttled_seconds = rate_limiter.throttled_seconds
+    result.metrics = metrics.snapshot()
+    return result
+
+
+def run_workers(
+    *, workers: int, app_logger: logging.Logger, deadline: float | None = None
+) -> WorkerResult:
+    """Run worker processes and merge their results
+
+    A failed or killed worker is logged, its leased orders
+    are claimed by other workers after the lease expiration
+
+    Args:
+        workers (int): processes count
+        app_logger (logging.Logger): _description_
+        deadline (float | None, optional): seconds left of the run deadline.
+            Defaults to None - unlimited.
+
+    Returns:
+        WorkerResult: results of all workers, metrics are merged
+            into the process registry
+    """
+    merged: WorkerResult = WorkerResult()
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        futures = [
+            executor.submit(run_worker, index, deadline) for index in range(workers)
+        ]
+        for future in as_completed(futures):
+            try:
+                result: WorkerResult = future.result()
+            except Exception as ex:
+                app_logger.exception("Worker is failed: %s", ex)
+                continue
+            merged.orders.extend(result.orders)
+            merged.throttled_seconds += result.throttled_seconds
+            merged.abort_reason = merged.abort_reason or result.abort_reason
+            metrics.merge(result.metrics)
+    return merged
@@ -0,0 +1,101 @@
+import logging
+from pathlib import Path
+from typing import Iterator
+
+import pytest
+
+from benchmarks.fake_woocommerce import FakeShop, FakeWoocommerceServer
+from services.file_catalog import FileCatalog
+from services.woocommerce_client import WoocommerceClient
+from services.woocommerce_fetcher import WoocommerceFetcher
+from utils.config import (
+    AppSettings,
+    CouponSettings,
+    DaemonSettings,
+    EmailSettings,
+    LinkSettings,
+    PipelineSettings,
+    ResilienceSettings,
+    TelegramSettrings,
+    WoocommerceSettings,
+    WorkerSettings,
+)
+from utils.resilience import configure_resilience
+
+app_logger = logging.getLogger("app_logger")
+
+
+@pytest.fixture(autouse=True)
+def reset_resilience() -> None:
+    # breakers are process wide
+    configure_resilience(settings=ResilienceSettings(base_delay=0.01))
+
+
+@pytest.fixture
+def shop() -> FakeShop:
+    return FakeShop.generate(orders_count=10, product_files=[[], []])
+
+
+@pytest.fixture
+def wc_server(shop: FakeShop) -> Iterator[FakeWoocommerceServer]:
+    with FakeWoocommerceServer(shop=shop) as server:
+        yield server
+
+
+@pytest.fixture
+def woocommerce_settings(
+    tmp_path: Path, wc_server: FakeWoocommerceServer
+) -> WoocommerceSettings:
+    return WoocommerceSettings(
+        user_key="ck_test",
+        secret_key="cs_test",
+        url=wc_server.url,
+        orders_per_page=3,
+        products_cache_path=str(tmp_path / "products.json"),
+        files_catalog_path=str(tmp_path / "files.json"),
+        orders_cursor_path=str(tmp_path / "orders_cursor.json"),
+    )
+
+
+@pytest.fixture
+def fetcher(
+    woocommerce_settings: WoocommerceSettings,
+) -> Iterator[WoocommerceFetcher]:
+    with WoocommerceClient(settings=woocommerce_settings) as wc_client:
+        yield WoocommerceFetcher(
+            woocommerce_settings=woocommerce_settings,
+            wc_client=wc_client,
+            file_catalog=FileCatalog(
+                index_path=woocommerce_settings.files_catalog_path,
+                download_dirs=[],
+                app_logger=app_logger,
+            ),
+            app_logger=app_logger,
+        )
+
+
+@pytest.fixture
+def app_settings(
+    tmp_path: Path, woocommerce_settings: WoocommerceSettings
+) -> AppSettings:
+    return AppSettings(
+        _env_file=None,
+        journal_path=str(tmp_path / "journal.sqlite3"),
+        telegram_settings=TelegramSettrings(
+            _env_file=None, bot_token="token", users_id=[]
+        ),
+        woocommerce_settings=woocommerce_settings,
+        email_settings=EmailSettings(
+            _env_file=None,
+            sender="shop@example.com",
+            password="",
+            display_name="",
+            attachments_cache_dir=str(tmp_path / "attachments"),
+        ),
+        pipeline_settings=PipelineSettings(_env_file=None),
+        coupon_settings=CouponSettings(_env_file=None),
+        daemon_settings=DaemonSettings(_env_file=None, port=0),
+        link_settings=LinkSettings(_env_file=None),
+        worker_settings=WorkerSettings(_env_file=None),
+        resilience_settings=ResilienceSettings(_env_file=None),
+    )
@@ -0,0 +1,87 @@
+import logging
+from pathlib import Path
+from threading import Event
+from types import SimpleNamespace
+from typing import Any, List, cast
+
+from models.order import Order
+from services.async_pipeline import AsyncOrdersPipeline
+from services.attachment_cache import AttachmentCache
+from services.delivery_journal import DeliveryJournal
+from services.orders_handler import OrdersHandler
+from utils.config import EmailSettings, PipelineSettings
+from utils.resilience import DeadlineExceeded, ResilienceError
+
+app_logger = logging.getLogger("app_logger")
+
+
+class StubOrdersHandler:
+    """Stages of OrdersHandler without woocommerce and smtp:
+    the first order closing exceeds the deadline while
+    the second order is still being sent"""
+
+    def __init__(self, tmp_path: Path) -> None:
+        self.settings = SimpleNamespace(
+            email_settings=EmailSettings(
+                _env_file=None, sender="shop@example.com", password="", display_name=""
+            )
+        )
+        self.smtp_session = SimpleNamespace(
+            attachment_cache=AttachmentCache(
+                cache_dir=str(tmp_path / "attachments"), app_logger=app_logger
+            )
+        )
+        self.journal = DeliveryJournal(path=str(tmp_path / "journal.sqlite3"))
+        self.owns_journal = True
+        self.coupon_pool = None
+        self.orders: List[Order] = []
+        self.abort_error: ResilienceError | None = None
+        self.first_is_closing = Event()
+
+    def _prepare_coupons(self, orders: List[Order]) -> None:
+        pass
+
+    def _get_order_info(self, *, order: Order) -> dict:
+        return {}
+
+    def _send_order_email(self, *, order: Order, **kwargs: Any) -> bool:
+        if order.id == "2":
+            # still sending when the run is stopped
+            self.first_is_closing.wait(5)
+        self.journal.record_sent(order.id)
+        return True
+
+    def _close_order(self, *, order: Order) -> None:
+        self.first_is_closing.set()
+        raise DeadlineExceeded("run deadline is exceeded")
+
+    def flush_closer(self) -> None:
+        pass
+
+    def abort(self, error: ResilienceError) -> None:
+        self.abort_error = error
+
+    def _create_result_message(self) -> str:
+        return ", ".join(order.id for order in self.orders)
+
+
+def create_order(order_id: str) -> Order:
+    return Order(
+        id=order_id, total=0.0, email="buyer@example.com", first_name="", last_name=""
+    )
+
+
+def test_orders_sent_in_flight_are_reported_after_abort(tmp_path: Path):
+    orders_handler = StubOrdersHandler(tmp_path)
+    pipeline = AsyncOrdersPipeline(
+        orders=[create_order("1"), create_order("2")],
+        orders_handler=cast(OrdersHandler, orders_handler),
+        settings=PipelineSettings(_env_file=None, send_workers=2, close_workers=1),
+        app_logger=app_logger,
+    )
+
+    assert pipeline.handle() == "1, 2"
+    assert isinstance(orders_handler.abort_error, DeadlineExceeded)
+    journal = DeliveryJournal(path=str(tmp_path / "journal.sqlite3"))
+    assert journal.is_sent("2")
+    journal.close()
@@ -0,0 +1,71 @@
+import email
+import logging
+import os
+import re
+from base64 import b64encode
+from pathlib import Path
+
+from models.order import ProductFile
+from services.attachment_cache import AttachmentCache
+from services.smtp_session import SmtpSession
+from utils.config import EmailSettings
+
+app_logger = logging.getLogger("app_logger")
+
+
+def test_cached_message_has_crlf_line_endings(tmp_path: Path):
+    file_path = tmp_path / "Урок 1.pdf"
+    content = os.urandom(200 * 1024)
+    file_path.write_bytes(content)
+    settings = EmailSettings(
+        sender="shop@example.com",
+        password="test",
+        display_name="Shop",
+        attachments_cache_dir=str(tmp_path / "attachments"),
+    )
+    with SmtpSession(settings=settings, app_logger=app_logger) as smtp_session:
+        _, message = smtp_session.prepare(
+            to_email="customer@example.com",
+            subject="Материалы",
+            contents="Спасибо за заказ",
+            attachments=[
+                ProductFile(
+                    file_name=str(file_path),
+                    file_size=len(content),
+                    mime_type="application/pdf",
+                )
+            ],
+        )
+
+    assert isinstance(message, bytes)
+    assert re.search(rb"(?<!\r)\n", message) is None
+    assert all(len(line) <= 998 for line in message.split(b"\r\n"))
+    attachments = [
+        part
+        for part in email.message_from_bytes(message).walk()
+        if part.get_content_disposition() == "attachment"
+    ]
+    assert [part.get_filename() for part in attachments] == ["Урок 1.pdf"]
+    assert attachments[0].get_payload(decode=True) == content
+
+
+def test_file_rewritten_in_place_is_encoded_again(tmp_path: Path):
+    file_path = tmp_path / "lesson.pdf"
+    file_path.write_bytes(b"first version")
+    catalog_entry = file_path.stat()
+    cache = AttachmentCache(
+        cache_dir=str(tmp_path / "attachments"), app_logger=app_logger
+    )
+    file = ProductFile(
+        file_name=str(file_path),
+        file_size=catalog_entry.st_size,
+        content_hash=cache.content_hash(str(file_path)),
+        mime_type="application/pdf",
+        mtime=catalog_entry.st_mtime_ns,
+    )
+    assert b64encode(b"first version") in cache.get_part(file)
+
+    # the catalog isn't rescanned, its entry still describes the first version
+    file_path.write_bytes(b"second version")
+    os.utime(file_path, ns=(catalog_entry.st_atime_ns, catalog_entry.st_mtime_ns + 1))
+    assert b64encode(b"second version") in cache.get_part(file)
@@ -0,0 +1,72 @@
+import logging
+import os
+from pathlib import Path
+
+import pytest
+
+from models.order import ProductFile
+from services.attachment_cache import AttachmentCache
+from services.attachment_packer import AttachmentPacker, encoded_size, part_size
+from services.smtp_session import SmtpSession
+from utils.config import EmailSettings
+
+app_logger = logging.getLogger("app_logger")
+MAX_MESSAGE_SIZE: int = 2 * 1024 * 1024
+BODY: str = "<p>Спасибо за заказ</p>"
+
+
+def create_file(tmp_path: Path, size: int) -> ProductFile:
+    file_path = tmp_path / f"file-{size}.pdf"
+    file_path.write_bytes(os.urandom(size))
+    return ProductFile(
+        file_name=str(file_path), file_size=size, mime_type="application/pdf"
+    )
+
+
+@pytest.mark.parametrize("size", [0, 1, 56, 57, 58, 57 * 1024 + 5, 100_000])
+def test_encoded_size_matches_cached_part(tmp_path: Path, size: int):
+    file = create_file(tmp_path, size)
+    cache = AttachmentCache(cache_dir=str(tmp_path / "cache"), app_logger=app_logger)
+    headers = AttachmentCache.part_headers(file.file_name, file.mime_type)
+    assert len(cache.get_part(file)) == len(headers) + encoded_size(size)
+
+
+@pytest.mark.parametrize("attachments_cache", [True, False])
+def test_largest_packed_file_fits_max_message_size(
+    tmp_path: Path, attachments_cache: bool
+):
+    packer = AttachmentPacker(
+        max_message_size=MAX_MESSAGE_SIZE, body_size=len(BODY.encode())
+    )
+    file_name = str(tmp_path / f"file-{MAX_MESSAGE_SIZE}.pdf")
+    low, high = 0, MAX_MESSAGE_SIZE
+    while low < high:
+        middle = (low + high + 1) // 2
+        file = ProductFile(
+            file_name=file_name, file_size=middle, mime_type="application/pdf"
+        )
+        if part_size(file) <= packer.capacity:
+            low = middle
+        else:
+            high = middle - 1
+    file = create_file(tmp_path, low)
+    assert packer.pack([file]).packs == [[file]]
+
+    settings = EmailSettings(
+        sender="shop@example.com",
+        password="test",
+        display_name="Shop",
+        max_attachment_size=MAX_MESSAGE_SIZE,
+        attachments_cache_dir=str(tmp_path / "cache") if attachments_cache else "",
+    )
+    with SmtpSession(settings=settings, app_logger=app_logger) as smtp_session:
+        _, message = smtp_session.prepare(
+            to_email="customer@example.com",
+            subject="Заказ №1",
+            contents=[BODY],
+            attachments=[file],
+        )
+    if isinstance(message, str):
+        # smtplib sends str messages with CRLF line endings
+        message = message.replace("\n", "\r\n").encode()
+    assert len(message) <= MAX_MESSAGE_SIZE
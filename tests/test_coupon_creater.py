@@ -0,0 +1,52 @@
+from itertools import count
+from typing import List, Tuple
+
+import pytest
+
+from benchmarks.fake_woocommerce import FakeShop, FakeWoocommerceServer
+from services.coupon_creater import COUPONS_BATCH_SIZE, CouponCreater
+from services.woocommerce_client import WoocommerceClient
+from utils.config import WoocommerceSettings
+
+
+def test_coupons_are_created_in_batches_of_100(
+    shop: FakeShop,
+    wc_server: FakeWoocommerceServer,
+    woocommerce_settings: WoocommerceSettings,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    # every third order is too small for a discount
+    customers: List[Tuple[int | float, str]] = [
+        (500 if index % 3 == 0 else 1500, f"Покупатель {index}") for index in range(330)
+    ]
+    numbers = count()
+    with WoocommerceClient(settings=woocommerce_settings) as wc_client:
+        creater = CouponCreater(client=wc_client)
+        monkeypatch.setattr(
+            creater, "_get_coupon_name", lambda name: f"coupon_{next(numbers)}"
+        )
+        # the code of the last coupon is already taken, it's rejected
+        shop.coupons["coupon_219"] = {"id": 1, "code": "coupon_219"}
+        coupons = creater.create_batch(customers=customers)
+
+    eligible = [index for index in range(330) if index % 3 != 0]
+    assert len(eligible) == 220
+    assert wc_server.requests_count["POST /coupons/batch"] == 3
+    assert [coupon is not None for coupon in coupons] == [
+        index in eligible[:-1] for index in range(330)
+    ]
+    # coupons are matched to customers across batches
+    assert [coupon.coupon_name for coupon in coupons if coupon is not None] == [
+        f"coupon_{number}" for number in range(219)
+    ]
+    assert len(shop.coupons) == 220
+    assert COUPONS_BATCH_SIZE == 100
+
+
+def test_no_batch_for_orders_without_discount(
+    wc_server: FakeWoocommerceServer, woocommerce_settings: WoocommerceSettings
+):
+    with WoocommerceClient(settings=woocommerce_settings) as wc_client:
+        creater = CouponCreater(client=wc_client)
+        assert creater.create_batch(customers=[(500, "Покупатель")]) == [None]
+    assert wc_server.requests_count.get("POST /coupons/batch", 0) == 0
@@ -0,0 +1,95 @@
+import base64
+import hashlib
+import hmac
+import json
+import logging
+from threading import Thread
+from typing import Iterator
+
+import pytest
+import requests
+
+from services.daemon import OrdersDaemon
+from services.woocommerce_fetcher import WoocommerceFetcher
+from utils.config import AppSettings
+
+app_logger = logging.getLogger("app_logger")
+
+SECRET = "webhook-secret"
+
+
+@pytest.fixture
+def daemon(
+    app_settings: AppSettings, fetcher: WoocommerceFetcher
+) -> Iterator[OrdersDaemon]:
+    app_settings = app_settings.copy(
+        update={
+            "daemon_settings": app_settings.daemon_settings.copy(
+                update={"webhook_secret": SECRET, "max_webhook_size": 1024}
+            )
+        }
+    )
+    daemon = OrdersDaemon(
+        app_settings=app_settings,
+        wc_client=fetcher.wc_client,
+        orders_fetcher=fetcher,
+        app_logger=app_logger,
+    )
+    thread = Thread(target=daemon.server.serve_forever, daemon=True)
+    thread.start()
+    yield daemon
+    daemon.server.shutdown()
+    thread.join()
+    daemon.server.server_close()
+    daemon.journal.close()
+
+
+def post_webhook(daemon: OrdersDaemon, body: bytes) -> int:
+    host, port = daemon.server.server_address[:2]
+    signature = base64.b64encode(
+        hmac.new(SECRET.encode(), body, hashlib.sha256).digest()
+    ).decode()
+    response = requests.post(
+        f"http://{host}:{port}/webhook",
+        data=body,
+        headers={
+            "X-WC-Webhook-Signature": signature,
+            "X-WC-Webhook-Topic": "order.updated",
+        },
+        timeout=5,
+    )
+    return response.status_code
+
+
+def test_processing_order_webhook_is_queued(daemon: OrdersDaemon):
+    body = json.dumps({"id": 7, "status": "processing"}).encode()
+    assert post_webhook(daemon, body) == 202
+    assert daemon.queue.get_nowait() == "7"
+
+
+def test_signed_webhook_without_order_id_is_rejected(daemon: OrdersDaemon):
+    assert post_webhook(daemon, json.dumps({"status": "processing"}).encode()) == 400
+    assert post_webhook(daemon, b"[]") == 400
+    assert daemon.queue.empty()
+
+
+def test_too_large_webhook_is_rejected(daemon: OrdersDaemon):
+    body = json.dumps({"id": 7, "status": "processing", "note": "x" * 2048}).encode()
+    assert post_webhook(daemon, body) == 413
+    assert daemon.queue.empty()
+
+
+def test_access_log_is_kept_out_of_app_logger(
+    daemon: OrdersDaemon, caplog: pytest.LogCaptureFixture
+):
+    caplog.set_level(logging.DEBUG)
+    host, port = daemon.server.server_address[:2]
+    response = requests.get(f"http://{host}:{port}/metrics", timeout=5)
+    assert response.status_code == 200
+
+    access_records = [
+        record for record in caplog.records if record.name == "webhook.access"
+    ]
+    assert access_records
+    assert "GET /metrics" in access_records[0].getMessage()
+    assert not [record for record in caplog.records if record.name == "app_logger"]
@@ -0,0 +1,102 @@
+import logging
+import os
+from pathlib import Path
+from typing import List
+
+import pytest
+
+from services.file_catalog import FileCatalog
+
+app_logger = logging.getLogger("app_logger")
+
+
+def create_catalog(tmp_path: Path) -> FileCatalog:
+    return FileCatalog(
+        index_path=str(tmp_path / "files.json"), download_dirs=[], app_logger=app_logger
+    )
+
+
+def test_changed_and_deleted_files_are_checked_on_lookup(tmp_path: Path):
+    file_path = tmp_path / "lesson.pdf"
+    file_path.write_bytes(b"first version")
+    catalog = create_catalog(tmp_path)
+    entry = catalog.lookup(str(file_path))
+    assert entry is not None
+    first_hash = entry.content_hash
+    catalog.save()
+
+    file_path.write_bytes(b"second, longer version")
+    stat = file_path.stat()
+    os.utime(file_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    # the entry comes from the index written by the previous run
+    catalog = create_catalog(tmp_path)
+    entry = catalog.lookup(str(file_path))
+    assert entry is not None
+    assert entry.size == len(b"second, longer version")
+    assert entry.content_hash != first_hash
+
+    file_path.unlink()
+    assert catalog.lookup(str(file_path)) is None
+    assert str(file_path) not in catalog.entries
+
+
+def create_indexed_catalog(tmp_path: Path, download_dir: Path) -> FileCatalog:
+    return FileCatalog(
+        index_path=str(tmp_path / "files.json"),
+        download_dirs=[str(download_dir)],
+        app_logger=app_logger,
+    )
+
+
+def test_unchanged_directories_are_not_rescanned(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    download_dir = tmp_path / "downloads"
+    (download_dir / "course").mkdir(parents=True)
+    file_paths = [download_dir / "course" / f"lesson {index}.pdf" for index in range(3)]
+    for file_path in file_paths:
+        file_path.write_bytes(file_path.name.encode())
+    catalog = create_indexed_catalog(tmp_path, download_dir)
+    assert all(catalog.lookup(str(file_path)) for file_path in file_paths)
+    catalog.save()
+
+    stat_paths: List[str] = []
+    stat = os.stat
+
+    def counted_stat(path, *args, **kwargs):
+        stat_paths.append(str(path))
+        return stat(path, *args, **kwargs)
+
+    monkeypatch.setattr(os, "stat", counted_stat)
+    # the next run trusts the index
+    catalog = create_indexed_catalog(tmp_path, download_dir)
+    entries = [catalog.lookup(str(file_path)) for file_path in file_paths]
+
+    assert all(entry is not None and entry.content_hash for entry in entries)
+    # only directories are checked, files aren't
+    assert sorted(
+        path for path in stat_paths if path.startswith(str(download_dir))
+    ) == sorted([str(download_dir), str(download_dir / "course")])
+
+
+def test_added_and_removed_files_are_found_by_directory_mtime(tmp_path: Path):
+    download_dir = tmp_path / "downloads"
+    download_dir.mkdir()
+    old_path = download_dir / "old.pdf"
+    old_path.write_bytes(b"old")
+    catalog = create_indexed_catalog(tmp_path, download_dir)
+    assert catalog.lookup(str(old_path)) is not None
+    catalog.save()
+
+    new_path = download_dir / "new.pdf"
+    new_path.write_bytes(b"new")
+    old_path.unlink()
+    # mtime granularity of some filesystems is coarse
+    dir_stat = download_dir.stat()
+    os.utime(download_dir, ns=(dir_stat.st_atime_ns, dir_stat.st_mtime_ns + 1))
+
+    catalog = create_indexed_catalog(tmp_path, download_dir)
+    assert catalog.lookup(str(old_path)) is None
+    entry = catalog.lookup(str(new_path))
+    assert entry is not None
+    assert entry.size == len(b"new")
@@ -0,0 +1,56 @@
+import json
+from typing import List
+
+import pytest
+
+from utils.json_stream import JsonStreamError, iter_json_array
+
+TEXT: str = json.dumps(
+    [
+        {"id": 1, "total": "1500.00", "line_items": [{"name": 'Книга "1"'}]},
+        12345,
+        -0.5e10,
+        "строка с ] и }",
+        True,
+        None,
+        [],
+        {},
+    ],
+    ensure_ascii=False,
+    indent=1,
+)
+
+
+def split(text: str, size: int) -> List[str]:
+    return [text[start : start + size] for start in range(0, len(text), size)]
+
+
+@pytest.mark.parametrize("size", range(1, 40))
+def test_items_are_decoded_across_chunk_boundaries(size: int):
+    assert list(iter_json_array(split(TEXT, size))) == json.loads(TEXT)
+
+
+def test_number_cut_by_chunk_is_not_decoded_early():
+    assert list(iter_json_array(["[12", "34, 5", "6]"])) == [1234, 56]
+
+
+@pytest.mark.parametrize("chunks", [["[]"], [" \n[ ", " ]"], ["", "[", "", "]"]])
+def test_empty_array(chunks: List[str]):
+    assert list(iter_json_array(chunks)) == []
+
+
+@pytest.mark.parametrize(
+    "chunks",
+    [
+        [],
+        ['{"id": 1}'],
+        ["[1, 2"],
+        ["[1,", ""],
+        ['[{"id": 1}'],
+        ["[1 2]"],
+        ['[{"id": ', "}]"],
+    ],
+)
+def test_broken_array_is_rejected(chunks: List[str]):
+    with pytest.raises(JsonStreamError):
+        list(iter_json_array(chunks))
@@ -0,0 +1,83 @@
+import logging
+from pathlib import Path
+from typing import Dict
+from urllib.parse import parse_qs, unquote, urlparse
+
+import pytest
+
+from models.order import ProductFile
+from services.link_publisher import LinkPublisher
+from utils.config import LinkSettings
+
+app_logger = logging.getLogger("app_logger")
+
+BASE_URL: str = "https://shop.example.com/files"
+
+
+@pytest.fixture
+def publisher(tmp_path: Path) -> LinkPublisher:
+    return LinkPublisher(
+        settings=LinkSettings(
+            _env_file=None,
+            threshold=1,
+            static_dir=str(tmp_path / "static"),
+            base_url=BASE_URL,
+            secret="link-secret",
+        ),
+        max_message_size=1024 * 1024,
+        app_logger=app_logger,
+    )
+
+
+def publish(publisher: LinkPublisher, tmp_path: Path) -> Dict[str, str]:
+    file_path = tmp_path / "Книга.pdf"
+    file_path.write_bytes(b"%PDF-1.4 book")
+    (link,) = publisher.publish(
+        [ProductFile(file_name=str(file_path), file_size=13, content_hash="abc")]
+    )
+    url = urlparse(link["url"])
+    query = {key: values[0] for key, values in parse_qs(url.query).items()}
+    return {
+        "path": unquote(url.path.removeprefix(urlparse(BASE_URL).path + "/")),
+        **query,
+    }
+
+
+def test_published_link_is_verified_and_resolved(
+    publisher: LinkPublisher, tmp_path: Path
+):
+    link = publish(publisher, tmp_path)
+    assert link["path"] == "abc/Книга.pdf"
+    assert publisher.verify(**link)
+    file_path = publisher.resolve(link["path"])
+    assert file_path is not None
+    assert file_path.read_bytes() == b"%PDF-1.4 book"
+
+
+def test_tampered_link_is_rejected(publisher: LinkPublisher, tmp_path: Path):
+    link = publish(publisher, tmp_path)
+    assert not publisher.verify(**{**link, "path": "abc/other.pdf"})
+    assert not publisher.verify(**{**link, "token": "0" * len(link["token"])})
+    assert not publisher.verify(**{**link, "expires": str(int(link["expires"]) + 1)})
+    assert not publisher.verify(**{**link, "expires": "-1"})
+
+
+def test_expired_link_is_rejected(
+    publisher: LinkPublisher, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+):
+    link = publish(publisher, tmp_path)
+    monkeypatch.setattr(
+        "services.link_publisher.time", lambda: int(link["expires"]) + 1
+    )
+    assert not publisher.verify(**link)
+
+
+@pytest.mark.parametrize(
+    "path", ["../secret.txt", "abc/../../secret.txt", "/etc/passwd", "", "abc"]
+)
+def test_paths_outside_static_dir_are_not_resolved(
+    publisher: LinkPublisher, tmp_path: Path, path: str
+):
+    publish(publisher, tmp_path)
+    (tmp_path / "secret.txt").write_text("secret")
+    assert publisher.resolve(path) is None
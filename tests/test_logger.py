@@ -0,0 +1,50 @@
+import logging
+import logging.config
+from typing import List
+
+import pytest
+
+from utils.config import TelegramSettrings
+from utils.logger import TelegramHandler, get_logger_config
+
+
+def test_failed_telegram_log_is_reported_to_stderr(
+    capsys: pytest.CaptureFixture[str],
+):
+    handler = TelegramHandler(
+        telegram_bot_token="token",
+        telegram_users=["1"],
+        # nothing listens there, sending fails right away
+        api_url="http://127.0.0.1:9",
+        coalesce_interval=0.0,
+    )
+    handler.handle(logging.makeLogRecord({"msg": "Order 7 is not sent"}))
+    handler.close()
+
+    assert "Telegram log is not sent" in capsys.readouterr().err
+
+
+def test_only_warnings_are_queued_for_telegram(monkeypatch: pytest.MonkeyPatch):
+    config = get_logger_config(TelegramSettrings(bot_token="token", users_id=[]))
+    # dictConfig changes process wide loggers, they are restored after the test
+    for name in config["loggers"]:
+        logger = logging.getLogger(name)
+        for attribute in ("handlers", "level", "propagate"):
+            monkeypatch.setattr(logger, attribute, getattr(logger, attribute))
+    logging.config.dictConfig(config)
+    app_logger = logging.getLogger("app_logger")
+    handler = next(
+        handler
+        for handler in app_logger.handlers
+        if isinstance(handler, TelegramHandler)
+    )
+    queued: List[logging.LogRecord] = []
+    monkeypatch.setattr(handler, "emit", queued.append)
+    try:
+        app_logger.debug("Order 7 is fetched")
+        app_logger.info("Order 7 is sent")
+        app_logger.warning("Order 8 is not sent")
+    finally:
+        handler.close()
+
+    assert [record.getMessage() for record in queued] == ["Order 8 is not sent"]
@@ -0,0 +1,19 @@
+import stat
+from pathlib import Path
+
+from utils.metrics import MetricsRegistry
+
+
+def test_metrics_file_is_readable_by_collector(tmp_path: Path):
+    registry = MetricsRegistry(prefix="test")
+    registry.inc("orders_total", status="sent")
+    registry.observe("stage_seconds", 0.2, stage="smtp_send")
+    metrics_path = tmp_path / "metrics.prom"
+
+    registry.write(str(metrics_path))
+
+    assert stat.S_IMODE(metrics_path.stat().st_mode) == 0o644
+    text = metrics_path.read_text(encoding="utf-8")
+    assert 'test_orders_total{status="sent"} 1' in text
+    assert 'test_stage_seconds_count{stage="smtp_send"} 1' in text
+    assert list(tmp_path.iterdir()) == [metrics_path]
@@ -0,0 +1,136 @@
+import json
+import logging
+from pathlib import Path
+
+import pytest
+
+from benchmarks.fake_woocommerce import FakeShop, FakeWoocommerceServer
+from models.order import Order
+from services.delivery_journal import DeliveryJournal
+from services.order_closer import OrderCloser
+from services.woocommerce_client import WoocommerceClient
+from utils.config import WoocommerceSettings
+from utils.resilience import CircuitOpenError, resilience
+
+app_logger = logging.getLogger("app_logger")
+
+
+def create_order(order_info) -> Order:
+    return Order(
+        id=str(order_info["id"]),
+        total=0.0,
+        email="buyer@example.com",
+        first_name="",
+        last_name="",
+    )
+
+
+def test_closed_orders_are_not_updated_again(
+    tmp_path: Path,
+    shop: FakeShop,
+    wc_server: FakeWoocommerceServer,
+    woocommerce_settings: WoocommerceSettings,
+):
+    journal = DeliveryJournal(path=str(tmp_path / "journal.sqlite3"))
+    orders = [create_order(order_info) for order_info in shop.orders.values()]
+    first, second = orders[:2]
+    journal.record_closed(first.id)
+    with WoocommerceClient(settings=woocommerce_settings) as wc_client:
+        order_closer = OrderCloser(
+            wc_client=wc_client, journal=journal, app_logger=app_logger
+        )
+        order_closer.enqueue(first)
+        order_closer.flush()
+        assert first.status
+        assert wc_server.requests_count.get("POST /orders/batch", 0) == 0
+
+        order_closer.enqueue(second)
+        order_closer.flush()
+    assert second.status
+    assert journal.is_closed(second.id)
+    assert wc_server.requests_count["POST /orders/batch"] == 1
+    journal.close()
+
+
+def test_batch_item_errors_are_mapped_to_orders(
+    tmp_path: Path,
+    shop: FakeShop,
+    wc_server: FakeWoocommerceServer,
+    woocommerce_settings: WoocommerceSettings,
+):
+    journal = DeliveryJournal(path=str(tmp_path / "journal.sqlite3"))
+    order = create_order(next(iter(shop.orders.values())))
+    # woocommerce answers with an error item for an unknown order
+    missing = create_order({"id": 999})
+    with WoocommerceClient(settings=woocommerce_settings) as wc_client:
+        order_closer = OrderCloser(
+            wc_client=wc_client, journal=journal, app_logger=app_logger
+        )
+        order_closer.enqueue(missing)
+        order_closer.enqueue(order)
+        order_closer.flush()
+    assert order.status
+    assert journal.is_closed(order.id)
+    assert not missing.status
+    assert not journal.is_closed(missing.id)
+    assert wc_server.requests_count["POST /orders/batch"] == 1
+    journal.close()
+
+
+def test_orders_missing_in_batch_response_are_not_closed(
+    tmp_path: Path,
+    shop: FakeShop,
+    wc_server: FakeWoocommerceServer,
+    woocommerce_settings: WoocommerceSettings,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    journal = DeliveryJournal(path=str(tmp_path / "journal.sqlite3"))
+    first, second, third = [
+        create_order(order_info) for order_info in list(shop.orders.values())[:3]
+    ]
+    with WoocommerceClient(settings=woocommerce_settings) as wc_client:
+        post = wc_client.post
+
+        def drop_answers(path: str, **kwargs):
+            response = post(path, **kwargs)
+            updated = response.json()["update"]
+            # the second order is left in processing, the third is not answered
+            updated[1]["status"] = "processing"
+            response._content = json.dumps({"update": updated[:2]}).encode()
+            return response
+
+        monkeypatch.setattr(wc_client, "post", drop_answers)
+        order_closer = OrderCloser(
+            wc_client=wc_client, journal=journal, app_logger=app_logger
+        )
+        for order in (first, second, third):
+            order_closer.enqueue(order)
+        order_closer.flush()
+    assert [order.status for order in (first, second, third)] == [True, False, False]
+    assert journal.is_closed(first.id)
+    assert not journal.is_closed(second.id)
+    assert not journal.is_closed(third.id)
+    journal.close()
+
+
+def test_open_circuit_stops_closing(
+    tmp_path: Path,
+    shop: FakeShop,
+    wc_server: FakeWoocommerceServer,
+    woocommerce_settings: WoocommerceSettings,
+):
+    journal = DeliveryJournal(path=str(tmp_path / "journal.sqlite3"))
+    order = create_order(next(iter(shop.orders.values())))
+    breaker = resilience.breaker("woocommerce")
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    with WoocommerceClient(settings=woocommerce_settings) as wc_client:
+        order_closer = OrderCloser(
+            wc_client=wc_client, journal=journal, app_logger=app_logger
+        )
+        order_closer.enqueue(order)
+        with pytest.raises(CircuitOpenError):
+            order_closer.flush()
+    assert not order.status
+    assert not journal.is_closed(order.id)
+    journal.close()
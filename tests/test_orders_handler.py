@@ -0,0 +1,85 @@
+import logging
+from time import sleep
+from types import SimpleNamespace
+from typing import List, cast
+
+import pytest
+
+from benchmarks.fake_woocommerce import FakeWoocommerceServer
+from models.order import Order
+from services.orders_handler import OrdersHandler
+from services.rate_limiter import SendRateLimiter
+from services.smtp_session import SmtpSession
+from services.woocommerce_fetcher import WoocommerceFetcher
+from utils.config import AppSettings
+from utils.metrics import MetricsRegistry
+
+app_logger = logging.getLogger("app_logger")
+
+
+def create_handler(
+    app_settings: AppSettings, fetcher: WoocommerceFetcher
+) -> OrdersHandler:
+    return OrdersHandler(
+        orders=[],
+        settings=app_settings,
+        wc_client=fetcher.wc_client,
+        app_logger=app_logger,
+    )
+
+
+def test_prepared_coupons_are_journaled_and_reused(
+    app_settings: AppSettings,
+    fetcher: WoocommerceFetcher,
+    wc_server: FakeWoocommerceServer,
+):
+    orders_handler = create_handler(app_settings, fetcher)
+    # orders of small totals get no discount
+    orders: List[Order] = [
+        order
+        for order in fetcher.iter_orders()
+        if orders_handler.coupon_creater._get_discount_percent(total=order.total)
+    ][:3]
+    assert len(orders) == 3
+    orders_handler._prepare_coupons(orders)
+    coupons = [orders_handler.journal.get_coupon(order.id) for order in orders]
+    assert all(coupons)
+    assert wc_server.requests_count["POST /coupons/batch"] == 1
+    # the run is stopped before the orders are sent
+    orders_handler.journal.close()
+
+    orders_handler = create_handler(app_settings, fetcher)
+    orders_handler._prepare_coupons(orders)
+    assert [orders_handler._get_coupon(order) for order in orders] == coupons
+    assert wc_server.requests_count["POST /coupons/batch"] == 1
+    orders_handler.journal.close()
+
+
+def test_throttling_is_not_counted_as_sending(
+    app_settings: AppSettings,
+    fetcher: WoocommerceFetcher,
+    monkeypatch: pytest.MonkeyPatch,
+):
+    registry = MetricsRegistry()
+    monkeypatch.setattr("services.orders_handler.metrics", registry)
+    smtp_session = SimpleNamespace(
+        prepare=lambda **kwargs: (["buyer@example.com"], b"message"),
+        sendmail=lambda **kwargs: None,
+    )
+    rate_limiter = SimpleNamespace(acquire=lambda message_size: sleep(0.2))
+    orders_handler = OrdersHandler(
+        orders=[],
+        settings=app_settings,
+        wc_client=fetcher.wc_client,
+        app_logger=app_logger,
+        smtp_session=cast(SmtpSession, smtp_session),
+        rate_limiter=cast(SendRateLimiter, rate_limiter),
+    )
+    assert orders_handler._send_email(
+        to_email="buyer@example.com", subject="", attachments=[], contents=""
+    )
+    orders_handler.journal.close()
+
+    histogram = registry.histograms["stage_seconds"][(("stage", "send_email"),)]
+    assert histogram.count == 1
+    assert histogram.sum < 0.2
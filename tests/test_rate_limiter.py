@@ -0,0 +1,45 @@
+import logging
+from pathlib import Path
+
+from services.delivery_journal import DeliveryJournal
+from services.rate_limiter import SendRateLimiter, TokenBucket
+from utils.config import SmtpRateLimit
+
+app_logger = logging.getLogger("app_logger")
+
+
+def test_bucket_is_not_refilled_by_a_new_run(tmp_path: Path):
+    journal_path = str(tmp_path / "journal.sqlite3")
+    journal = DeliveryJournal(path=journal_path)
+    bucket = TokenBucket(rate=0.1, capacity=3, name="smtp_messages", journal=journal)
+    assert [bucket.reserve(1) for _ in range(3)] == [0.0, 0.0, 0.0]
+    journal.close()
+
+    # the next cron run or another worker process
+    journal = DeliveryJournal(path=journal_path)
+    bucket = TokenBucket(rate=0.1, capacity=3, name="smtp_messages", journal=journal)
+    wait = bucket.reserve(1)
+    journal.close()
+
+    assert 9 < wait <= 10
+
+
+def test_bucket_without_journal_starts_full():
+    bucket = TokenBucket(rate=0.1, capacity=3)
+    assert [bucket.reserve(1) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.reserve(1) > 9
+
+
+def test_smtp_servers_have_own_budgets(tmp_path: Path):
+    journal = DeliveryJournal(path=str(tmp_path / "journal.sqlite3"))
+    rate_limit = SmtpRateLimit(messages_per_minute=1, bytes_per_hour=1024, burst_size=1)
+    yandex, gmail = (
+        SendRateLimiter(
+            rate_limit=rate_limit, server=server, app_logger=app_logger, journal=journal
+        )
+        for server in ("smtp.yandex.ru", "smtp.gmail.com")
+    )
+    assert yandex.messages_bucket.reserve(1) == 0.0
+    assert gmail.messages_bucket.reserve(1) == 0.0
+    assert yandex.messages_bucket.reserve(1) > 0
+    journal.close()
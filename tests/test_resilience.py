@@ -0,0 +1,24 @@
+import logging
+
+import pytest
+
+from utils.resilience import resilience
+
+
+def test_telegram_failures_are_not_logged_to_app_logger(
+    caplog: pytest.LogCaptureFixture,
+):
+    def send(timeout: float) -> None:
+        raise ConnectionError("telegram is down")
+
+    caplog.set_level(logging.DEBUG)
+    with pytest.raises(ConnectionError):
+        resilience.call(
+            "telegram",
+            send,
+            timeout=1.0,
+            is_transient=lambda ex: isinstance(ex, ConnectionError),
+        )
+
+    assert [record.name for record in caplog.records]
+    assert {record.name for record in caplog.records} == {"resilience.telegram"}
@@ -0,0 +1,41 @@
+import logging
+
+import pytest
+
+from benchmarks.smtp_sink import SmtpSink
+from services.smtp_session import DeliveryUnknownError, SmtpSession
+from utils.config import EmailSettings
+
+app_logger = logging.getLogger("app_logger")
+
+
+def create_session(port: int) -> SmtpSession:
+    return SmtpSession(
+        settings=EmailSettings(
+            sender="shop@example.com",
+            password="test",
+            display_name="Shop",
+            smtp_server="127.0.0.1",
+            smtp_port=port,
+            smtp_ssl=False,
+            smtp_timeout=5.0,
+            attachments_cache_dir="",
+        ),
+        app_logger=app_logger,
+    )
+
+
+def test_message_is_not_resent_after_connection_is_lost_in_data():
+    with SmtpSink(drop_after_data=1) as sink:
+        with create_session(sink.port) as smtp_session:
+            with pytest.raises(DeliveryUnknownError):
+                smtp_session.sendmail(
+                    recipients=["customer@example.com"], message="Subject: 1\n\nhi"
+                )
+            assert smtp_session.connection is None
+            # the next message goes over a new connection
+            smtp_session.sendmail(
+                recipients=["customer@example.com"], message="Subject: 2\n\nhi"
+            )
+    assert sink.messages_count == 2
+    assert sink.connections_count == 2
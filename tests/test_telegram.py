@@ -0,0 +1,29 @@
+from utils.telegram import split_message
+
+
+def test_short_text_is_one_message():
+    assert split_message("Order 7\nOrder 8", limit=20) == ["Order 7\nOrder 8"]
+
+
+def test_text_is_split_by_lines():
+    assert split_message("aaaa\nbbbb\ncccc", limit=9) == ["aaaa\nbbbb", "cccc"]
+
+
+def test_long_line_is_cut():
+    assert split_message("ab\n" + "x" * 12 + "\ncd", limit=5) == [
+        "ab",
+        "xxxxx",
+        "xxxxx",
+        "xx\ncd",
+    ]
+
+
+def test_messages_fit_the_limit():
+    text = "\n".join("line " * (index % 7) for index in range(100))
+    messages = split_message(text, limit=50)
+    assert all(0 < len(message) <= 50 for message in messages)
+    assert "\n".join(messages).replace("\n", "") == text.replace("\n", "")
+
+
+def test_empty_text_has_no_messages():
+    assert split_message("") == []
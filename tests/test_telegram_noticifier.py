@@ -0,0 +1,26 @@
+from services.telegram_noticifier import TelegramNoticifier
+
+
+def test_orders_are_not_torn_apart():
+    report = "Отправлено 3\n№ 1 - a\nbook\n№ 2 - b\nbook\n№ 3 - c\nbook"
+    assert TelegramNoticifier._split_report(report, limit=30) == [
+        "Отправлено 3\n№ 1 - a\nbook",
+        "№ 2 - b\nbook\n№ 3 - c\nbook",
+    ]
+
+
+def test_short_orders_share_a_message():
+    report = "№ 1 - a\n№ 2 - b\n№ 3 - c"
+    assert TelegramNoticifier._split_report(report, limit=16) == [
+        "№ 1 - a\n№ 2 - b",
+        "№ 3 - c",
+    ]
+
+
+def test_order_longer_than_limit_is_split_by_lines():
+    report = "№ 1 - a\n" + "\n".join(["book"] * 5) + "\n№ 2 - b"
+    messages = TelegramNoticifier._split_report(report, limit=15)
+    assert all(len(message) <= 15 for message in messages)
+    # the next order is kept whole
+    assert messages[-1].endswith("\n№ 2 - b")
+    assert "\n".join(messages) == report
@@ -0,0 +1,120 @@
+from itertools import islice
+from typing import Any, Dict, List
+
+import pytest
+
+from benchmarks.fake_woocommerce import FakeShop, FakeWoocommerceServer
+from services.woocommerce_fetcher import PageKeyset
+from utils.resilience import CircuitOpenError, resilience
+
+
+def close_order(wc_server: FakeWoocommerceServer, order_id: str) -> None:
+    wc_server._update_order({"id": order_id, "status": "completed"})
+
+
+def test_first_page_has_no_keyset_params():
+    assert PageKeyset(modified_after="2024-01-01T00:00:00").params() == {}
+
+
+def test_orders_of_last_second_are_excluded():
+    keyset = PageKeyset()
+    keyset.add({"id": 1, "date_modified_gmt": "2024-01-01T00:00:00"})
+    keyset.add({"id": 2, "date_modified_gmt": "2024-01-01T00:00:05"})
+    keyset.add({"id": 3, "date_modified_gmt": "2024-01-01T00:00:05"})
+    assert keyset.params() == {
+        "modified_after": "2024-01-01T00:00:04",
+        "exclude": "2,3",
+    }
+    assert keyset.is_seen({"id": 1})
+    assert not keyset.is_seen({"id": 4})
+
+
+def test_keyset_does_not_go_back_before_cursor():
+    keyset = PageKeyset(modified_after="2024-01-01T00:00:00")
+    keyset.add({"id": 1, "date_modified_gmt": "2024-01-01T00:00:00"})
+    assert keyset.params() == {
+        "modified_after": "2024-01-01T00:00:00",
+        "exclude": "1",
+    }
+
+
+def test_order_without_modification_date_does_not_move_keyset():
+    keyset = PageKeyset()
+    assert not keyset.add({"date_modified_gmt": "2024-01-01T00:00:00"})
+    assert not keyset.add({"id": 1, "date_modified_gmt": "yesterday"})
+    assert keyset.is_seen({"id": 1})
+    assert keyset.params() == {}
+
+
+def test_orders_closed_between_pages_are_not_skipped(wc_server, fetcher):
+    fetched = []
+    for order in fetcher.iter_orders():
+        fetched.append(order.id)
+        close_order(wc_server, order.id)
+    assert fetched == [str(order_id) for order_id in range(1, 11)]
+    assert fetcher.is_fetch_complete
+
+
+def test_orders_of_one_second_are_paged_by_id(shop: FakeShop, wc_server, fetcher):
+    for order_info in shop.orders.values():
+        order_info["date_modified_gmt"] = "2024-01-01T00:00:00"
+    fetched = []
+    for order in fetcher.iter_orders():
+        fetched.append(order.id)
+        close_order(wc_server, order.id)
+    assert sorted(fetched, key=int) == [str(order_id) for order_id in range(1, 11)]
+    assert len(fetched) == len(set(fetched))
+
+
+def test_cursor_is_advanced_to_watermark_of_complete_fetch(
+    shop: FakeShop, wc_server, fetcher
+):
+    last_modified = shop.orders[10]["date_modified_gmt"]
+    orders = []
+    for order in fetcher.iter_orders():
+        orders.append(order)
+        close_order(wc_server, order.id)
+    fetcher.commit_cursor(orders=orders)
+    assert fetcher.cursor.modified_after == last_modified
+
+
+def test_cursor_is_kept_when_page_is_not_fetched(wc_server, fetcher, monkeypatch):
+    fetch_wc_response = fetcher._fetch_wc_response
+    calls: List[Dict[str, Any]] = []
+
+    def fail_second_page(**kwargs):
+        if kwargs["path"] == "orders":
+            calls.append(kwargs)
+        if len(calls) == 2:
+            return None
+        return fetch_wc_response(**kwargs)
+
+    monkeypatch.setattr(fetcher, "_fetch_wc_response", fail_second_page)
+    orders = list(fetcher.iter_orders())
+    fetcher.commit_cursor(orders=orders)
+    assert len(orders) == 3
+    assert not fetcher.is_fetch_complete
+    assert fetcher.cursor.modified_after == ""
+
+
+def test_cursor_is_kept_when_fetch_is_stopped(wc_server, fetcher):
+    orders = list(islice(fetcher.iter_orders(), 4))
+    fetcher.commit_cursor(orders=orders)
+    assert not fetcher.is_fetch_complete
+    assert fetcher.cursor.modified_after == ""
+
+
+def test_open_circuit_stops_products_fetch(wc_server, fetcher, monkeypatch):
+    get_products_info = fetcher._get_products_info
+
+    def open_circuit(**kwargs):
+        breaker = resilience.breaker("woocommerce")
+        for _ in range(breaker.failure_threshold):
+            breaker.record_failure()
+        return get_products_info(**kwargs)
+
+    # orders page is fetched, then woocommerce goes down
+    monkeypatch.setattr(fetcher, "_get_products_info", open_circuit)
+    with pytest.raises(CircuitOpenError):
+        list(fetcher.iter_orders())
+    assert not fetcher.is_fetch_complete
@@ -0,0 +1,127 @@
+from pathlib import Path
+from typing import List
+
+import pytest
+
+from models.order import Order
+from services.work_queue import WorkQueue
+
+
+def create_queue(
+    tmp_path: Path, worker: str = "worker-1", lease_seconds: float = 60, **kwargs
+) -> WorkQueue:
+    return WorkQueue(
+        path=str(tmp_path / "work_queue.sqlite3"),
+        worker=worker,
+        lease_seconds=lease_seconds,
+        **kwargs,
+    )
+
+
+def create_orders(*order_ids: str) -> List[Order]:
+    return [
+        Order(
+            id=order_id,
+            total=0.0,
+            email="buyer@example.com",
+            first_name="",
+            last_name="",
+        )
+        for order_id in order_ids
+    ]
+
+
+def test_done_orders_are_not_queued_again(tmp_path: Path):
+    queue = create_queue(tmp_path)
+    queue.put(create_orders("1"))
+    (order,) = queue.claim(10)
+    order.status = True
+    queue.release([order])
+
+    # e.g. a replayed webhook or a stale fetch
+    queue.put(create_orders("1"))
+
+    assert queue.claim(10) == []
+    assert queue.unfinished() == []
+    queue.close()
+
+
+def test_failing_order_is_given_up_after_max_attempts(tmp_path: Path):
+    queue = create_queue(tmp_path, max_attempts=2)
+    queue.put(create_orders("1"))
+    queue.release(queue.claim(10))
+    # failed once, it's retried and keeps the orders cursor
+    assert [order.id for order in queue.unfinished()] == ["1"]
+
+    queue.put(create_orders("1"))
+    queue.release(queue.claim(10))
+    assert queue.unfinished() == []
+
+    queue.put(create_orders("1"))
+    assert queue.claim(10) == []
+    queue.close()
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now: float = 1_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> Clock:
+    clock = Clock()
+    monkeypatch.setattr("services.work_queue.time", clock)
+    return clock
+
+
+def test_leased_orders_are_not_claimed_twice(tmp_path: Path, clock: Clock):
+    first = create_queue(tmp_path, "worker-1", lease_seconds=10)
+    second = create_queue(tmp_path, "worker-2", lease_seconds=10)
+    first.put(create_orders("1", "2"))
+
+    assert [order.id for order in first.claim(1)] == ["1"]
+    assert [order.id for order in second.claim(10)] == ["2"]
+    assert first.claim(10) == []
+    first.close()
+    second.close()
+
+
+def test_expired_lease_is_reclaimed(tmp_path: Path, clock: Clock):
+    crashed = create_queue(tmp_path, "worker-1", lease_seconds=10)
+    alive = create_queue(tmp_path, "worker-2", lease_seconds=10)
+    crashed.put(create_orders("1"))
+    (order,) = crashed.claim(10)
+
+    clock.now += 5
+    assert alive.claim(10) == []
+    clock.now += 6
+    (reclaimed,) = alive.claim(10)
+    assert reclaimed.id == "1"
+
+    # the late release of the first worker doesn't touch the new lease
+    order.status = True
+    crashed.release([order])
+    reclaimed.status = False
+    alive.release([reclaimed])
+    assert [order.id for order in alive.unfinished()] == ["1"]
+    crashed.close()
+    alive.close()
+
+
+def test_renewed_lease_is_kept(tmp_path: Path, clock: Clock):
+    first = create_queue(tmp_path, "worker-1", lease_seconds=10)
+    second = create_queue(tmp_path, "worker-2", lease_seconds=10)
+    first.put(create_orders("1"))
+    first.claim(10)
+
+    for _ in range(3):
+        clock.now += 8
+        first.renew()
+        assert second.claim(10) == []
+    clock.now += 11
+    assert [order.id for order in second.claim(10)] == ["1"]
+    first.close()
+    second.close()
@@ -0,0 +1,316 @@
+"""Record and replay of WooCommerce and SMTP traffic
+
+A cassette is a gzipped JSON lines file, one exchange per line, with
+its duration. Credentials are never written: auth params and headers
+are dropped, only the size of SMTP messages is kept.
+
+On replay WooCommerce responses are served from the cassette in
+the recorded order of every request, and SMTP sends only wait, so a
+production run can be profiled offline with its real orders shapes.
+"""
+
+import builtins
+import gzip
+import json
+import smtplib
+import time
+from collections import deque
+from pathlib import Path
+from threading import Lock
+from typing import IO, Any, Deque, Dict
+from urllib.parse import urlencode
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+CASSETTE_VERSION: int = 1
+SECRET_PARAMS: frozenset = frozenset(
+    {"consumer_key", "consumer_secret", "oauth_signature", "oauth_token", "password"}
+)
+RECORDED_HEADERS: tuple = (
+    "Content-Type",
+    "ETag",
+    "Last-Modified",
+    "Link",
+    "X-WP-Total",
+    "X-WP-TotalPages",
+)
+RECORD: str = "record"
+REPLAY: str = "replay"
+
+
+class CassetteMiss(requests.exceptions.ConnectionError):
+    """Request is not found in the cassette, handled as a network error"""
+
+
+class Cassette:
+    """Process wide traffic recorder, disabled until `record` or `replay`"""
+
+    def __init__(self) -> None:
+        self.mode: str | None = None
+        self.speed: float = 1.0
+        self.file: IO[str] | None = None
+        self.lock: Lock = Lock()
+        self.wc_exchanges: Dict[str, Deque[Dict[str, Any]]] = {}
+        self.smtp_exchanges: Deque[Dict[str, Any]] = deque()
+        self.state: Dict[str, str] = {}
+
+    @property
+    def is_recording(self) -> bool:
+        return self.mode == RECORD
+
+    @property
+    def is_replaying(self) -> bool:
+        return self.mode == REPLAY
+
+    def record(self, path: str, *, state_files: Dict[str, str] = {}) -> None:
+        """Start writing exchanges
+
+        Args:
+            path (str): cassette file, e.g. cassettes/run.jsonl.gz
+            state_files (Dict[str, str], optional): local state files
+                which define the run requests, they are saved by name
+                to be restored on replay. Defaults to {}.
+        """
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.file = gzip.open(path, "wt", encoding="utf-8")
+        self.mode = RECORD
+        self._write(
+            {
+                "kind": "meta",
+                "version": CASSETTE_VERSION,
+                "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "state": {
+                    name: Path(file_path).read_text(encoding="utf-8")
+                    for name, file_path in state_files.items()
+                    if Path(file_path).is_file()
+                },
+            }
+        )
+
+    def replay(self, path: str, *, speed: float = 1.0) -> None:
+        """Load exchanges to serve them instead of the network
+
+        Args:
+            path (str): recorded cassette
+            speed (float, optional): recorded durations are divided by it,
+                0 - don't wait at all. Defaults to 1.0.
+
+        Raises:
+            ValueError: cassette version is not supported
+        """
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                exchange: Dict[str, Any] = json.loads(line)
+                if exchange["kind"] == "meta":
+                    if exchange["version"] != CASSETTE_VERSION:
+                        raise ValueError(
+                            f"Cassette version {exchange['version']} is not supported"
+                        )
+                    self.state = exchange.get("state", {})
+                elif exchange["kind"] == "wc":
+                    self.wc_exchanges.setdefault(exchange["key"], deque()).append(
+                        exchange
+                    )
+                elif exchange["kind"] == "smtp":
+                    self.smtp_exchanges.append(exchange)
+        self.speed = speed
+        self.mode = REPLAY
+
+    def restore_state(self, *, name: str, path: str) -> None:
+        """Write recorded state file, nothing is written if it wasn't recorded
+
+        Args:
+            name (str): state name
+            path (str): file path
+        """
+        if name not in self.state:
+            return
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        Path(path).write_text(self.state[name], encoding="utf-8")
+
+    def close(self) -> None:
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            self.mode = None
+
+    def _write(self, exchange: Dict[str, Any]) -> None:
+        line = json.dumps(exchange, ensure_ascii=False)
+        with self.lock:
+            if self.file is not None:
+                self.file.write(line + "\n")
+
+    def _wait(self, duration: float) -> None:
+        if self.speed > 0:
+            time.sleep(duration / self.speed)
+
+    @staticmethod
+    def _request_key(method: str, path: str, params: Dict[str, Any] | None) -> str:
+        query = urlencode(
+            sorted(
+                (key, str(value))
+                for key, value in (params or {}).items()
+                if key not in SECRET_PARAMS
+            )
+        )
+        return f"{method} {path.lstrip('/')}?{query}"
+
+    def record_wc(
+        self,
+        *,
+        method: str,
+        path: str,
+        params: Dict[str, Any] | None,
+        started: float,
+        response: requests.Response | None = None,
+        error: requests.exceptions.RequestException | None = None,
+    ) -> None:
+        """Write woocommerce exchange, the body is read here,
+        so streamed responses are served from memory afterwards
+
+        Args:
+            method (str): http method
+            path (str): api path
+            params (Dict[str, Any] | None): query params
+            started (float): monotonic time of the request start
+            response (requests.Response | None, optional): response.
+                Defaults to None.
+            error (requests.exceptions.RequestException | None, optional):
+                network error instead of response. Defaults to None.
+        """
+        exchange: Dict[str, Any] = {
+            "kind": "wc",
+            "key": self._request_key(method, path, params),
+            "method": method,
+            "path": path.lstrip("/"),
+        }
+        if response is not None:
+            exchange.update(
+                {
+                    "status": response.status_code,
+                    "headers": {
+                        header: response.headers[header]
+                        for header in RECORDED_HEADERS
+                        if header in response.headers
+                    },
+                    "body": response.content.decode("utf-8", errors="replace"),
+                }
+            )
+        else:
+            exchange["error"] = type(error).__name__
+        exchange["duration"] = round(time.monotonic() - started, 4)
+        self._write(exchange)
+
+    def replay_wc(
+        self, *, method: str, path: str, params: Dict[str, Any] | None
+    ) -> requests.Response:
+        """Serve woocommerce response from the cassette
+
+        The same request is answered in the recorded order,
+        requests with other params (e.g. batches of generated coupons)
+        are answered by the next exchange of the endpoint
+
+        Raises:
+            CassetteMiss: there are no more exchanges of the endpoint
+            requests.exceptions.RequestException: recorded network error
+
+        Returns:
+            requests.Response: recorded response
+        """
+        key = self._request_key(method, path, params)
+        with self.lock:
+            exchanges = self.wc_exchanges.get(key)
+            if not exchanges:
+                endpoint = key.split("?", 1)[0] + "?"
+                exchanges = next(
+                    (
+                        queue
+                        for queue_key, queue in self.wc_exchanges.items()
+                        if queue and queue_key.startswith(endpoint)
+                    ),
+                    None,
+                )
+            if not exchanges:
+                raise CassetteMiss(f"{key} is not recorded")
+            exchange = exchanges.popleft()
+        self._wait(exchange["duration"])
+        if "error" in exchange:
+            error_class = getattr(
+                requests.exceptions,
+                exchange["error"],
+                requests.exceptions.ConnectionError,
+            )
+            raise error_class(f"Recorded {exchange['error']}: {key}")
+        response = requests.Response()
+        response.status_code = exchange["status"]
+        response.headers = CaseInsensitiveDict(exchange["headers"])
+        response.encoding = "utf-8"
+        response._content = exchange["body"].encode("utf-8")
+        # iter_content serves a consumed body from _content instead of raw
+        setattr(response, "_content_consumed", True)
+        response.url = f"cassette:///{exchange['path']}"
+        response.reason = ""
+        return response
+
+    def record_smtp(
+        self,
+        *,
+        recipients: int,
+        size: int,
+        started: float,
+        error: Exception | None = None,
+    ) -> None:
+        """Write smtp send, message content isn't kept
+
+        Args:
+            recipients (int): recipients count
+            size (int): message size
+            started (float): monotonic time of the send start
+            error (Exception | None, optional): smtp or network error.
+                Defaults to None.
+        """
+        exchange: Dict[str, Any] = {
+            "kind": "smtp",
+            "recipients": recipients,
+            "size": size,
+            "duration": round(time.monotonic() - started, 4),
+        }
+        if error is not None:
+            exchange["error"] = str(error)
+            exchange["error_type"] = type(error).__name__
+            if isinstance(error, smtplib.SMTPResponseException):
+                exchange["code"] = error.smtp_code
+        self._write(exchange)
+
+    def replay_smtp(self) -> None:
+        """Wait for the next recorded smtp send
+
+        Raises:
+            smtplib.SMTPException: recorded send error
+            OSError: recorded network error
+        """
+        with self.lock:
+            exchange = self.smtp_exchanges.popleft() if self.smtp_exchanges else None
+        if exchange is None:
+            return
+        self._wait(exchange["duration"])
+        if "error" not in exchange:
+            return
+        if "code" in exchange:
+            raise smtplib.SMTPResponseException(exchange["code"], exchange["error"])
+        error_class = getattr(
+            smtplib,
+            exchange.get("error_type", ""),
+            getattr(builtins, exchange.get("error_type", ""), smtplib.SMTPException),
+        )
+        if not (
+            isinstance(error_class, type)
+            and issubclass(error_class, (smtplib.SMTPException, OSError))
+        ):
+            error_class = smtplib.SMTPException
+        raise error_class(exchange["error"])
+
+
+cassette: Cassette = Cassette()
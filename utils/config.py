@@ -1,16 +1,20 @@
 from functools import lru_cache
-from typing import List
+from typing import Dict, List
 
-from pydantic import BaseSettings
+from dotenv import load_dotenv
+from pydantic import BaseModel, BaseSettings
+
+ENV_FILE: str = ".env"
 
 
 class TelegramSettrings(BaseSettings):
     bot_token: str
     users_id: List[str]
     proxy: str = ""
+    api_url: str = "https://api.telegram.org"
 
     class Config:
-        env_file = ".env"
+        env_file = ENV_FILE
         env_file_encoding = "utf-8"
         env_prefix = "TELEGRAM_"
 
@@ -21,41 +25,186 @@ class WoocommerceSettings(BaseSettings):
     url: str
     debug_email: str = "dimk00z@gmail.com"
     redundant_phrase: str = " (материалы для преподавателей)"
+    orders_per_page: int = 100
+    products_cache_path: str = "cache/products.json"
+    products_cache_ttl: int = 24 * 60 * 60  # 1 day
+    download_dirs: List[str] = []
+    files_catalog_path: str = "cache/files.json"
+    orders_cursor_path: str = "cache/orders_cursor.json"
+    full_sync_interval: int = 6 * 60 * 60  # 6 hours
+    pool_size: int = 10
+    connect_timeout: float = 5.0
+    read_timeout: float = 30.0
+    close_batch_size: int = 10
+    close_flush_interval: float = 60.0
 
     class Config:
-        env_file = ".env"
+        env_file = ENV_FILE
         env_file_encoding = "utf-8"
         env_prefix = "WC_"
 
 
+class SmtpRateLimit(BaseModel):
+    messages_per_minute: float
+    bytes_per_hour: int
+    burst_size: int
+
+
+DEFAULT_SMTP_RATE_LIMIT = SmtpRateLimit(
+    messages_per_minute=10,
+    bytes_per_hour=500 * 1024 * 1024,
+    burst_size=5,
+)
+
+
 class EmailSettings(BaseSettings):
     sender: str
     password: str
     display_name: str
     smtp_server: str = "smtp.yandex.ru"
     smtp_port: int = 465
-    max_attachment_size: int = 20 * 1024 * 1024  # 20MB
+    smtp_ssl: bool = True
+    max_attachment_size: int = 20 * 1024 * 1024  # 20MB, encoded message size
+    smtp_timeout: float = 60.0
+    messages_per_connection: int = 20
+    attachments_cache_dir: str = "cache/attachments"
+    rate_limits: Dict[str, SmtpRateLimit] = {
+        "smtp.yandex.ru": SmtpRateLimit(
+            messages_per_minute=6,
+            bytes_per_hour=300 * 1024 * 1024,
+            burst_size=3,
+        ),
+        "smtp.gmail.com": SmtpRateLimit(
+            messages_per_minute=10,
+            bytes_per_hour=1024 * 1024 * 1024,
+            burst_size=5,
+        ),
+    }
 
     class Config:
-        env_file = ".env"
+        env_file = ENV_FILE
         env_file_encoding = "utf-8"
         env_prefix = "EMAIL_"
 
+    @property
+    def rate_limit(self) -> SmtpRateLimit:
+        return self.rate_limits.get(self.smtp_server, DEFAULT_SMTP_RATE_LIMIT)
+
+
+class CouponSettings(BaseSettings):
+    pool_size: int = 0  # pre-generated coupons per discount tier, 0 - disabled
+    pool_path: str = "cache/coupons_pool.json"
+    pool_max_age_days: int = 1
+
+    class Config:
+        env_file = ENV_FILE
+        env_file_encoding = "utf-8"
+        env_prefix = "COUPON_"
+
+
+class LinkSettings(BaseSettings):
+    threshold: int = 5 * 1024 * 1024  # files from 5MB are sent by link
+    static_dir: str = "static/files"
+    base_url: str = ""  # public url of DAEMON files_path, empty - disabled
+    secret: str = ""
+    ttl_days: int = 14
+
+    class Config:
+        env_file = ENV_FILE
+        env_file_encoding = "utf-8"
+        env_prefix = "LINK_"
+
+
+class PipelineSettings(BaseSettings):
+    queue_size: int = 10
+    prepare_workers: int = 4
+    send_workers: int = 1
+    close_workers: int = 2
+
+    class Config:
+        env_file = ENV_FILE
+        env_file_encoding = "utf-8"
+        env_prefix = "PIPELINE_"
+
+
+class WorkerSettings(BaseSettings):
+    workers: int = 2
+    queue_path: str = "cache/work_queue.sqlite3"
+    lease_seconds: float = 5 * 60
+    claim_size: int = 5
+    max_attempts: int = 5  # then a failing order is given up by worker runs
+
+    class Config:
+        env_file = ENV_FILE
+        env_file_encoding = "utf-8"
+        env_prefix = "WORKER_"
+
+
+class ResilienceSettings(BaseSettings):
+    run_deadline: float = 25 * 60  # a cron run ends before the next one, 0 - none
+    attempts: int = 3
+    base_delay: float = 0.5
+    max_delay: float = 10.0
+    failure_threshold: int = 5  # consecutive failures to open a circuit
+    reset_timeout: float = 60.0
+
+    class Config:
+        env_file = ENV_FILE
+        env_file_encoding = "utf-8"
+        env_prefix = "RESILIENCE_"
+
+
+class DaemonSettings(BaseSettings):
+    host: str = "127.0.0.1"
+    port: int = 8080
+    webhook_path: str = "/webhook"
+    metrics_path: str = "/metrics"
+    files_path: str = "/files"
+    webhook_secret: str = ""
+    max_webhook_size: int = 1024 * 1024  # order payloads are a few KB
+    poll_interval: int = 30 * 60  # 30 minutes
+
+    class Config:
+        env_file = ENV_FILE
+        env_file_encoding = "utf-8"
+        env_prefix = "DAEMON_"
+
 
 class AppSettings(BaseSettings):
     debug: bool = False
-    telegram_settings: TelegramSettrings = TelegramSettrings()
-    woocommerce_settings: WoocommerceSettings = WoocommerceSettings()
-    email_settings: EmailSettings = EmailSettings()
+    journal_path: str = "cache/journal.sqlite3"
+    metrics_path: str = "cache/metrics.prom"
+    telegram_settings: TelegramSettrings
+    woocommerce_settings: WoocommerceSettings
+    email_settings: EmailSettings
+    pipeline_settings: PipelineSettings
+    coupon_settings: CouponSettings
+    daemon_settings: DaemonSettings
+    link_settings: LinkSettings
+    worker_settings: WorkerSettings
+    resilience_settings: ResilienceSettings
 
     class Config:
-        env_file = ".env"
+        env_file = ENV_FILE
         env_file_encoding = "utf-8"
 
 
 @lru_cache()
 def get_settings():
-    settings: AppSettings = AppSettings()
+    # .env is read once into the environment instead of by every settings class
+    load_dotenv(ENV_FILE, encoding="utf-8")
+    settings: AppSettings = AppSettings(
+        _env_file=None,
+        telegram_settings=TelegramSettrings(_env_file=None),
+        woocommerce_settings=WoocommerceSettings(_env_file=None),
+        email_settings=EmailSettings(_env_file=None),
+        pipeline_settings=PipelineSettings(_env_file=None),
+        coupon_settings=CouponSettings(_env_file=None),
+        daemon_settings=DaemonSettings(_env_file=None),
+        link_settings=LinkSettings(_env_file=None),
+        worker_settings=WorkerSettings(_env_file=None),
+        resilience_settings=ResilienceSettings(_env_file=None),
+    )
     settings.woocommerce_settings.url = (
         f"{settings.woocommerce_settings.url}/wp-json/wc/v3"
     )
@@ -0,0 +1,90 @@
+import json
+from typing import Any, Iterable, Iterator
+
+WHITESPACE: str = " \t\n\r"
+CLOSING: str = '}]"'
+
+_decoder: json.JSONDecoder = json.JSONDecoder()
+
+
+class JsonStreamError(ValueError):
+    pass
+
+
+def iter_json_array(chunks: Iterable[str]) -> Iterator[Any]:
+    """Decode items of a top-level JSON array as its text comes
+
+    Only the current item and an unparsed tail are kept in memory,
+    so a page of orders is never loaded as a whole
+
+    Args:
+        chunks (Iterable[str]): decoded text chunks, e.g. response.iter_content
+
+    Raises:
+        JsonStreamError: text is not a JSON array or is truncated
+
+    Yields:
+        Any: array items
+    """
+    chunks = iter(chunks)
+    buffer: str = ""
+    position: int = 0
+    is_exhausted: bool = False
+
+    def read(min_size: int = 1) -> bool:
+        """Append chunks until the buffer grows by min_size chars"""
+        nonlocal buffer, position, is_exhausted
+        buffer = buffer[position:]
+        position = 0
+        grown = 0
+        for chunk in chunks:
+            buffer += chunk
+            grown += len(chunk)
+            if grown >= min_size:
+                return True
+        is_exhausted = True
+        return grown > 0
+
+    def skip_whitespace() -> bool:
+        """Move to the next significant char, False at the end of text"""
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position] in WHITESPACE:
+                position += 1
+            if position < len(buffer):
+                return True
+            if is_exhausted or not read():
+                return False
+
+    if not skip_whitespace() or buffer[position] != "[":
+        raise JsonStreamError("JSON array is expected")
+    position += 1
+    is_first: bool = True
+    while True:
+        if not skip_whitespace():
+            raise JsonStreamError("JSON array is truncated")
+        if buffer[position] == "]":
+            return
+        if not is_first:
+            if buffer[position] != ",":
+                raise JsonStreamError(f"',' is expected at {position}")
+            position += 1
+            if not skip_whitespace():
+                raise JsonStreamError("JSON array is truncated")
+        is_first = False
+        while True:
+            try:
+                item, end = _decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                end = -1
+            # a number or a literal at the end of the buffer could be cut by the chunk
+            if end != -1 and (
+                end < len(buffer) or is_exhausted or buffer[end - 1] in CLOSING
+            ):
+                break
+            if is_exhausted:
+                raise JsonStreamError("JSON array item is broken or truncated")
+            # double the buffer, so a large item isn't decoded again on every chunk
+            read(len(buffer) - position)
+        position = end
+        yield item
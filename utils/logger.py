@@ -1,62 +1,221 @@
 import logging.config
 import sys
+from queue import Empty, Full, Queue
+from threading import Thread
+from time import monotonic, sleep
+from typing import Any, Dict, List, Tuple
 
-import telebot
+from utils.config import TelegramSettrings
+from utils.telegram import (
+    MESSAGE_LIMIT,
+    TELEGRAM_API_URL,
+    TelegramClient,
+    TelegramError,
+    split_message,
+)
 
-from utils.config import TelegramSettrings, get_settings
+RecordKey = Tuple[int, str, int, str]
 
 
 class TelegramHandler(logging.Handler):
-    """Telegram logger
+    """Non-blocking telegram logger
+
+    Records are queued and shipped by a background thread.
+    Same records coming within `coalesce_interval` are sent once
+    with a repeats count, queued records are batched into messages
+    up to telegram limit and every chat gets at most one message
+    per `chat_interval`. Queue is flushed on close
 
     Args:
         logging (_type_): _description_
     """
 
-    def __init__(self, telegram_bot_token, telegram_users):
+    def __init__(
+        self,
+        telegram_bot_token,
+        telegram_users,
+        api_url: str = TELEGRAM_API_URL,
+        proxy: str = "",
+        coalesce_interval: float = 5.0,
+        chat_interval: float = 1.0,
+        queue_size: int = 1000,
+        close_timeout: float = 10.0,
+    ):
         logging.Handler.__init__(self)
-        self.telegram_bot_token = telegram_bot_token
-        self.telegram_users = telegram_users
+        self.telegram_users: List[str] = [user for user in telegram_users if user]
+        self.client: TelegramClient = TelegramClient(
+            bot_token=telegram_bot_token, api_url=api_url, proxy=proxy
+        )
+        self.coalesce_interval: float = coalesce_interval
+        self.chat_interval: float = chat_interval
+        self.close_timeout: float = close_timeout
+        self.queue: Queue[Tuple[RecordKey, str] | None] = Queue(maxsize=queue_size)
+        self.dropped: int = 0
+        self.next_send_at: Dict[str, float] = {}
+        self.thread: Thread = Thread(
+            target=self._ship_forever, name="telegram-logger", daemon=True
+        )
+        self.thread.start()
+
+    @staticmethod
+    def _record_key(record: logging.LogRecord) -> RecordKey:
+        return (record.levelno, record.pathname, record.lineno, record.getMessage())
 
     def emit(self, record):
-        message = self.format(record)
-        bot = telebot.TeleBot(self.telegram_bot_token)
-        for user in self.telegram_users:
-            if user:
-                bot.send_message(user, message)
+        try:
+            self.queue.put_nowait((self._record_key(record), self.format(record)))
+        except Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def _collect(self) -> Tuple[Dict[RecordKey, Tuple[str, int]], bool]:
+        """Wait for records and collect everything coming in coalesce window
+
+        Returns:
+            Tuple[Dict[RecordKey, Tuple[str, int]], bool]: first text and
+                repeats of every record, True if handler is closed
+        """
+        records: Dict[RecordKey, Tuple[str, int]] = {}
+        item = self.queue.get()
+        deadline = monotonic() + self.coalesce_interval
+        while item is not None:
+            key, text = item
+            first_text, repeats = records.get(key, (text, 0))
+            records[key] = (first_text, repeats + 1)
+            timeout = deadline - monotonic()
+            if timeout <= 0:
+                return records, False
+            try:
+                item = self.queue.get(timeout=timeout)
+            except Empty:
+                return records, False
+        return records, True
+
+    def _pack(self, records: Dict[RecordKey, Tuple[str, int]]) -> List[str]:
+        texts: List[str] = [
+            f"{text}\n(повторов: {repeats})" if repeats > 1 else text
+            for text, repeats in records.values()
+        ]
+        if self.dropped:
+            texts.append(f"Пропущено записей: {self.dropped}")
+            self.dropped = 0
+        messages: List[str] = []
+        for text in texts:
+            if messages and len(messages[-1]) + 2 + len(text) <= MESSAGE_LIMIT:
+                messages[-1] = f"{messages[-1]}\n\n{text}"
+                continue
+            messages.extend(split_message(text))
+        return messages
+
+    def _send(self, chat_id: str, text: str) -> None:
+        for attempt in range(2):
+            delay = self.next_send_at.get(chat_id, 0.0) - monotonic()
+            if delay > 0:
+                sleep(delay)
+            self.next_send_at[chat_id] = monotonic() + self.chat_interval
+            try:
+                self.client.send_message(chat_id=chat_id, text=text)
+                return
+            except TelegramError as ex:
+                if attempt or not ex.retry_after:
+                    raise
+                self.next_send_at[chat_id] = monotonic() + ex.retry_after
+
+    def _ship_forever(self) -> None:
+        is_closed = False
+        while not is_closed:
+            records, is_closed = self._collect()
+            for message in self._pack(records):
+                for chat_id in self.telegram_users:
+                    try:
+                        self._send(chat_id, message)
+                    except Exception as ex:
+                        self._report_error(ex)
+
+    @staticmethod
+    def _report_error(error: Exception) -> None:
+        # app logger can't be used here, it leads back to this handler
+        if logging.lastResort is None:
+            return
+        logging.lastResort.handle(
+            logging.makeLogRecord(
+                {
+                    "name": "telegram-logger",
+                    "levelno": logging.ERROR,
+                    "levelname": logging.getLevelName(logging.ERROR),
+                    "msg": "Telegram log is not sent: %s",
+                    "args": (error,),
+                }
+            )
+        )
+
+    def close(self):
+        """Flush queued records and stop the sender thread"""
+        if self.thread.is_alive():
+            try:
+                self.queue.put(None, timeout=self.close_timeout)
+            except Full:
+                pass
+            self.thread.join(self.close_timeout)
+        self.client.close()
+        logging.Handler.close(self)
 
 
 format_string = (
     "{asctime} - {levelname} - {name} - {module}:{funcName}:{lineno}- {message}"
 )
 
-telegram_params: TelegramSettrings = get_settings().telegram_settings
-logger_config = {
-    "version": 1,
-    "disable_existing_loggers": False,
-    "formatters": {"std_formatter": {"format": format_string, "style": "{"}},
-    "handlers": {
-        "telegram_handler": {
-            "()": TelegramHandler,
-            "formatter": "std_formatter",
-            "telegram_bot_token": telegram_params.bot_token,
-            "telegram_users": telegram_params.users_id,
+
+def get_logger_config(telegram_params: TelegramSettrings) -> Dict[str, Any]:
+    """Logging dict config
+
+    Args:
+        telegram_params (TelegramSettrings): telegram settings for log shipping
+
+    Returns:
+        Dict[str, Any]: config for logging.config.dictConfig
+    """
+    return {
+        "version": 1,
+        "disable_existing_loggers": False,
+        "formatters": {"std_formatter": {"format": format_string, "style": "{"}},
+        "handlers": {
+            "telegram_handler": {
+                "()": TelegramHandler,
+                # admins get problems only, progress stays in stdout
+                "level": "WARNING",
+                "formatter": "std_formatter",
+                "telegram_bot_token": telegram_params.bot_token,
+                "telegram_users": telegram_params.users_id,
+                "api_url": telegram_params.api_url,
+                "proxy": telegram_params.proxy,
+            },
+            "console_stdout": {
+                "class": "logging.StreamHandler",
+                "level": "DEBUG",
+                "formatter": "std_formatter",
+                "stream": sys.stdout,
+            },
         },
-        "console_stdout": {
-            "class": "logging.StreamHandler",
-            "level": "DEBUG",
-            "formatter": "std_formatter",
-            "stream": sys.stdout,
+        "loggers": {
+            "app_logger": {
+                "level": "DEBUG",
+                "handlers": [
+                    "telegram_handler",
+                    "console_stdout",
+                ],
+                "propagate": False,
+            },
+            "webhook.access": {
+                "level": "DEBUG",
+                "handlers": ["console_stdout"],
+                "propagate": False,
+            },
+            "resilience.telegram": {
+                "level": "DEBUG",
+                "handlers": ["console_stdout"],
+                "propagate": False,
+            },
         },
-    },
-    "loggers": {
-        "app_logger": {
-            "level": "DEBUG",
-            "handlers": [
-                "telegram_handler",
-                "console_stdout",
-            ],
-            "propagate": False,
-        }
-    },
-}
+    }
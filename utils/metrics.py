@@ -0,0 +1,260 @@
+import os
+import tempfile
+from bisect import bisect_left
+from contextlib import contextmanager
+from copy import deepcopy
+from functools import wraps
+from threading import Lock
+from time import perf_counter
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple, TypeVar
+
+T = TypeVar("T")
+Labels = Tuple[Tuple[str, str], ...]
+
+PREFIX: str = "woo_sender"
+LATENCY_BUCKETS: Tuple[float, ...] = (
+    0.005,
+    0.01,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+METRICS_HELP: Dict[str, str] = {
+    "stage_seconds": "Wall time of a stage call",
+    "errors_total": "Failed stage calls",
+    "retries_total": "Retried stage calls",
+    "bytes_total": "Bytes received from woocommerce or sent by smtp and telegram",
+}
+# stages shown in the telegram report
+STAGE_TITLES: Dict[str, str] = {
+    "fetch_orders": "заказы",
+    "coupon_upload": "купоны",
+    "send_email": "письма",
+    "close_orders": "закрытие",
+}
+
+
+class Histogram:
+    """Cumulative histogram with fixed buckets"""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self.buckets: Tuple[float, ...] = buckets
+        self.counts: List[int] = [0] * (len(buckets) + 1)
+        self.sum: float = 0.0
+        self.count: int = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> Iterator[Tuple[str, int]]:
+        total = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            yield ("+Inf" if bound == float("inf") else repr(bound)), total
+
+
+class MetricsRegistry:
+    """Thread safe counters and histograms of the process
+
+    Rendered in prometheus text format, written to a file after
+    a run and served on /metrics in daemon mode"""
+
+    def __init__(self, prefix: str = PREFIX) -> None:
+        self.prefix: str = prefix
+        self.lock: Lock = Lock()
+        self.counters: Dict[str, Dict[Labels, float]] = {}
+        self.histograms: Dict[str, Dict[Labels, Histogram]] = {}
+
+    @staticmethod
+    def _labels(labels: Dict[str, str]) -> Labels:
+        return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+    def inc(self, name: str, amount: float = 1, **labels: str) -> None:
+        """Increase counter
+
+        Args:
+            name (str): counter name without prefix
+            amount (float, optional): Defaults to 1.
+        """
+        key = self._labels(labels)
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        """Add histogram observation
+
+        Args:
+            name (str): histogram name without prefix
+            value (float): observed value
+        """
+        key = self._labels(labels)
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = Histogram()
+            series[key].observe(value)
+
+    @contextmanager
+    def timer(self, stage: str) -> Iterator[None]:
+        """Measure stage call, raised exceptions are counted as errors
+
+        Args:
+            stage (str): stage name
+        """
+        started = perf_counter()
+        try:
+            yield
+        except Exception:
+            self.inc("errors_total", stage=stage)
+            raise
+        finally:
+            self.observe("stage_seconds", perf_counter() - started, stage=stage)
+
+    def timed(self, stage: str) -> Callable[[Callable[..., T]], Callable[..., T]]:
+        """Decorator version of `timer`"""
+
+        def decorator(func: Callable[..., T]) -> Callable[..., T]:
+            @wraps(func)
+            def wrapper(*args, **kwargs) -> T:
+                with self.timer(stage):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def iter_timed(self, stage: str, items: Iterable[T]) -> Iterator[T]:
+        """Yield items measuring only the time spent to produce each of them,
+        consumer work between items is not counted
+
+        Args:
+            stage (str): stage name
+            items (Iterable[T]): lazy items, e.g. fetched pages
+        """
+        iterator = iter(items)
+        while True:
+            with self.timer(stage):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Picklable copy of all series, e.g. to pass from a worker process"""
+        with self.lock:
+            return deepcopy({"counters": self.counters, "histograms": self.histograms})
+
+    def merge(self, snapshot: Dict[str, Any]) -> None:
+        """Add series of another registry snapshot
+
+        Args:
+            snapshot (Dict[str, Any]): `snapshot` result
+        """
+        with self.lock:
+            for name, counter_series in snapshot["counters"].items():
+                own_counters = self.counters.setdefault(name, {})
+                for labels, value in counter_series.items():
+                    own_counters[labels] = own_counters.get(labels, 0) + value
+            for name, histogram_series in snapshot["histograms"].items():
+                own_histograms = self.histograms.setdefault(name, {})
+                for labels, histogram in histogram_series.items():
+                    own = own_histograms.setdefault(
+                        labels, Histogram(histogram.buckets)
+                    )
+                    own.counts = [a + b for a, b in zip(own.counts, histogram.counts)]
+                    own.sum += histogram.sum
+                    own.count += histogram.count
+
+    def stage_seconds(self) -> Dict[str, float]:
+        """Total seconds by stage"""
+        with self.lock:
+            return {
+                dict(labels).get("stage", ""): histogram.sum
+                for labels, histogram in self.histograms.get(
+                    "stage_seconds", {}
+                ).items()
+            }
+
+    def format_timings(self, since: Dict[str, float] | None = None) -> str:
+        """Short timing breakdown for the telegram report
+
+        Args:
+            since (Dict[str, float] | None, optional): `stage_seconds` snapshot
+                taken at start, so a long-running process reports
+                only the last cycle. Defaults to None.
+
+        Returns:
+            str: breakdown line, empty if nothing is measured
+        """
+        since = since or {}
+        totals = self.stage_seconds()
+        parts: List[str] = [
+            f"{title} {totals[stage] - since.get(stage, 0.0):.1f} с"
+            for stage, title in STAGE_TITLES.items()
+            if totals.get(stage, 0.0) - since.get(stage, 0.0) > 0
+        ]
+        return f"Время: {', '.join(parts)}" if parts else ""
+
+    def _series_name(self, name: str, labels: Labels, suffix: str = "") -> str:
+        if not labels:
+            return f"{self.prefix}_{name}{suffix}"
+        labels_text = ",".join(f'{key}="{value}"' for key, value in labels)
+        return f"{self.prefix}_{name}{suffix}{{{labels_text}}}"
+
+    def render(self) -> str:
+        """Render metrics in prometheus text format"""
+        lines: List[str] = []
+        with self.lock:
+            for name, counter_series in sorted(self.counters.items()):
+                lines.append(
+                    f"# HELP {self.prefix}_{name} {METRICS_HELP.get(name, name)}"
+                )
+                lines.append(f"# TYPE {self.prefix}_{name} counter")
+                for labels, value in sorted(counter_series.items()):
+                    lines.append(f"{self._series_name(name, labels)} {value:.15g}")
+            for name, histogram_series in sorted(self.histograms.items()):
+                lines.append(
+                    f"# HELP {self.prefix}_{name} {METRICS_HELP.get(name, name)}"
+                )
+                lines.append(f"# TYPE {self.prefix}_{name} histogram")
+                for labels, histogram in sorted(histogram_series.items()):
+                    for bound, count in histogram.cumulative():
+                        lines.append(
+                            f"{self._series_name(name, labels + (('le', bound),), '_bucket')} {count}"
+                        )
+                    lines.append(
+                        f"{self._series_name(name, labels, '_sum')} {histogram.sum:.6f}"
+                    )
+                    lines.append(
+                        f"{self._series_name(name, labels, '_count')} {histogram.count}"
+                    )
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str) -> None:
+        """Atomically write metrics file, e.g. for node exporter textfile collector
+
+        Args:
+            path (str): metrics file path
+        """
+        directory = os.path.dirname(path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        # mkstemp creates 0600 files, the collector runs as another user
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+
+
+metrics = MetricsRegistry()
@@ -0,0 +1,285 @@
+"""Deadline, retries and circuit breakers of outbound calls
+
+Every call to WooCommerce, SMTP and Telegram goes through `resilience.call`:
+its timeout is cut to the run deadline, transient errors are retried
+with full jitter exponential delays, and consecutive failures open
+the dependency circuit. While the circuit is open calls fail at once
+with CircuitOpenError, so the run stops instead of waiting for every order.
+"""
+
+import logging
+import random
+from dataclasses import dataclass
+from threading import Lock
+from time import monotonic, sleep
+from typing import Callable, Dict, TypeVar
+
+from utils.config import ResilienceSettings
+from utils.metrics import metrics
+
+T = TypeVar("T")
+
+CLOSED: str = "closed"
+OPEN: str = "open"
+HALF_OPEN: str = "half_open"
+
+logger = logging.getLogger("app_logger")
+# telegram calls come from the telegram log handler, their failures
+# logged to app_logger would be shipped by the same failing handler
+telegram_logger = logging.getLogger("resilience.telegram")
+
+
+def _logger(name: str) -> logging.Logger:
+    return telegram_logger if name == "telegram" else logger
+
+
+class ResilienceError(Exception):
+    """Dependency can't be called for the rest of the run"""
+
+
+class DeadlineExceeded(ResilienceError):
+    pass
+
+
+class CircuitOpenError(ResilienceError):
+    def __init__(self, name: str, retry_in: float) -> None:
+        super().__init__(f"{name} is unavailable, next try in {retry_in:.0f} s")
+        self.name: str = name
+        self.retry_in: float = retry_in
+
+
+class Deadline:
+    """Time budget of a run, None - unlimited"""
+
+    def __init__(self, seconds: float | None = None) -> None:
+        self.expires_at: float | None = monotonic() + seconds if seconds else None
+
+    def remaining(self) -> float:
+        if self.expires_at is None:
+            return float("inf")
+        return max(0.0, self.expires_at - monotonic())
+
+    def timeout(self, timeout: float) -> float:
+        """Timeout of a call which ends before the deadline
+
+        Args:
+            timeout (float): call timeout
+
+        Raises:
+            DeadlineExceeded: run has no time left
+
+        Returns:
+            float: timeout cut to the remaining time
+        """
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded("Run deadline is exceeded")
+        return min(timeout, remaining)
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures,
+    after `reset_timeout` one trial call is let through:
+    success closes the circuit, failure opens it again"""
+
+    def __init__(
+        self, *, name: str, failure_threshold: int, reset_timeout: float
+    ) -> None:
+        self.name: str = name
+        self.failure_threshold: int = failure_threshold
+        self.reset_timeout: float = reset_timeout
+        self.state: str = CLOSED
+        self.failures: int = 0
+        self.opened_at: float = 0.0
+        self.lock: Lock = Lock()
+
+    def before_call(self) -> None:
+        """Check if call is allowed
+
+        Raises:
+            CircuitOpenError: circuit is open or the trial call is running
+        """
+        with self.lock:
+            if self.state == CLOSED:
+                return
+            retry_in = self.opened_at + self.reset_timeout - monotonic()
+            if self.state == OPEN and retry_in <= 0:
+                self.state = HALF_OPEN
+                return
+            raise CircuitOpenError(self.name, max(0.0, retry_in))
+
+    def record_success(self) -> None:
+        with self.lock:
+            self.state = CLOSED
+            self.failures = 0
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    metrics.inc("circuit_opened_total", dependency=self.name)
+                    _logger(self.name).error(
+                        "%s circuit is open after %s failures", self.name, self.failures
+                    )
+                self.state = OPEN
+                self.opened_at = monotonic()
+
+
+@dataclass(frozen=True, slots=True)
+class RetryPolicy:
+    attempts: int = 3
+    base_delay: float = 0.5
+    max_delay: float = 10.0
+
+    def delay(self, attempt: int) -> float:
+        """Full jitter delay, retries of parallel calls don't come together"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+
+class Resilience:
+    """Process wide guard of outbound calls, one breaker per dependency"""
+
+    def __init__(self) -> None:
+        self.deadline: Deadline = Deadline()
+        self.policy: RetryPolicy = RetryPolicy()
+        self.failure_threshold: int = 5
+        self.reset_timeout: float = 60.0
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.lock: Lock = Lock()
+
+    def configure(
+        self,
+        *,
+        policy: RetryPolicy,
+        failure_threshold: int,
+        reset_timeout: float,
+        deadline: float | None = None,
+    ) -> None:
+        """Set retries and breakers, start the run deadline
+
+        Args:
+            policy (RetryPolicy): retries of transient errors
+            failure_threshold (int): consecutive failures to open a circuit
+            reset_timeout (float): seconds before a trial call
+            deadline (float | None, optional): run time budget, seconds.
+                Defaults to None - unlimited.
+        """
+        self.policy = policy
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.deadline = Deadline(deadline)
+        with self.lock:
+            self.breakers = {}
+
+    def breaker(self, name: str) -> CircuitBreaker:
+        with self.lock:
+            if name not in self.breakers:
+                self.breakers[name] = CircuitBreaker(
+                    name=name,
+                    failure_threshold=self.failure_threshold,
+                    reset_timeout=self.reset_timeout,
+                )
+            return self.breakers[name]
+
+    def call(
+        self,
+        name: str,
+        func: Callable[[float], T],
+        *,
+        timeout: float,
+        is_transient: Callable[[Exception], bool],
+        is_failed: Callable[[T], bool] | None = None,
+        use_deadline: bool = True,
+    ) -> T:
+        """Call dependency with retries
+
+        Args:
+            name (str): dependency, also the retries metric stage
+            func (Callable[[float], T]): call taking its timeout
+            timeout (float): call timeout
+            is_transient (Callable[[Exception], bool]): errors to retry,
+                other errors are raised at once and don't open the circuit
+            is_failed (Callable[[T], bool] | None, optional): results to retry,
+                e.g. 5xx responses, the last one is returned. Failed results
+                are closed before retries. Defaults to None.
+            use_deadline (bool, optional): cut the timeout to the run deadline.
+                Defaults to True.
+
+        Raises:
+            DeadlineExceeded: run has no time left
+            CircuitOpenError: dependency circuit is open
+
+        Returns:
+            T: call result
+        """
+        breaker = self.breaker(name)
+        attempt: int = 0
+        while True:
+            call_timeout = self.deadline.timeout(timeout) if use_deadline else timeout
+            breaker.before_call()
+            try:
+                result = func(call_timeout)
+            except Exception as ex:
+                if not is_transient(ex):
+                    breaker.record_success()
+                    raise
+                breaker.record_failure()
+                if not self._wait_retry(breaker, attempt, use_deadline):
+                    raise
+                _logger(name).warning("%s call is failed, retry: %s", name, ex)
+                attempt += 1
+                continue
+            if is_failed is None or not is_failed(result):
+                breaker.record_success()
+                return result
+            breaker.record_failure()
+            if not self._wait_retry(breaker, attempt, use_deadline):
+                return result
+            close = getattr(result, "close", None)
+            if close is not None:
+                close()
+            attempt += 1
+
+    def _wait_retry(
+        self, breaker: CircuitBreaker, attempt: int, use_deadline: bool
+    ) -> bool:
+        """Sleep before the next attempt
+
+        Returns:
+            bool: False if there are no attempts or time left,
+                or the circuit is open
+        """
+        if attempt + 1 >= self.policy.attempts or breaker.state == OPEN:
+            return False
+        delay = self.policy.delay(attempt)
+        if use_deadline and delay >= self.deadline.remaining():
+            return False
+        metrics.inc("retries_total", stage=breaker.name)
+        sleep(delay)
+        return True
+
+
+resilience: Resilience = Resilience()
+
+
+def configure_resilience(
+    *, settings: ResilienceSettings, deadline: float | None = None
+) -> None:
+    """Configure the process guard from settings
+
+    Args:
+        settings (ResilienceSettings): retries and breakers settings
+        deadline (float | None, optional): run time budget, seconds.
+            Defaults to None - unlimited, e.g. for the daemon.
+    """
+    resilience.configure(
+        policy=RetryPolicy(
+            attempts=max(1, settings.attempts),
+            base_delay=settings.base_delay,
+            max_delay=settings.max_delay,
+        ),
+        failure_threshold=settings.failure_threshold,
+        reset_timeout=settings.reset_timeout,
+        deadline=deadline,
+    )
@@ -0,0 +1,117 @@
+from typing import Any, Dict, List, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils.resilience import resilience
+
+TELEGRAM_API_URL: str = "https://api.telegram.org"
+MESSAGE_LIMIT: int = 4096
+
+
+class TelegramError(Exception):
+    """Telegram bot api error
+
+    Args:
+        description (str): error description from telegram
+        retry_after (float, optional): seconds to wait on 429. Defaults to 0.
+    """
+
+    def __init__(self, description: str, retry_after: float = 0.0) -> None:
+        super().__init__(description)
+        self.retry_after: float = retry_after
+
+
+class TelegramClient:
+    """Minimal telegram bot api client over one pooled session"""
+
+    def __init__(
+        self,
+        *,
+        bot_token: str,
+        api_url: str = TELEGRAM_API_URL,
+        proxy: str = "",
+        pool_size: int = 10,
+        timeout: Tuple[float, float] = (5.0, 30.0),
+    ) -> None:
+        self.base_url: str = f"{api_url.rstrip('/')}/bot{bot_token}"
+        self.timeout: Tuple[float, float] = timeout
+        self.session: requests.Session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        if proxy:
+            self.session.proxies = {"http": proxy, "https": proxy}
+
+    def send_message(self, *, chat_id: str, text: str) -> Dict[str, Any]:
+        """Send text message
+
+        Args:
+            chat_id (str): user or chat id
+            text (str): message up to MESSAGE_LIMIT characters
+
+        Raises:
+            TelegramError: telegram rejected the message
+            CircuitOpenError: telegram is unavailable
+
+        Returns:
+            Dict[str, Any]: sent message
+        """
+        connect_timeout, read_timeout = self.timeout
+        # the report is sent after the run deadline as well
+        r = resilience.call(
+            "telegram",
+            lambda timeout: self.session.post(
+                f"{self.base_url}/sendMessage",
+                json={"chat_id": chat_id, "text": text},
+                timeout=(connect_timeout, timeout),
+            ),
+            timeout=read_timeout,
+            is_transient=lambda error: isinstance(
+                error,
+                (requests.exceptions.ConnectionError, requests.exceptions.Timeout),
+            ),
+            use_deadline=False,
+        )
+        try:
+            payload: Dict[str, Any] = r.json()
+        except ValueError:
+            raise TelegramError(f"Bad telegram response {r.status_code}")
+        if not payload.get("ok"):
+            raise TelegramError(
+                payload.get("description", f"Telegram error {r.status_code}"),
+                retry_after=payload.get("parameters", {}).get("retry_after", 0),
+            )
+        return payload["result"]
+
+    def close(self) -> None:
+        self.session.close()
+
+
+def split_message(text: str, limit: int = MESSAGE_LIMIT) -> List[str]:
+    """Split text into messages by lines, too long lines are cut
+
+    Args:
+        text (str): text of any length
+        limit (int, optional): message limit. Defaults to MESSAGE_LIMIT.
+
+    Returns:
+        List[str]: messages
+    """
+    chunks: List[str] = []
+    current: str = ""
+    for line in text.split("\n"):
+        while len(line) > limit:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(line[:limit])
+            line = line[limit:]
+        if current and len(current) + 1 + len(line) > limit:
+            chunks.append(current)
+            current = line
+        else:
+            current = f"{current}\n{line}" if current else line
+    if current:
+        chunks.append(current)
+    return chunks
@@ -0,0 +1,38 @@
+import os
+from threading import Lock
+from typing import Dict, Tuple
+
+from jinja2 import Template
+
+
+class TemplateRegistry:
+    """Compiled jinja2 templates cache
+
+    Template is compiled once per process and recompiled
+    only when its file modification time is changed"""
+
+    def __init__(self) -> None:
+        self.templates: Dict[str, Tuple[int, Template]] = {}
+        self.lock: Lock = Lock()
+
+    def get(self, path: str) -> Template:
+        """Get compiled template
+
+        Args:
+            path (str): template file path
+
+        Returns:
+            Template: compiled template
+        """
+        mtime = os.stat(path).st_mtime_ns
+        with self.lock:
+            cached = self.templates.get(path)
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+            with open(path, "rb") as f:
+                template = Template(f.read().decode("UTF-8"))
+            self.templates[path] = (mtime, template)
+            return template
+
+
+template_registry = TemplateRegistry()